@@ -1,8 +1,13 @@
 import time
+from typing import Optional
 
 from PySide6.QtCore import QThread, Signal
 
-from algo.algo_brain import start_search
+from algo.astar import ANYTIME_TIME_BUDGET
+from algo.cancellation import COMPLETED, CANCELLED, TIMED_OUT
+from algo.grid_map import route_length
+from algo.parallel import search_backend, ALL_ALGORITHMS, INFEASIBLE
+from algo.progress import RouteImprovement
 from airway_genius_gui.globals import AlgoType
 
 
@@ -10,7 +15,14 @@ class CalculationThread(QThread):
     finished_signal = Signal(float)
     result_signal = Signal(list)
     error_signal = Signal(str, str)
-    all_signal = Signal(int, float, int, float, int, float, int, float)
+    all_signal = Signal(float, float, float, float, float, float, float, float)
+    # algorithm name, path length, time and status of each algorithm of the "All" modes as soon as it finishes
+    algorithm_finished_signal = Signal(str, float, float, str)
+    # algorithm name, expanded nodes, frontier size, best f-value and distance to the end of a running search
+    progress_signal = Signal(str, int, int, float, int)
+    # algorithm name, path length and suboptimality bound of each better route of an anytime search,
+    # the route itself is drawn through result_signal
+    improvement_signal = Signal(str, float, float)
 
     def __init__(self,
                  max_fuel: int,
@@ -22,7 +34,8 @@ class CalculationThread(QThread):
                  start_pos: tuple[int, int],
                  end_pos: tuple[int, int],
                  map_size: tuple[int, int],
-                 bounding_box_offset: tuple[int, int]):
+                 bounding_box_offset: tuple[int, int],
+                 anytime_budget: Optional[float] = ANYTIME_TIME_BUDGET):
         super().__init__()
         self.max_fuel = max_fuel
         self.fuel_cost = fuel_cost
@@ -34,6 +47,8 @@ class CalculationThread(QThread):
         self.end_pos = end_pos
         self.map_size = map_size
         self.bounding_box_offset = bounding_box_offset
+        # seconds the anytime search keeps improving its route once it has one
+        self.anytime_budget = anytime_budget
 
     def run(self):
         # apply bounding box offset to all coordinates in the input data
@@ -49,57 +64,106 @@ class CalculationThread(QThread):
         start_time = time.time()
 
         forbidden_area_set = set(self.forbidden_area_coords_list)
-        # call algorithm in backend
-        if self.cur_algorithm != AlgoType.ALL and self.cur_algorithm != AlgoType.ALL_WITHOUT_DFS:
-            path = start_search(self.max_fuel,
-                                self.fuel_cost,
-                                self.cur_algorithm,
-                                forbidden_area_set,
-                                self.carrier_airport_list,
-                                self.tanker_list,
-                                self.start_pos,
-                                self.end_pos,
-                                self.map_size)
-            end_time = time.time()
-            if path == [-1]:
-                self.error_signal.emit("Recursion Error", "DFS algorithm has reached maximum recursion depth")
-                self.finished_signal.emit(end_time - start_time)
-                return
-            elif path is None:
-                path = []
-            print(path)
-            # apply bounding box offset to all coordinates in the path
-            path = [(pos[0] + self.bounding_box_offset[0], pos[1] + self.bounding_box_offset[1]) for pos in path]
-            self.finished_signal.emit(end_time - start_time)
-            self.result_signal.emit(path)
+        if self.cur_algorithm == AlgoType.ALL:
+            algorithms = ALL_ALGORITHMS
+        elif self.cur_algorithm == AlgoType.ALL_WITHOUT_DFS:
+            algorithms = tuple(algorithm for algorithm in ALL_ALGORITHMS if algorithm != AlgoType.DFS)
         else:
-            dij, astar, bfs, dfs = start_search(self.max_fuel,
-                                                self.fuel_cost,
-                                                self.cur_algorithm,
-                                                forbidden_area_set,
-                                                self.carrier_airport_list,
-                                                self.tanker_list,
-                                                self.start_pos,
-                                                self.end_pos,
-                                                self.map_size)
-            end_time = time.time()
-            self.finished_signal.emit(end_time - start_time)
-            dij_path = [(pos[0] + self.bounding_box_offset[0], pos[1] + self.bounding_box_offset[1]) for pos in dij[0]]
-            astar_path = [(pos[0] + self.bounding_box_offset[0], pos[1] + self.bounding_box_offset[1]) for pos in astar[0]]
-            bfs_path = [(pos[0] + self.bounding_box_offset[0], pos[1] + self.bounding_box_offset[1]) for pos in bfs[0]]
-            lengths = [len(dij_path), len(astar_path), len(bfs_path)]
-            self.result_signal.emit(dij_path)
-            self.result_signal.emit(astar_path)
-            self.result_signal.emit(bfs_path)
-            dfs_path = dfs[0]
-            if dfs_path == [-1]:
-                self.error_signal.emit("Recursion Error", "DFS algorithm has reached maximum recursion depth")
-                lengths.append(-1)
-            elif dfs_path == [-2]:
+            algorithms = (self.cur_algorithm,)
+        # call algorithm in backend, the algorithms run in parallel in worker processes
+        results = {}
+        improved_paths = {}
+        completed = search_backend.run(self.max_fuel,
+                                       self.fuel_cost,
+                                       algorithms,
+                                       forbidden_area_set,
+                                       self.carrier_airport_list,
+                                       self.tanker_list,
+                                       self.start_pos,
+                                       self.end_pos,
+                                       self.map_size,
+                                       lambda *result: self.handle_result(results, improved_paths, *result),
+                                       on_progress=lambda algorithm, progress: self.progress_signal.emit(
+                                           algorithm.value, progress.expanded, progress.frontier, progress.best_f,
+                                           progress.goal_distance),
+                                       on_improvement=lambda *improvement: self.handle_improvement(
+                                           results, improved_paths, *improvement),
+                                       anytime_budget=self.anytime_budget)
+        if not completed:
+            print("calculation cancelled")
+            return
+        if self.cur_algorithm != AlgoType.ALL and self.cur_algorithm != AlgoType.ALL_WITHOUT_DFS:
+            return
+
+        end_time = time.time()
+        self.finished_signal.emit(end_time - start_time)
+        # -2 for not launched, -3 for timed out, -4 for failed, the reason code of algo.feasibility for rejected queries
+        lengths = []
+        times = []
+        for algorithm in ALL_ALGORITHMS:
+            path, search_time, status = results.get(algorithm, ([], 0, None))
+            if status is None:
                 lengths.append(-2)
+            elif status == COMPLETED:
+                lengths.append(route_length(path))
+            elif status == TIMED_OUT:
+                lengths.append(-3)
+            elif status == INFEASIBLE:
+                lengths.append(path[0])
             else:
-                dfs_path = [(pos[0] + self.bounding_box_offset[0], pos[1] + self.bounding_box_offset[1]) for pos in dfs_path]
-                self.result_signal.emit(dfs_path)
-                lengths.append(len(dfs_path))
-            self.all_signal.emit(lengths[0], dij[1], lengths[1], astar[1], lengths[2], bfs[1], lengths[3], dfs[1])
+                lengths.append(-4)
+            times.append(search_time)
+        self.all_signal.emit(lengths[0], times[0], lengths[1], times[1], lengths[2], times[2], lengths[3], times[3])
+
+    def handle_improvement(self, results: dict, improved_paths: dict, algorithm: AlgoType,
+                           improvement: RouteImprovement):
+        """
+        Draw each better route of an anytime search as soon as it is found.
+        """
+        if algorithm in results:
+            # the final result is already there
+            return
+        path = [(pos[0] + self.bounding_box_offset[0], pos[1] + self.bounding_box_offset[1])
+                for pos in improvement.path]
+        improved_paths[algorithm] = path
+        self.result_signal.emit(path)
+        self.improvement_signal.emit(algorithm.value, route_length(path), improvement.bound)
+
+    def handle_result(self, results: dict, improved_paths: dict, algorithm: AlgoType, path: list, search_time: float,
+                      status: str, partial_path: list):
+        """
+        Forward the result of one algorithm to the GUI as soon as it finishes.
+        """
+        if status == INFEASIBLE:
+            # the path is the reason code, the graphics view shows it
+            results[algorithm] = (path, search_time, status)
+            if self.cur_algorithm != AlgoType.ALL and self.cur_algorithm != AlgoType.ALL_WITHOUT_DFS:
+                self.result_signal.emit(path)
+            return
+        if path is None:
+            path = []
+        # apply bounding box offset to all coordinates in the path
+        path = [(pos[0] + self.bounding_box_offset[0], pos[1] + self.bounding_box_offset[1]) for pos in path]
+        results[algorithm] = (path, search_time, status)
+        if self.cur_algorithm != AlgoType.ALL and self.cur_algorithm != AlgoType.ALL_WITHOUT_DFS:
+            if status == COMPLETED:
+                # a repeated scenario is answered by the route cache, the time is the one of the original search
+                self.finished_signal.emit(search_time)
+                if path != improved_paths.get(algorithm):
+                    self.result_signal.emit(path)
+            elif status == TIMED_OUT:
+                self.error_signal.emit("Search Timeout",
+                                       f"{algorithm.value} didn't finish in {search_time:.0f} s, the best partial "
+                                       f"route covers {round(route_length(partial_path) * 8.47, 2)} km.")
+            elif status != CANCELLED:
+                self.error_signal.emit("Search Error", f"{algorithm.value} failed, see the console for details.")
+            return
+        if status == COMPLETED and path:
+            self.result_signal.emit(path)
+        self.algorithm_finished_signal.emit(algorithm.value, route_length(path), search_time, status)
 
+    def stop(self):
+        """
+        Ask the searches to stop, the thread then returns by itself within a few milliseconds.
+        """
+        search_backend.cancel()
@@ -37,10 +37,22 @@ class AlgoType(Enum):
     Enum class for algorithm
     """
     BFS = 'BFS'
+    BFS_WAVEFRONT = 'BFS(Wavefront)'
     DFS = 'DFS(may be slow)'
     ASTAR = 'A*'
+    ASTAR_GOAL_TABLE = 'A*(Obstacle-Aware)'
+    ASTAR_ANYTIME = 'A*(Anytime)'
+    ASTAR_FUEL_AWARE = 'A*(Fuel-Aware)'
+    ASTAR_LANDMARKS = 'A*(Landmarks)'
     DIJKSTRA = 'Dijkstra'
     ADVANCED_DIJKSTRA = 'Dijkstra(Visually-Optimized)'
+    STATION_GRAPH = 'Station Graph'
+    JPS = 'Jump Point Search'
+    JPS_DIAGONAL = 'Jump Point Search(8-Connected)'
+    BIDIRECTIONAL = 'Bidirectional'
+    INCREMENTAL = 'Incremental(LPA*)'
+    HIERARCHICAL = 'Hierarchical(HPA*)'
+    CONTRACTION = 'Contraction Hierarchy'
     ALL_WITHOUT_DFS = 'All(without DFS)'
     ALL = 'All(may be slow)'
     # reinforcement learning has difficulty in implementation, the code can be check in algo/rl directory
@@ -4,6 +4,9 @@ from airway_genius_gui.connector import CalculationThread
 from airway_genius_gui.globals import MarkerType, set_cur_marker_type, GUI_DIR, MapType, AlgoType, get_bounding_box, \
     OtherColor
 from airway_genius_gui.scalable_graphics_view import ScalableGraphicsView
+from algo.astar import ANYTIME_TIME_BUDGET
+from algo.cancellation import COMPLETED, CANCELLED, TIMED_OUT
+from algo.feasibility import REASON_MESSAGES
 
 from PySide6.QtCore import (QCoreApplication, QMetaObject, Qt, QThread, Signal)
 from PySide6.QtGui import (QBrush, QColor, QIcon, QPalette)
@@ -25,6 +28,8 @@ class UiMainWindow(object):
 
     def __init__(self):
         self.is_input_able = True  # a flag to indicate whether the input(button click, input box, etc.) is able
+        self.search_distance = 0  # Manhattan distance between the start and end positions of the running search
+        self.closest_distances = {}  # closest distance to the end position reached by each running algorithm
 
     def setup_ui(self, main_window):
         if not main_window.objectName():
@@ -208,6 +213,26 @@ class UiMainWindow(object):
         self.vertical_layout.addWidget(self.fuel_cost_label)
         self.vertical_layout.addLayout(self.horizontal_layout_6)
 
+        # how long the anytime search keeps improving its route once it has one
+        self.anytime_budget_spin_box = CompactDoubleSpinBox(self.central_widget)
+        self.anytime_budget_spin_box.setObjectName(u"anytime_budget_spin_box")
+        self.horizontal_layout_7 = QHBoxLayout()
+        min_anytime_budget = 0
+        max_anytime_budget = 30
+        self.anytime_budget_spin_box.setMinimum(min_anytime_budget)
+        self.anytime_budget_spin_box.setMaximum(max_anytime_budget)
+        self.anytime_budget_spin_box.setValue(ANYTIME_TIME_BUDGET)
+        self.unit_label_3 = BodyLabel("s")
+
+        with open(f"{GUI_DIR}/src/fighter_jet_setting_spin_box.qss", "r") as f:
+            self.anytime_budget_spin_box.setStyleSheet(f.read())
+
+        self.anytime_budget_label = CaptionLabel(f"Anytime Budget [{min_anytime_budget}.00, {max_anytime_budget}.00]")
+        self.horizontal_layout_7.addWidget(self.anytime_budget_spin_box)
+        self.horizontal_layout_7.addWidget(self.unit_label_3)
+        self.vertical_layout.addWidget(self.anytime_budget_label)
+        self.vertical_layout.addLayout(self.horizontal_layout_7)
+
         # -----------------Clear Map Button-----------------
         self.clear_map_push_button = PushButton(self.central_widget)
         self.clear_map_push_button.setObjectName(u"clear_map_push_button")
@@ -498,14 +523,11 @@ class UiMainWindow(object):
         :param data: the data collected from the main window
         """
         if data[2] == AlgoType.DFS or data[2] == AlgoType.ALL:
-            # remind that DFS algorithm may cause stack overflow, if user still choose DFS algorithm, then continue
+            # remind that DFS algorithm may be slow, if user still choose DFS algorithm, then continue
             warning = MessageBox("<p style=\"color:red;\">WARNING</p>",
-                                 "The DFS algorithm here uses recursion strategy and may cause stack over flow! "
-                                 "Especially when the distance is long! "
-                                 "The recursion limit has been set to 2500 to prevent the program from crashing. "
-                                 "However, it may still cause the program to crash and report a error message like "
-                                 "\'Process finished with exit code -1073741571 (0xC00000FD)\' "
-                                 "due to your computer's hardware and runtime settings.\n"
+                                 "The DFS algorithm here uses branch and bound strategy and may be much slower "
+                                 "than the other algorithms! "
+                                 "Especially when the distance is long or there are many forbidden areas!\n"
                                  "Are you sure to launch it?",
                                  self.central_widget)
             if warning.exec():
@@ -513,7 +535,7 @@ class UiMainWindow(object):
             else:
                 return
         self.sub_thread = CalculationThread(data[0], data[1], data[2], data[3], data[4], data[5], data[6], data[7],
-                                            data[8], data[9])
+                                            data[8], data[9], self.anytime_budget_spin_box.value())
         self.sub_thread.started.connect(self.switch_disable_input_state)
         self.sub_thread.started.connect(self.enable_indeterminate_progress_bar)
         self.sub_thread.finished.connect(self.disable_indeterminate_progress_bar)
@@ -521,18 +543,26 @@ class UiMainWindow(object):
         self.sub_thread.finished.connect(self.switch_disable_input_state)
         self.sub_thread.finished_signal.connect(self.handle_running_time)
         self.sub_thread.finished_signal.connect(lambda: self.stop_push_button.setEnabled(False))
+        self.sub_thread.finished.connect(lambda: self.stop_push_button.setEnabled(False))
         self.sub_thread.result_signal.connect(self.graphics_view.draw_path)
+        self.sub_thread.algorithm_finished_signal.connect(self.handle_algorithm_finished)
         self.sub_thread.all_signal.connect(self.compare_all_algorithms)
         self.sub_thread.error_signal.connect(self.error_message)
+        self.sub_thread.progress_signal.connect(self.handle_search_progress)
+        self.sub_thread.improvement_signal.connect(self.handle_route_improvement)
+        self.sub_thread.finished.connect(self.reset_search_progress)
 
+        # the progress of a search is how much closer than the start position its closest label is to the end
+        self.search_distance = abs(data[6][0] - data[7][0]) + abs(data[6][1] - data[7][1])
+        self.closest_distances = {}
         self.stop_push_button.setEnabled(True)
         self.sub_thread.start()
 
     def terminate_calculation(self):
         """
-        Terminate the calculation thread.
+        Stop the calculation, the searches stop cooperatively and the calculation thread returns by itself.
         """
-        self.sub_thread.terminate()
+        self.sub_thread.stop()
         self.stop_push_button.setEnabled(False)
 
     def switch_disable_input_state(self):
@@ -552,6 +582,7 @@ class UiMainWindow(object):
             self.clear_map_push_button.setEnabled(False)
             self.max_fuel_spin_box.setEnabled(False)
             self.fuel_cost_spin_box.setEnabled(False)
+            self.anytime_budget_spin_box.setEnabled(False)
             self.start_pos_transparent_tool_button.setEnabled(False)
             self.end_pos_transparent_tool_button.setEnabled(False)
         else:
@@ -567,6 +598,7 @@ class UiMainWindow(object):
             self.clear_map_push_button.setEnabled(True)
             self.max_fuel_spin_box.setEnabled(True)
             self.fuel_cost_spin_box.setEnabled(True)
+            self.anytime_budget_spin_box.setEnabled(True)
             self.start_pos_transparent_tool_button.setEnabled(True)
             self.end_pos_transparent_tool_button.setEnabled(True)
 
@@ -576,6 +608,42 @@ class UiMainWindow(object):
     def disable_indeterminate_progress_bar(self):
         self.indeterminate_progress_bar.stop()
 
+    def handle_search_progress(self, algorithm_name: str, expanded: int, frontier: int, best_f: float,
+                               goal_distance: int):
+        """
+        Show the progress of the running searches, the bar follows the algorithm that is the furthest behind.
+        """
+        if goal_distance < 0 or self.search_distance == 0:
+            return
+        closest = min(goal_distance, self.closest_distances.get(algorithm_name, goal_distance))
+        self.closest_distances[algorithm_name] = closest
+        value = int(100 * (1 - max(self.closest_distances.values()) / self.search_distance))
+        if self.progress_bar.isHidden():
+            self.indeterminate_progress_bar.hide()
+            self.progress_bar.show()
+        self.progress_bar.setValue(max(value, 0))
+        best = "-" if best_f < 0 else f"{best_f:.0f}"
+        self.progress_bar.setToolTip(f"{algorithm_name}: {expanded} nodes expanded, {frontier} in the frontier, "
+                                     f"best f = {best}, {round(closest * 8.47, 2)} km from the destination")
+
+    def handle_route_improvement(self, algorithm_name: str, path_length: float, bound: float):
+        """
+        Handle a better route found by an anytime search, the route itself is drawn by the graphics view.
+        """
+        self.success_message(f'{algorithm_name} Algorithm',
+                             f"Route improved: length = {round(path_length * 8.47, 2)} km, "
+                             f"at most {(bound - 1) * 100:.1f}% longer than the shortest", 3000)
+
+    def reset_search_progress(self):
+        """
+        Hide the progress bar of the searches and bring back the indeterminate one.
+        """
+        self.closest_distances = {}
+        self.progress_bar.setValue(0)
+        self.progress_bar.setToolTip("")
+        self.progress_bar.hide()
+        self.indeterminate_progress_bar.show()
+
     def handle_running_time(self, running_time: float):
         """
         Handle the running time of the calculation thread.
@@ -584,6 +652,18 @@ class UiMainWindow(object):
         self.success_message(f'{self.algorithm_combo_box.currentText()} Algorithm',
                              f"Search Finished! Time Cost: {running_time:.2f} s", 5000)
 
+    def handle_algorithm_finished(self, algorithm_name: str, path_length: float, running_time: float, status: str):
+        """
+        Handle the result of one algorithm of the "All" modes as soon as it finishes.
+        """
+        if status == COMPLETED:
+            self.success_message(f'{algorithm_name} Algorithm',
+                                 f"length = {round(path_length * 8.47, 2)} km, time = {running_time:.2f} s", 5000)
+        elif status == TIMED_OUT:
+            self.error_message(f'{algorithm_name} Algorithm', f"Timed out after {running_time:.0f} s", 5000)
+        elif status != CANCELLED:
+            self.error_message(f'{algorithm_name} Algorithm', "Failed, see the console for details", 5000)
+
     def handle_collecting_time(self, collecting_time: float):
         """
         Handle the collecting time of the data collector thread.
@@ -665,28 +745,33 @@ class UiMainWindow(object):
         self.end_pos_coord_label.setText("undefined")
 
     def compare_all_algorithms(self,
-                               dij_len: int,
+                               dij_len: float,
                                dij_time: float,
-                               astar_len: int,
+                               astar_len: float,
                                astar_time: float,
-                               bfs_len: int,
+                               bfs_len: float,
                                bfs_time: float,
-                               dfs_len: int,
+                               dfs_len: float,
                                dfs_time: float, ):
         """
         Compare the results of all algorithms.
         """
-        if dfs_len == -1:
-            dfs_message = "DFS: Recursion Error\n"
-        elif dfs_len == -2:
-            dfs_message = "DFS: Not launch\n"
-        else:
-            dfs_message = f"DFS: length = {round(dfs_len * 8.47, 2)} km, time = {dfs_time:.2f} s\n"
+        def describe(name: str, length: float, running_time: float) -> str:
+            if length == -2:
+                return f"{name}: Not launch\n"
+            elif length == -3:
+                return f"{name}: Timed out after {running_time:.0f} s\n"
+            elif length == -4:
+                return f"{name}: Failed\n"
+            elif length in REASON_MESSAGES:
+                return f"{name}: {REASON_MESSAGES[length]}\n"
+            return f"{name}: length = {round(length * 8.47, 2)} km, time = {running_time:.2f} s\n"
+
         result = MessageBox("<p>Running Result</p>",
                             "The result of BFS, DFS, A* and Dijkstra algorithms are as follows:\n"
-                            f"BFS: length = {round(bfs_len * 8.47, 2)} km, time = {bfs_time:.2f} s\n"
-                            f"A*: length = {round(astar_len * 8.47, 2)} km, time = {astar_time:.2f} s\n"
-                            f"Dijkstra: length = {round(dij_len * 8.47, 2)} km, time = {dij_time:.2f} s\n"
-                            f"{dfs_message}",
+                            f"{describe('BFS', bfs_len, bfs_time)}"
+                            f"{describe('A*', astar_len, astar_time)}"
+                            f"{describe('Dijkstra', dij_len, dij_time)}"
+                            f"{describe('DFS', dfs_len, dfs_time)}",
                             self.central_widget)
         result.exec()
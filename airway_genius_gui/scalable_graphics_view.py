@@ -7,6 +7,8 @@ from PySide6.QtGui import QColor, QPixmap, QPolygonF, QPainter, QPainterPath, QP
     QTransform
 
 from airway_genius_gui.globals import GUI_DIR, MapType, OtherColor
+from algo.feasibility import REASON_MESSAGES
+from algo.grid_map import route_length
 
 
 class ScalableGraphicsView(QGraphicsView):
@@ -34,6 +36,7 @@ class ScalableGraphicsView(QGraphicsView):
         self.current_polygon = QPolygonF()
         self.current_polygon_item = None
         self.polygons = {}
+        self.polygon_coords = {}  # the rasterized pixels of each finished polygon, reused by every search
         self.markers = []
         self.marker_radius = 3
         self.changeable = True
@@ -173,6 +176,7 @@ class ScalableGraphicsView(QGraphicsView):
             if self.polygons:
                 self.scene().removeItem(polygon)
                 self.polygons.pop(polygon)
+                self.polygon_coords.pop(polygon, None)
                 print("remove polygon, current polygons:", len(self.polygons))
 
     def change_map(self, map_type: MapType):
@@ -189,6 +193,7 @@ class ScalableGraphicsView(QGraphicsView):
     def __clear_scene(self):
         self.scene().clear()
         self.polygons.clear()
+        self.polygon_coords.clear()
         self.markers.clear()
         self.paths.clear()
         self.current_polygon = QPolygonF()
@@ -246,16 +251,22 @@ class ScalableGraphicsView(QGraphicsView):
     def get_polygon_contain_coord_list(self):
         # traverse all the polygons and get the coordinates that are contained in the polygons
         polygon_contain_coord_list = set()
-        for polygon in self.polygons.values():
-            polygon: QPolygonF
-            bounding_rect = polygon.boundingRect()
-            for x in range(int(bounding_rect.x()), int(bounding_rect.x() + bounding_rect.width())):
-                for y in range(int(bounding_rect.y()), int(bounding_rect.y() + bounding_rect.height())):
-                    if self.__point_in_polygon(x, y, polygon):
-                        polygon_contain_coord_list.add((x, y))
+        for polygon_item, polygon in self.polygons.items():
+            if polygon_item not in self.polygon_coords:
+                self.polygon_coords[polygon_item] = self.__rasterize_polygon(polygon)
+            polygon_contain_coord_list.update(self.polygon_coords[polygon_item])
         # print("polygon_contain_coord_list:", polygon_contain_coord_list)
         return list(polygon_contain_coord_list)
 
+    def __rasterize_polygon(self, polygon: QPolygonF) -> list[tuple[int, int]]:
+        coords = []
+        bounding_rect = polygon.boundingRect()
+        for x in range(int(bounding_rect.x()), int(bounding_rect.x() + bounding_rect.width())):
+            for y in range(int(bounding_rect.y()), int(bounding_rect.y() + bounding_rect.height())):
+                if self.__point_in_polygon(x, y, polygon):
+                    coords.append((x, y))
+        return coords
+
     def __point_in_polygon(self, x, y, polygon: QPolygonF):
         if x < 0 or y < 0 or x >= self.map_img.width() or y >= self.map_img.height():
             return False
@@ -290,8 +301,12 @@ class ScalableGraphicsView(QGraphicsView):
         if path_len == 0:
             self.error_signal.emit("Invalid Search Result", "No path found!")
             return
+        elif path_len == 1 and points[0] in REASON_MESSAGES:
+            # the query was rejected before searching, the only element is the reason code
+            self.error_signal.emit("Invalid Search Result", f"No path found! {REASON_MESSAGES[points[0]]}")
+            return
         else:
-            self.success_signal.emit("Path found", f"Total distance: {round(path_len * 8.47, 2)}km", 5000)
+            self.success_signal.emit("Path found", f"Total distance: {round(route_length(points) * 8.47, 2)}km", 5000)
         self.points = points
         self.path = QPainterPath()
         # if the point is out of the map
@@ -1,193 +1,149 @@
 
-import heapq
-import random
+from array import array
+from typing import Optional
 
+from algo.cancellation import CancellationToken, CHECK_MASK
+from algo.grid_map import GridMap
+from algo.heuristics import goal_distance_table
+from algo.priority_queue import RadixHeap
+from algo.workspace import search_workspace
 
-class Node:
-    def __init__(self, node_type=0):
-        self.node_type = node_type
-        self.visited = 0
+# direction of the move that reached a label, NO_DIRECTION for the start label
+NO_DIRECTION = 4
 
-    def __str__(self):
-        return f"({self.node_type}, {self.visited})"
 
-    __repr__ = __str__
-
-def init_map(map_size, forbidden=None, carrier_airport=None, tanker=None):
-    if forbidden is None:
-        forbidden = []
-    if carrier_airport is None:
-        carrier_airport = []
-    if tanker is None:
-        tanker = []
-
-    map_grid = []
-    forbidden_set = set(forbidden)
-    carrier_set = set(carrier_airport)
-    tanker_set = set(tanker)
+# Advanced Dijkstra Search Algorithm (with refueling stations)
+def advanced_dijkstra_search(map_grid: GridMap, start_pos, end_pos, fuel_cost, max_fuel,
+                             token: Optional[CancellationToken] = None):
+    """
+    Visually optimized Dijkstra: among the shortest fuel-feasible routes, the one with the fewest turns.
+    A single search runs over (cell, direction, remaining fuel) labels with the lexicographic cost
+    (distance, turns), packed in one integer as distance * turn_scale + turns. turn_scale is larger than any turn
+    count, so the distance is never traded for fewer turns. The labels are popped by the packed cost plus the
+    obstacle-aware goal distance times turn_scale: the heuristic is consistent and is the same for every label of a
+    cell, so the first label popped at the end position is still the lexicographic optimum, and the search stays
+    as small as an A* run. A label is kept only if no label popped before at the same cell and direction has at
+    least as much fuel, and the radix heap breaks ties the same way on every run, so the route is the same too.
+    A label is also dominated by a label of the same cell in any direction with at least as much fuel and a strictly
+    smaller cost, since one turn costs a single unit.
+    :param map_grid: the grid map
+    :param start_pos: the start position
+    :param end_pos: the end position
+    :param fuel_cost: the fuel cost per pixel
+    :param max_fuel: the fuel capacity, refilled at carriers, airports and tankers
+    :param token: stops the search when cancelled or past its deadline
+    :return: the path from start_pos to end_pos, or an empty list if no path found
+    """
+    start = map_grid.index(start_pos)
+    end = map_grid.index(end_pos)
+    refuel = map_grid.refuel
+    blocked = map_grid.blocked
+    width, height = map_grid.map_size
+    offsets = (-height, height, -1, 1)
+    turn_scale = map_grid.size + 1
+    goal_distance = goal_distance_table(map_grid, end_pos)
+    if goal_distance[start] < 0:
+        return []
 
-    for i in range(map_size[0]):
-        row = []
-        for j in range(map_size[1]):
-            node_type = 0
-            if (i, j) in forbidden_set:
-                visited = 1
+    with search_workspace(map_grid) as workspace:
+        label_cell = array('l', [start])
+        label_direction = array('b', [NO_DIRECTION])
+        label_cost = array('q', [0])
+        label_fuel = array('l', [max_fuel])
+        label_parent = array('l', [-1])
+        # the per-cell planes hold base + value, see SearchWorkspace
+        base = workspace.begin()
+        # most fuel left among the labels popped at each (cell, direction), the labels of a cell are popped in
+        # non-decreasing cost
+        popped_fuel = workspace.stamped('direction fuel', 5)
+        # most fuel left among the labels popped at each cell in any direction, and the cost of the first of them,
+        # only read where the fuel is stamped
+        cell_fuel = workspace.stamped('fuel')
+        cell_cost = workspace.plain('cost')
+        # last label generated at each cell, used to drop dominated labels before they reach the queue
+        generated = workspace.stamped('label')
+        generated[start] = base
+        # the priorities are popped in non-decreasing order but span distance * turn_scale, too many for a bucket each
+        priority_queue = RadixHeap(goal_distance[start] * turn_scale, 0)  # store the label by its packed priority
+
+        found = -1
+        popped = 0
+        while priority_queue:
+            popped += 1
+            if not popped & CHECK_MASK and token is not None:
+                head_priority, head_label = priority_queue.peek()
+                if token.checkpoint(popped, len(priority_queue), head_priority // turn_scale,
+                                    map_grid.manhattan(label_cell[head_label], end)):
+                    return token.stop(map_grid, label_cell, label_parent, end)
+            _, label = priority_queue.pop()
+            cost = label_cost[label]
+            current = label_cell[label]
+            direction = label_direction[label]
+            current_fuel = label_fuel[label]
+            if base + current_fuel <= cell_fuel[current]:
+                if cost > cell_cost[current]:
+                    continue
             else:
-                visited = 0
-                if (i, j) in carrier_set:
-                    node_type = 1
-                elif (i, j) in tanker_set:
-                    node_type = 2
-            node = Node(node_type)
-            node.visited = visited
-            row.append(node)
-        map_grid.append(row)
-    return map_grid
-
-
-def dijkstra_first_search(map_grid, start_pos, end_pos, fuel_cost, max_fuel):
-    size = len(map_grid)
-    distances = {(i, j): float('inf') for i in range(len(map_grid)) for j in range(len(map_grid[0]))}
-    distances[start_pos] = 0
-    previous_nodes = {start_pos: None}
-    # store the distance, position, and fuel remaining
-    priority_queue = [(0, start_pos, max_fuel)]
-    fuel_used = {(i, j): float('inf') for i in range(len(map_grid)) for j in range(len(map_grid[0]))}
-    # initialize the fuel used at the start position to 0
-    fuel_used[start_pos] = 0
-    # 4 directions: north, south, east, west
-    direction = [(0, 1), (0, -1), (1, 0), (-1, 0)]
-
-    while priority_queue:
-
-        current_distance, (current_x, current_y), current_fuel = heapq.heappop(priority_queue)
-
-        if map_grid[current_x][current_y].visited == 1:
-            continue
-
-        if current_fuel <= 0:
-            continue
-
-        if map_grid[current_x][current_y].node_type in [1, 2]:
-            current_fuel = max_fuel
-
-        if (current_x, current_y) == end_pos:
-            break
-
-
-        neighbors = [(current_x - 1, current_y), (current_x + 1, current_y), (current_x, current_y - 1),
-                     (current_x, current_y + 1)]
-
-        for (nx, ny) in neighbors:
-            if 0 <= nx < len(map_grid) and 0 <= ny < len(map_grid[0]) and map_grid[nx][ny].visited == 0:
-                if map_grid[nx][ny].node_type in [1, 2]:
-                    distance = current_distance + 1  # no random weight for refueling stations
-                else:
-                    distance = current_distance + 1
-                if distance < distances[(nx, ny)] or distance == distances[(nx, ny)] and current_fuel - fuel_cost > fuel_used[(nx, ny)]:
-                    distances[(nx, ny)] = distance
-                    fuel_needed = current_fuel - fuel_cost
-                    if fuel_needed >= 0:
-                        fuel_used[(nx, ny)] = fuel_needed
-                        previous_nodes[(nx, ny)] = (current_x, current_y)
-                        heapq.heappush(priority_queue, (distance, (nx, ny), fuel_needed))
-    # if the distance at the end position is infinity, return empty lists
-    if distances[end_pos] == float('infinity'):
-        return [], []
-
-    path = []
-    current_node = end_pos
-    while current_node is not None:
-        path.append(current_node)
-        current_node = previous_nodes[current_node]
-    path.reverse()
-
-    # Find all refueling stations in the path
-    refueling_stations = [node for node in path if map_grid[node[0]][node[1]].node_type in [1, 2]]
-
-    print("Dijkstra 1st finished" "path lenth: ", len(path))
-    return path, refueling_stations
-
-def dijkstra_second_search(map_grid, start_pos, end_pos, fuel_cost, max_fuel):
-    size = len(map_grid)
-    distances = {(i, j): float('inf') for i in range(len(map_grid)) for j in range(len(map_grid[0]))}
-    distances[start_pos] = 0
-    previous_nodes = {start_pos: None}
-    # store the distance, position, and fuel remaining
-    priority_queue = [(0, start_pos, max_fuel)]
-    fuel_used = {(i, j): float('inf') for i in range(len(map_grid)) for j in range(len(map_grid[0]))}
-    # initialize the fuel used at the start position to 0
-    fuel_used[start_pos] = 0
-    # 4 directions: north, south, east, west
-    direction = [(0, 1), (0, -1), (1, 0), (-1, 0)]
-
-    while priority_queue:
-
-        current_distance, (current_x, current_y), current_fuel = heapq.heappop(priority_queue)
-
-        if map_grid[current_x][current_y].visited == 1:
-            continue
-
-        if current_fuel <= 0:
-            continue
-
-        if map_grid[current_x][current_y].node_type in [1, 2]:
-            current_fuel = max_fuel
-
-        if (current_x, current_y) == end_pos:
-            break
-
-        neighbors = [(current_x - 1, current_y), (current_x + 1, current_y), (current_x, current_y - 1),
-                     (current_x, current_y + 1)]
-        for (nx, ny) in neighbors:
-            if 0 <= nx < len(map_grid) and 0 <= ny < len(map_grid[0]) and map_grid[nx][ny].visited == 0:
-                if map_grid[nx][ny].node_type in [1, 2]:
-                    distance = current_distance + 1  # no random weight for refueling stations
-                else:
-                    distance = current_distance + 1 + random.uniform(0, 0.00000000001)
-                if distance < distances[(nx, ny)] or distance == distances[(nx, ny)] and current_fuel - fuel_cost > fuel_used[(nx, ny)]:
-                    distances[(nx, ny)] = distance
-                    fuel_needed = current_fuel - fuel_cost
-                    if fuel_needed >= 0:
-                        fuel_used[(nx, ny)] = fuel_needed
-                        previous_nodes[(nx, ny)] = (current_x, current_y)
-                        heapq.heappush(priority_queue, (distance, (nx, ny), fuel_needed))
-
-    if distances[end_pos] == float('infinity'):
+                cell_fuel[current] = base + current_fuel
+                cell_cost[current] = cost
+            state = current * 5 + direction
+            if base + current_fuel <= popped_fuel[state]:
+                continue
+            popped_fuel[state] = base + current_fuel
+
+            if current == end:
+                found = label
+                break
+            if current_fuel < fuel_cost:
+                continue
+
+            x, y = divmod(current, height)
+            for new_direction, offset in enumerate(offsets):
+                # skip the neighbors out of the map
+                if new_direction == 0:
+                    if x == 0:
+                        continue
+                elif new_direction == 1:
+                    if x + 1 == width:
+                        continue
+                elif new_direction == 2:
+                    if y == 0:
+                        continue
+                elif y + 1 == height:
+                    continue
+                neighbor = current + offset
+                if blocked[neighbor] or goal_distance[neighbor] < 0:
+                    continue
+                new_fuel = max_fuel if refuel[neighbor] else current_fuel - fuel_cost
+                if base + new_fuel <= popped_fuel[neighbor * 5 + new_direction]:
+                    continue
+                new_cost = cost + turn_scale
+                if direction != new_direction and direction != NO_DIRECTION:
+                    new_cost += 1
+                if base + new_fuel <= cell_fuel[neighbor] and new_cost > cell_cost[neighbor]:
+                    continue
+                last = generated[neighbor] - base
+                if last >= 0 and label_fuel[last] >= new_fuel and \
+                        (label_cost[last] < new_cost or label_cost[last] == new_cost and
+                         label_direction[last] == new_direction):
+                    continue
+                generated[neighbor] = base + len(label_cell)
+                label_cell.append(neighbor)
+                label_cost.append(new_cost)
+                label_direction.append(new_direction)
+                label_fuel.append(new_fuel)
+                label_parent.append(label)
+                priority_queue.push(new_cost + goal_distance[neighbor] * turn_scale, len(label_cell) - 1)
+
+    # if the end position has never been reached, return an empty list
+    if found == -1:
         return []
 
     path = []
-    current_node = end_pos
-    while current_node is not None:
-        path.append(current_node)
-        current_node = previous_nodes[current_node]
+    while found != -1:
+        path.append(label_cell[found])
+        found = label_parent[found]
     path.reverse()
 
-    print("Dijkstra 2st finished" "path lenth: ", len(path))
-    return path
-
-# Advanced Dijkstra Search Algorithm (with refueling stations)
-def advanced_dijkstra_search(map_grid, start_pos, end_pos, fuel_cost, max_fuel):
-    # First search to find the path and refueling stations
-    first_path, refueling_stations = dijkstra_first_search(map_grid, start_pos, end_pos, fuel_cost, max_fuel)
-    if not first_path:
-        return []
-
-    # Second search to find the final path
-    final_path = [start_pos]
-
-    # Iterate through the refueling stations
-    for i in range(len(refueling_stations)):
-        if i == 0:
-            prev_station = start_pos
-        else:
-            prev_station = refueling_stations[i - 1]
-        current_station = refueling_stations[i]
-        # Path segment from the previous refueling station to the current refueling station
-        path_segment = dijkstra_second_search(map_grid, prev_station, current_station, fuel_cost, max_fuel)
-        final_path += path_segment[1:]
-    # Last path segment from the last refueling station to the end position
-    last_path_segment = dijkstra_second_search(map_grid, refueling_stations[-1], end_pos, fuel_cost, max_fuel)
-    final_path += last_path_segment[1:]
-
-    return final_path
+    print("Advanced Dijkstra finished" "path lenth: ", len(path), "labels: ", len(label_cell))
+    return map_grid.path_to_coords(path)
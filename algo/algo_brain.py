@@ -1,16 +1,32 @@
 import time
 
 from airway_genius_gui.globals import AlgoType
-from algo.advanced_dijkstra import advanced_dijkstra_search, init_map as advanced_dijkstra_init_map
-from algo.astar import astar
+from algo.advanced_dijkstra import advanced_dijkstra_search
+from algo.astar import astar, anytime_astar, fuel_aware_astar, ANYTIME_TIME_BUDGET
 from algo.bfs import BFS
+from algo.bidirectional import bidirectional_search
+from algo.cancellation import CancellationToken, COMPLETED
+from algo.contraction import contraction_search
 from algo.dfs import DFS
-from algo.dijkstra import dijkstra_search, init_map as dijkstra_init_map
+from algo.dijkstra import dijkstra_search
+from algo.feasibility import precheck, FEASIBLE, REASON_MESSAGES
+from algo.grid_map import GridMap
+from algo.heuristics import goal_distance_table
+from algo.hierarchical import hierarchical_search
+from algo.incremental import incremental_search
+from algo.jps import jps_search
+from algo.landmarks import landmark_heuristic_table
+from algo.route_cache import RouteCache, route_key
+from algo.station_graph import station_graph_search
+from algo.wavefront import wavefront_search
 # from algo.rl.train import rl
 from typing import Optional
 
 from env.environment import Env
 
+# results of the most recent searches, pressing Start again on the same scenario returns them at once
+route_cache = RouteCache()
+
 
 def start_search(max_fuel: int,
                  fuel_cost: int,
@@ -20,7 +36,87 @@ def start_search(max_fuel: int,
                  tanker_list: list[tuple[int, int]],
                  start_pos: tuple[int, int],
                  end_pos: tuple[int, int],
-                 map_size: tuple[int, int]) -> [list[tuple[int, int]], Optional[list[int]], Optional[list[list, float]]]:
+                 map_size: tuple[int, int],
+                 use_cache: bool = True,
+                 token: Optional[CancellationToken] = None,
+                 anytime_budget: Optional[float] = ANYTIME_TIME_BUDGET) -> [list[tuple[int, int]], Optional[list[int]], Optional[list[list, float]]]:
+    return timed_search(max_fuel, fuel_cost, cur_algorithm, forbidden_area, carrier_airport_list, tanker_list,
+                        start_pos, end_pos, map_size, use_cache, token, anytime_budget)[0]
+
+
+def timed_search(max_fuel: int,
+                 fuel_cost: int,
+                 cur_algorithm: AlgoType,
+                 forbidden_area: set[tuple[int, int]],
+                 carrier_airport_list: list[tuple[int, int]],
+                 tanker_list: list[tuple[int, int]],
+                 start_pos: tuple[int, int],
+                 end_pos: tuple[int, int],
+                 map_size: tuple[int, int],
+                 use_cache: bool = True,
+                 token: Optional[CancellationToken] = None,
+                 anytime_budget: Optional[float] = ANYTIME_TIME_BUDGET) -> tuple[list, float]:
+    """
+    Run a search through the route cache.
+    Queries that can't have a route are rejected before searching, their result is the reason code as a one-element
+    path, see algo.feasibility.
+    :param token: stops the search when cancelled or past its deadline, the result of a stopped search isn't cached
+    :param anytime_budget: seconds the anytime search keeps improving its route once it has one, None for no limit
+    :return: the search result and the time the search took, a cache hit returns the time of the original search
+    """
+    # build the map once, every algorithm reads the same grid
+    grid_map = GridMap(map_size, forbidden_area, carrier_airport_list, tanker_list)
+    reason = precheck(grid_map, start_pos, end_pos, fuel_cost, max_fuel, cur_algorithm == AlgoType.JPS_DIAGONAL)
+    if reason != FEASIBLE:
+        print("search rejected:", REASON_MESSAGES[reason])
+        if cur_algorithm == AlgoType.ALL:
+            return ([[reason], 0], [[reason], 0], [[reason], 0], [[reason], 0]), 0
+        if cur_algorithm == AlgoType.ALL_WITHOUT_DFS:
+            return ([[reason], 0], [[reason], 0], [[reason], 0], [[-2], 0]), 0
+        return [reason], 0
+    key = search_key(cur_algorithm, grid_map, start_pos, end_pos, fuel_cost, max_fuel, anytime_budget)
+    if use_cache:
+        cached = route_cache.get(key)
+        if cached is not None:
+            print("route cache hit", route_cache.stats())
+            return cached
+    search_start = time.time()
+    result = run_search(grid_map, max_fuel, fuel_cost, cur_algorithm, forbidden_area, carrier_airport_list,
+                        tanker_list, start_pos, end_pos, map_size, token, anytime_budget)
+    elapsed = time.time() - search_start
+    if token is None or token.status == COMPLETED:
+        route_cache.put(key, result, elapsed)
+    return result, elapsed
+
+
+def search_key(cur_algorithm: AlgoType,
+               grid_map: GridMap,
+               start_pos: tuple[int, int],
+               end_pos: tuple[int, int],
+               fuel_cost: int,
+               max_fuel: int,
+               anytime_budget: Optional[float] = ANYTIME_TIME_BUDGET) -> str:
+    """
+    The route cache key of a search, the route of the anytime search also depends on its budget.
+    """
+    algorithm_name = cur_algorithm.name
+    if cur_algorithm == AlgoType.ASTAR_ANYTIME:
+        algorithm_name += f"@{anytime_budget}"
+    return route_key(algorithm_name, grid_map, start_pos, end_pos, fuel_cost, max_fuel)
+
+
+def run_search(grid_map: GridMap,
+               max_fuel: int,
+               fuel_cost: int,
+               cur_algorithm: AlgoType,
+               forbidden_area: set[tuple[int, int]],
+               carrier_airport_list: list[tuple[int, int]],
+               tanker_list: list[tuple[int, int]],
+               start_pos: tuple[int, int],
+               end_pos: tuple[int, int],
+               map_size: tuple[int, int],
+               token: Optional[CancellationToken] = None,
+               anytime_budget: Optional[float] = ANYTIME_TIME_BUDGET):
     path: [list[tuple[int, int]], Optional[list[int]]]
     # reinforcement learning has difficulty in implementation, the code can be check in algo/rl directory
     # if cur_algorithm == AlgoType.RL:
@@ -37,38 +133,65 @@ def start_search(max_fuel: int,
     #     env.map_size = map_size
     #     path = rl(env)
     if cur_algorithm == AlgoType.BFS:
-        path = BFS(max_fuel, fuel_cost, forbidden_area, carrier_airport_list, tanker_list, start_pos, end_pos, map_size)
+        path = BFS(max_fuel, fuel_cost, forbidden_area, carrier_airport_list, tanker_list, start_pos, end_pos, map_size,
+                   grid_map, token=token)
+    elif cur_algorithm == AlgoType.BFS_WAVEFRONT:
+        path = wavefront_search(grid_map, start_pos, end_pos, fuel_cost, max_fuel, token)
     elif cur_algorithm == AlgoType.ASTAR:
-        path = astar(max_fuel, fuel_cost, forbidden_area, carrier_airport_list, tanker_list, start_pos, end_pos, map_size)
+        path = astar(max_fuel, fuel_cost, forbidden_area, carrier_airport_list, tanker_list, start_pos, end_pos, map_size,
+                     grid_map, token=token)
+    elif cur_algorithm == AlgoType.ASTAR_GOAL_TABLE:
+        path = astar(max_fuel, fuel_cost, forbidden_area, carrier_airport_list, tanker_list, start_pos, end_pos, map_size,
+                     grid_map, goal_distance_table(grid_map, end_pos), token)
+    elif cur_algorithm == AlgoType.ASTAR_ANYTIME:
+        path = anytime_astar(max_fuel, fuel_cost, forbidden_area, carrier_airport_list, tanker_list, start_pos, end_pos,
+                             map_size, grid_map, goal_distance_table(grid_map, end_pos), time_budget=anytime_budget,
+                             token=token)
+    elif cur_algorithm == AlgoType.ASTAR_LANDMARKS:
+        heuristic_table = landmark_heuristic_table(grid_map, end_pos, token)
+        path = [] if heuristic_table is None else \
+            astar(max_fuel, fuel_cost, forbidden_area, carrier_airport_list, tanker_list, start_pos, end_pos, map_size,
+                  grid_map, heuristic_table, token)
+    elif cur_algorithm == AlgoType.ASTAR_FUEL_AWARE:
+        path = fuel_aware_astar(grid_map, start_pos, end_pos, fuel_cost, max_fuel, token)
     elif cur_algorithm == AlgoType.DIJKSTRA:
-        map_grid = dijkstra_init_map(map_size, forbidden_area, carrier_airport_list, tanker_list)
-        path = dijkstra_search(map_grid, start_pos, end_pos, fuel_cost, max_fuel)
+        path = dijkstra_search(grid_map, start_pos, end_pos, fuel_cost, max_fuel, token)
     elif cur_algorithm == AlgoType.ADVANCED_DIJKSTRA:
-        map_grid = advanced_dijkstra_init_map(map_size, forbidden_area, carrier_airport_list, tanker_list)
-        path = advanced_dijkstra_search(map_grid, start_pos, end_pos, fuel_cost, max_fuel)
+        path = advanced_dijkstra_search(grid_map, start_pos, end_pos, fuel_cost, max_fuel, token)
+    elif cur_algorithm == AlgoType.STATION_GRAPH:
+        path = station_graph_search(grid_map, start_pos, end_pos, fuel_cost, max_fuel, token)
+    elif cur_algorithm == AlgoType.JPS:
+        path = jps_search(grid_map, start_pos, end_pos, fuel_cost, max_fuel, token=token)
+    elif cur_algorithm == AlgoType.JPS_DIAGONAL:
+        path = jps_search(grid_map, start_pos, end_pos, fuel_cost, max_fuel, diagonal=True, token=token)
+    elif cur_algorithm == AlgoType.BIDIRECTIONAL:
+        path = bidirectional_search(grid_map, start_pos, end_pos, fuel_cost, max_fuel, token)
+    elif cur_algorithm == AlgoType.INCREMENTAL:
+        path = incremental_search(grid_map, start_pos, end_pos, fuel_cost, max_fuel, token)
+    elif cur_algorithm == AlgoType.HIERARCHICAL:
+        path = hierarchical_search(grid_map, start_pos, end_pos, fuel_cost, max_fuel, token)
+    elif cur_algorithm == AlgoType.CONTRACTION:
+        path = contraction_search(grid_map, start_pos, end_pos, fuel_cost, max_fuel, token)
     elif cur_algorithm == AlgoType.DFS:
-        try:
-            path = DFS(max_fuel, fuel_cost, forbidden_area, carrier_airport_list, tanker_list, start_pos, end_pos, map_size)
-        except RecursionError:
-            path = [-1]
+        path = DFS(max_fuel, fuel_cost, forbidden_area, carrier_airport_list, tanker_list, start_pos, end_pos, map_size,
+                   grid_map, token=token)
     elif cur_algorithm == AlgoType.ALL or cur_algorithm == AlgoType.ALL_WITHOUT_DFS:
         start_DIJ = time.time()
-        map_grid = dijkstra_init_map(map_size, forbidden_area, carrier_airport_list, tanker_list)
-        path_DIJ = dijkstra_search(map_grid, start_pos, end_pos, fuel_cost, max_fuel)
+        path_DIJ = dijkstra_search(grid_map, start_pos, end_pos, fuel_cost, max_fuel, token)
         end_DIJ = time.time()
         start_ASTAR = time.time()
-        path_ASTAR = astar(max_fuel, fuel_cost, forbidden_area, carrier_airport_list, tanker_list, start_pos, end_pos, map_size)
+        path_ASTAR = astar(max_fuel, fuel_cost, forbidden_area, carrier_airport_list, tanker_list, start_pos, end_pos,
+                           map_size, grid_map, token=token)
         end_ASTAR = time.time()
         start_BFS = time.time()
-        path_BFS = BFS(max_fuel, fuel_cost, forbidden_area, carrier_airport_list, tanker_list, start_pos, end_pos, map_size)
+        path_BFS = BFS(max_fuel, fuel_cost, forbidden_area, carrier_airport_list, tanker_list, start_pos, end_pos, map_size,
+                       grid_map, token=token)
         end_BFS = time.time()
         start_DFS = time.time()
         if cur_algorithm == AlgoType.ALL_WITHOUT_DFS:
             return [path_DIJ, end_DIJ - start_DIJ], [path_ASTAR, end_ASTAR - start_ASTAR], [path_BFS, end_BFS - start_BFS], [[-2], 0]
-        try:
-            path_DFS = DFS(max_fuel, fuel_cost, forbidden_area, carrier_airport_list, tanker_list, start_pos, end_pos, map_size)
-        except RecursionError:
-            path_DFS = [-1]
+        path_DFS = DFS(max_fuel, fuel_cost, forbidden_area, carrier_airport_list, tanker_list, start_pos, end_pos,
+                       map_size, grid_map, token=token)
         end_DFS = time.time()
         return [path_DIJ, end_DIJ - start_DIJ], [path_ASTAR, end_ASTAR - start_ASTAR], [path_BFS, end_BFS - start_BFS], [path_DFS, end_DFS - start_DFS]
     else:
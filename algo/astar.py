@@ -1,5 +1,20 @@
 import heapq
-from typing import Optional
+import time
+from array import array
+from typing import Optional, Sequence
+
+from algo.cancellation import CancellationToken, CHECK_MASK, COMPLETED
+from algo.grid_map import GridMap
+from algo.heuristics import goal_distance_table, detour_tables
+from algo.station_graph import max_hop_length
+from algo.priority_queue import TieBucketQueue
+from algo.workspace import search_workspace
+
+# heuristic weights of the successive passes of the anytime search, the last pass is plain A*
+ANYTIME_WEIGHTS = (2.0, 1.5, 1.2, 1.0)
+# budget of the anytime search once it has a route: wall-clock seconds and labels of one pass
+ANYTIME_TIME_BUDGET = 1.0
+ANYTIME_LABEL_BUDGET = 4_000_000
 
 
 # Heuristic function for A* algorithm
@@ -7,39 +22,20 @@ def heuristic_cost(pos1: tuple[int, int], pos2: tuple[int, int]):
     return abs(pos2[0] - pos1[0]) + abs(pos2[1] - pos1[1])
 
 
-# To check if a point is in the range of map size
-def border_check(node: tuple[int, int], map_size: tuple[int, int]):
-    return (0 <= node[0] < map_size[0]) and (0 <= node[1] < map_size[1])
-
-# To get neighbors of a point in the range of map size
-def neighbors(node: tuple[int, int], map_size: tuple[int, int]):
-    neighbor_list = []
-
-    if border_check((node[0], node[1] - 1), map_size):
-        neighbor_list.append((node[0], node[1] - 1))
-    if border_check((node[0], node[1] + 1), map_size):
-        neighbor_list.append((node[0], node[1] + 1))
-    if border_check((node[0] - 1, node[1]), map_size):
-        neighbor_list.append((node[0] - 1, node[1]))
-    if border_check((node[0] + 1, node[1]), map_size):
-        neighbor_list.append((node[0] + 1, node[1]))
-
-    return neighbor_list
-
-
-# main A* algorithm
-def get_astar_path(came_from: dict[tuple[int, int], Optional[tuple[int, int]]], end_pos: tuple[int, int]):
-    if came_from.get(end_pos) is None:
+# Rebuild the route once the end position is popped, following the integer parent pointers of the labels
+def get_astar_path(label_cell, label_parent, end_label: int) -> list[int]:
+    if end_label == -1:
         return []
     else:
         path = []
-        reverse_pos = end_pos
-        while reverse_pos is not None:
-            path.append(reverse_pos)
-            reverse_pos = came_from.get(reverse_pos)
+        reverse_label = end_label
+        while reverse_label != -1:
+            path.append(label_cell[reverse_label])
+            reverse_label = label_parent[reverse_label]
         return list(reversed(path))
 
 
+# main A* algorithm
 def astar(max_fuel: int,
           fuel_cost: int,
           forbidden_area_coords_set: set[tuple[int, int]],
@@ -47,54 +43,415 @@ def astar(max_fuel: int,
           tanker_list: list[tuple[int, int]],
           start_pos: tuple[int, int],
           end_pos: tuple[int, int],
-          map_size: tuple[int, int]):
+          map_size: tuple[int, int],
+          grid_map: Optional[GridMap] = None,
+          heuristic_table: Optional[Sequence[int]] = None,
+          token: Optional[CancellationToken] = None):
+    """
+    A* over (cell, cost, fuel) labels, guided by the Manhattan distance to end_pos by default.
+    :param heuristic_table: optional per-cell lower bounds of the distance to end_pos, negative where end_pos can't be
+    reached. It replaces the Manhattan distance and must be consistent, e.g. algo.heuristics.goal_distance_table
+    :param token: stops the search when cancelled or past its deadline
+    """
 
     # initialize aux data
-    add_fuel_pos_set = set(carrier_airport_list + tanker_list)
-
-    came_from: dict[tuple[int, int], Optional[tuple[int, int]]] = {}
-    cost_so_far: dict[tuple[int, int], int] = {}
-    fuel_so_far: dict[tuple[int, int], int] = {}
-    path: tuple
-
-    came_from[start_pos] = None
-    cost_so_far[start_pos] = 0
-    fuel_so_far[start_pos] = max_fuel
-    frontier = [(0, start_pos, max_fuel, ())]
-
-    # main loop to find path
-    while frontier:
-        current = heapq.heappop(frontier)
-        path = current[3]
-        path = path + (current[1],)
-
-        # find path
-        if current[1] == end_pos:
-            return list(path)
-            # break
-
-        # cost and fuel calculation logic
-        for next_node in neighbors(current[1], map_size):
-            if next_node in forbidden_area_coords_set:
+    if grid_map is None:
+        grid_map = GridMap(map_size, forbidden_area_coords_set, carrier_airport_list, tanker_list)
+    refuel = grid_map.refuel
+    height = grid_map.height
+    start = grid_map.index(start_pos)
+    end = grid_map.index(end_pos)
+    if heuristic_table is not None and heuristic_table[start] < 0:
+        # the end position can't be reached even with unlimited fuel
+        return []
+
+    with search_workspace(grid_map) as workspace:
+        # a label is a (cell, cost, fuel) state, the frontier only holds label indices and the route
+        # is rebuilt from the parent pointers at the end instead of copying a path tuple on every expansion
+        label_cell = array('l', [start])
+        label_cost = array('l', [0])
+        label_fuel = array('l', [max_fuel])
+        label_parent = array('l', [-1])
+        # the per-cell planes hold base + value, see SearchWorkspace
+        base = workspace.begin()
+        # most fuel left among the labels expanded at each cell. With a consistent heuristic, labels of a cell are
+        # expanded in non-decreasing cost order, so a label with no more fuel than that is dominated
+        expanded_fuel = workspace.stamped('fuel')
+        # last label generated at each cell, used to drop duplicates before they reach the frontier
+        generated = workspace.stamped('label')
+        generated[start] = base
+        # the f-values are integers popped in non-decreasing order, one bucket per f-value. Ties are broken by the
+        # larger cost (deeper labels first), then by the label index
+        if heuristic_table is None:
+            frontier = TieBucketQueue(heuristic_cost(start_pos, end_pos), 0, 0)
+        else:
+            frontier = TieBucketQueue(heuristic_table[start], 0, 0)
+
+        # main loop to find path
+        end_label = -1
+        popped = 0
+        while frontier:
+            popped += 1
+            if not popped & CHECK_MASK and token is not None:
+                head_f, head_label = frontier.peek()
+                if token.checkpoint(popped, len(frontier), head_f, grid_map.manhattan(label_cell[head_label], end)):
+                    return token.stop(grid_map, label_cell, label_parent, end)
+            _, label = frontier.pop()
+            current = label_cell[label]
+            current_fuel = label_fuel[label]
+
+            if base + current_fuel <= expanded_fuel[current]:
+                continue
+            expanded_fuel[current] = base + current_fuel
+
+            # find path
+            if current == end:
+                end_label = label
+                break
+
+            if current_fuel < fuel_cost:
                 continue
 
-            new_cost = cost_so_far[current[1]] + 1
-            if next_node in add_fuel_pos_set:
-                new_fuel = max_fuel
+            # cost and fuel calculation logic
+            new_cost = label_cost[label] + 1
+            for next_node in grid_map.neighbors(current):
+                if refuel[next_node]:
+                    new_fuel = max_fuel
+                else:
+                    new_fuel = current_fuel - fuel_cost
+
+                if base + new_fuel <= expanded_fuel[next_node]:
+                    continue
+                last = generated[next_node] - base
+                if last >= 0 and label_cost[last] <= new_cost and label_fuel[last] >= new_fuel:
+                    continue
+                if heuristic_table is None:
+                    heuristic = heuristic_cost(divmod(next_node, height), end_pos)
+                else:
+                    heuristic = heuristic_table[next_node]
+                    if heuristic < 0:
+                        continue
+
+                # update aux data
+                new_label = len(label_cell)
+                label_cell.append(next_node)
+                label_cost.append(new_cost)
+                label_fuel.append(new_fuel)
+                label_parent.append(label)
+                generated[next_node] = base + new_label
+                frontier.push(new_cost + heuristic, -new_cost, new_label)
+
+    # empty if not found
+    return grid_map.path_to_coords(get_astar_path(label_cell, label_parent, end_label))
+
+
+def weighted_pass(grid_map: GridMap,
+                  start: int,
+                  end: int,
+                  fuel_cost: int,
+                  max_fuel: int,
+                  heuristic_table: Optional[Sequence[int]],
+                  weight: float,
+                  incumbent_cost: float,
+                  deadline: Optional[float],
+                  max_labels: Optional[int],
+                  token: Optional[CancellationToken]) -> tuple[list[int], float, bool]:
+    """
+    One pass of the anytime search: A* with the heuristic inflated by weight.
+    Labels that can't beat the incumbent even with the plain heuristic are pruned. As in ARA*, a cell isn't expanded
+    again by a label with less fuel, even if that label is cheaper. Such labels are only kept track of through the
+    smallest plain f-value among them, which bounds the cost of the shortest route together with the frontier.
+    :param incumbent_cost: the cost of the best route so far, inf if there is none
+    :param deadline: time.time() after which the pass gives up, None for no deadline
+    :param max_labels: the number of labels after which the pass gives up, None for no limit
+    :return: a route cheaper than the incumbent or an empty list, a lower bound of the shortest route cost,
+    and whether the pass ran to the end
+    """
+    height = grid_map.height
+    refuel = grid_map.refuel
+    end_x, end_y = divmod(end, height)
+    with search_workspace(grid_map) as workspace:
+        label_cell = array('l', [start])
+        label_cost = array('l', [0])
+        label_fuel = array('l', [max_fuel])
+        label_parent = array('l', [-1])
+        base = workspace.begin()
+        # most fuel left among the labels expanded at each cell, stamped with the base of the pass, and the cost of
+        # that label, only read where the fuel is stamped
+        expanded_fuel = workspace.stamped('fuel')
+        expanded_cost = workspace.plain('cost')
+        generated = workspace.stamped('label')
+        generated[start] = base
+        start_heuristic = grid_map.manhattan(start, end) if heuristic_table is None else heuristic_table[start]
+        frontier = [(weight * start_heuristic, 0, 0)]
+        # smallest plain f-value of the labels skipped while cheaper than the label expanded at their cell
+        inconsistent_f = incumbent_cost
+
+        popped = 0
+        while frontier:
+            popped += 1
+            if not popped & CHECK_MASK:
+                if token is not None and token.checkpoint(popped, len(frontier), frontier[0][0],
+                                                          grid_map.manhattan(label_cell[frontier[0][2]], end)):
+                    token.stop(grid_map, label_cell, label_parent, end)
+                    return [], 0, False
+                if deadline is not None and time.time() >= deadline or \
+                        max_labels is not None and len(label_cell) >= max_labels:
+                    return [], 0, False
+            _, negative_cost, label = heapq.heappop(frontier)
+            current = label_cell[label]
+            current_fuel = label_fuel[label]
+
+            if base + current_fuel <= expanded_fuel[current]:
+                if -negative_cost < expanded_cost[current]:
+                    if heuristic_table is None:
+                        x, y = divmod(current, height)
+                        heuristic = abs(x - end_x) + abs(y - end_y)
+                    else:
+                        heuristic = heuristic_table[current]
+                    inconsistent_f = min(inconsistent_f, heuristic - negative_cost)
+                continue
+            expanded_fuel[current] = base + current_fuel
+            expanded_cost[current] = -negative_cost
+
+            if current == end:
+                # the shortest route has a label in the frontier or among the skipped ones,
+                # or is no shorter than the incumbent
+                lower_bound = min(-negative_cost, inconsistent_f)
+                for _, open_negative_cost, open_label in frontier:
+                    cell = label_cell[open_label]
+                    if heuristic_table is None:
+                        x, y = divmod(cell, height)
+                        heuristic = abs(x - end_x) + abs(y - end_y)
+                    else:
+                        heuristic = heuristic_table[cell]
+                    lower_bound = min(lower_bound, heuristic - open_negative_cost)
+                return get_astar_path(label_cell, label_parent, label), lower_bound, True
+
+            if current_fuel < fuel_cost:
+                continue
+
+            new_cost = 1 - negative_cost
+            for next_node in grid_map.neighbors(current):
+                new_fuel = max_fuel if refuel[next_node] else current_fuel - fuel_cost
+                last = generated[next_node] - base
+                if last >= 0 and label_cost[last] <= new_cost and label_fuel[last] >= new_fuel:
+                    continue
+                if heuristic_table is None:
+                    x, y = divmod(next_node, height)
+                    heuristic = abs(x - end_x) + abs(y - end_y)
+                else:
+                    heuristic = heuristic_table[next_node]
+                    if heuristic < 0:
+                        continue
+                if new_cost + heuristic >= incumbent_cost:
+                    continue
+
+                new_label = len(label_cell)
+                label_cell.append(next_node)
+                label_cost.append(new_cost)
+                label_fuel.append(new_fuel)
+                label_parent.append(label)
+                generated[next_node] = base + new_label
+                heapq.heappush(frontier, (new_cost + weight * heuristic, -new_cost, new_label))
+
+    # no cheaper route in this pass, the skipped labels are all that is left of the shortest one
+    return [], inconsistent_f, True
+
+
+def anytime_astar(max_fuel: int,
+                  fuel_cost: int,
+                  forbidden_area_coords_set: set[tuple[int, int]],
+                  carrier_airport_list: list[tuple[int, int]],
+                  tanker_list: list[tuple[int, int]],
+                  start_pos: tuple[int, int],
+                  end_pos: tuple[int, int],
+                  map_size: tuple[int, int],
+                  grid_map: Optional[GridMap] = None,
+                  heuristic_table: Optional[Sequence[int]] = None,
+                  weights: Sequence[float] = ANYTIME_WEIGHTS,
+                  time_budget: Optional[float] = ANYTIME_TIME_BUDGET,
+                  max_labels: Optional[int] = ANYTIME_LABEL_BUDGET,
+                  token: Optional[CancellationToken] = None):
+    """
+    Anytime A* in the spirit of ARA*: a first route is found quickly with an inflated heuristic, then the search is
+    restarted with smaller weights, each pass only keeping the labels that can beat the best route so far.
+    Each better route is handed to the improvement callback of the token with its suboptimality bound, the ratio
+    of its cost to a lower bound of the shortest route cost.
+    The budgets only cut the improvement passes, the search always runs until it has a route.
+    :param heuristic_table: optional per-cell lower bounds of the distance to end_pos, see astar()
+    :param weights: the heuristic weights of the passes, decreasing and ending with 1 for an optimal last pass
+    :param time_budget: seconds after which no new pass is started and the running one gives up, None for no limit
+    :param max_labels: labels after which a pass gives up, None for no limit
+    :param token: stops the search when cancelled or past its deadline
+    :return: the best route found, or an empty list if no path found
+    """
+    if grid_map is None:
+        grid_map = GridMap(map_size, forbidden_area_coords_set, carrier_airport_list, tanker_list)
+    start = grid_map.index(start_pos)
+    end = grid_map.index(end_pos)
+    if heuristic_table is not None and heuristic_table[start] < 0:
+        return []
+    deadline = None if time_budget is None else time.time() + time_budget
+
+    route = []
+    incumbent_cost = float('inf')
+    # every pass that runs to the end gives a lower bound of the shortest route cost, the largest one is kept
+    best_lower_bound = 0
+    bound = float('inf')
+    weights = list(weights)
+    while weights:
+        weight = weights.pop(0)
+        if route and deadline is not None and time.time() >= deadline:
+            break
+        if route:
+            pass_deadline, pass_labels = deadline, max_labels
+        else:
+            # an inflated pass may wander far off when fuel forces a detour, it is given one label for every four
+            # cells to find the first route before the exact pass takes over
+            pass_deadline, pass_labels = None, None if weight == 1.0 else grid_map.size // 4
+        better_route, lower_bound, finished = weighted_pass(grid_map, start, end, fuel_cost, max_fuel,
+                                                            heuristic_table, weight, incumbent_cost,
+                                                            pass_deadline, pass_labels, token)
+        if token is not None and token.status != COMPLETED:
+            if route:
+                # the best route so far is a better partial result than the closest label
+                token.partial_path = grid_map.path_to_coords(route)
+            return []
+        if not finished:
+            if route:
+                break
+            weights = [1.0]
+            continue
+        if better_route:
+            route = better_route
+            incumbent_cost = len(route) - 1
+        elif not route:
+            if weight == 1.0 or lower_bound == float('inf'):
+                # nothing was skipped, the end position can't be reached
+                return []
+            # the skipped labels may still reach the end position, only a plain pass can tell
+            weights = [1.0]
+            continue
+        best_lower_bound = max(best_lower_bound, lower_bound)
+        bound = incumbent_cost / best_lower_bound if best_lower_bound > 0 else 1.0
+        if better_route and token is not None:
+            token.improve(grid_map.path_to_coords(route), bound)
+        if bound <= 1.0:
+            break
+
+    print("Anytime A* finished" "path lenth: ", len(route), "bound: ", round(bound, 3))
+    return grid_map.path_to_coords(route)
+
+
+def fuel_aware_astar(grid_map: GridMap,
+                     start_pos: tuple[int, int],
+                     end_pos: tuple[int, int],
+                     fuel_cost: int,
+                     max_fuel: int,
+                     token: Optional[CancellationToken] = None):
+    """
+    A* with a heuristic that knows when fuel forces a refuel stop.
+    A label whose fuel can't cover the goal distance must stop at a carrier, airport or tanker other than the
+    destination first, so its heuristic is the detour distance through the best such station instead of the goal
+    distance, see detour_tables(), and it is dropped if no such station is within its fuel range. The heuristic is
+    admissible and consistent over (cell, fuel) states: a label short of fuel stays short of it until it enters a
+    station, and the detour distance of a cell next to a station is at most one more than the heuristic there.
+    The heuristic of a cell now depends on the fuel, so the labels of a cell are only expanded in non-decreasing cost
+    among the labels on the same side of the goal distance. A label is dominated by an expanded label on its side with
+    at least as much fuel, or, short of fuel, by the cheapest label expanded with enough fuel at its cell.
+    :param token: stops the search when cancelled or past its deadline
+    :return: the path from start_pos to end_pos, or an empty list if no path found
+    """
+    refuel = grid_map.refuel
+    start = grid_map.index(start_pos)
+    end = grid_map.index(end_pos)
+    goal_distance = goal_distance_table(grid_map, end_pos)
+    if goal_distance[start] < 0:
+        return []
+    tables = detour_tables(grid_map, end_pos, max_hop_length(fuel_cost, max_fuel), token)
+    if tables is None:
+        return []
+    detour_distance, station_distance = tables
+
+    def heuristic(cell: int, fuel: int) -> int:
+        distance = goal_distance[cell]
+        if fuel >= distance * fuel_cost:
+            return distance
+        if fuel < station_distance[cell] * fuel_cost:
+            # neither the goal nor a station that leads to it is in range, a dead end
+            return -1
+        return detour_distance[cell]
+
+    with search_workspace(grid_map) as workspace:
+        base = workspace.begin()
+        # most fuel left among the labels expanded at each cell with enough fuel for the goal distance, then short
+        # of it, stamped with the base of the search
+        expanded_fuel = workspace.stamped('side fuel', 2)
+        # cost of the first label expanded at each cell with enough fuel, only read where its fuel is stamped
+        expanded_cost = workspace.plain('cost')
+        generated = workspace.stamped('label')
+        generated[start] = base
+        label_cell = array('l', [start])
+        label_cost = array('l', [0])
+        label_fuel = array('l', [max_fuel])
+        label_parent = array('l', [-1])
+        start_heuristic = heuristic(start, max_fuel)
+        if start_heuristic < 0:
+            return []
+        frontier = TieBucketQueue(start_heuristic, 0, 0)
+
+        end_label = -1
+        popped = 0
+        while frontier:
+            popped += 1
+            if not popped & CHECK_MASK and token is not None:
+                head_f, head_label = frontier.peek()
+                if token.checkpoint(popped, len(frontier), head_f, grid_map.manhattan(label_cell[head_label], end)):
+                    return token.stop(grid_map, label_cell, label_parent, end)
+            _, label = frontier.pop()
+            current = label_cell[label]
+            current_fuel = label_fuel[label]
+            cost = label_cost[label]
+
+            if current_fuel >= goal_distance[current] * fuel_cost:
+                slot = current * 2
+                if base + current_fuel <= expanded_fuel[slot]:
+                    continue
+                if expanded_fuel[slot] < base:
+                    expanded_cost[current] = cost
             else:
-                new_fuel = current[2] - fuel_cost
+                slot = current * 2 + 1
+                if base + current_fuel <= expanded_fuel[slot]:
+                    continue
+                if expanded_fuel[slot - 1] >= base and expanded_cost[current] <= cost:
+                    continue
+            expanded_fuel[slot] = base + current_fuel
 
-            if new_fuel < 0:
+            if current == end:
+                end_label = label
+                break
+            if current_fuel < fuel_cost:
                 continue
 
-            # update aux data
-            if next_node not in cost_so_far or new_fuel > fuel_so_far[next_node]:
-                cost_so_far[next_node] = new_cost
-                fuel_so_far[next_node] = new_fuel
-                new_priority = new_cost + heuristic_cost(next_node, end_pos)
-                heapq.heappush(frontier, (new_priority, next_node, new_fuel, path))
-                came_from[next_node] = current[1]
+            new_cost = cost + 1
+            for next_node in grid_map.neighbors(current):
+                new_fuel = max_fuel if refuel[next_node] else current_fuel - fuel_cost
+                last = generated[next_node] - base
+                if last >= 0 and label_cost[last] <= new_cost and label_fuel[last] >= new_fuel:
+                    continue
+                next_heuristic = heuristic(next_node, new_fuel)
+                if next_heuristic < 0:
+                    continue
 
-    # if not found
-    return []
+                new_label = len(label_cell)
+                label_cell.append(next_node)
+                label_cost.append(new_cost)
+                label_fuel.append(new_fuel)
+                label_parent.append(label)
+                generated[next_node] = base + new_label
+                frontier.push(new_cost + next_heuristic, -new_cost, new_label)
 
+    route = get_astar_path(label_cell, label_parent, end_label)
+    print("Fuel-aware A* finished" "path lenth: ", len(route), "labels: ", len(label_cell))
+    return grid_map.path_to_coords(route)
@@ -0,0 +1,160 @@
+import math
+import os
+import time
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional
+
+import numpy as np
+
+from airway_genius_gui.globals import AlgoType
+from algo.algo_brain import run_search
+from algo.cancellation import CancellationToken, COMPLETED
+from algo.grid_map import GridMap, CARRIER_AIRPORT, TANKER
+
+
+class BatchResult:
+    """
+    Columnar result of a batch search.
+    The paths of all the queries are stored back to back as flat cell indices, the path of query i is
+    path_cells[path_offsets[i]:path_offsets[i + 1]], an empty slice means no path found or the query timed out.
+    """
+
+    def __init__(self, map_size: tuple[int, int], path_offsets: np.ndarray, path_cells: np.ndarray,
+                 times: np.ndarray, completed: np.ndarray):
+        self.map_size = map_size
+        self.path_offsets = path_offsets  # int64, one more entry than queries
+        self.path_cells = path_cells  # int32 flat indices, index = x * height + y
+        self.times = times  # float64 search time of each query in seconds
+        self.completed = completed  # bool, False where the query was stopped by its timeout
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def path_length(self, query: int) -> int:
+        return int(self.path_offsets[query + 1] - self.path_offsets[query])
+
+    def path(self, query: int) -> list[tuple[int, int]]:
+        cells = self.path_cells[self.path_offsets[query]:self.path_offsets[query + 1]]
+        return [divmod(int(cell), self.map_size[1]) for cell in cells]
+
+    def paths(self) -> list[list[tuple[int, int]]]:
+        return [self.path(query) for query in range(len(self))]
+
+
+# the grid map of the batch, built once in every worker process from the shared planes
+worker_shared_memory: Optional[SharedMemory] = None
+worker_grid_map: Optional[GridMap] = None
+worker_scenario = None
+
+
+def init_worker(shared_memory_name: str, map_size: tuple[int, int], max_fuel: int, fuel_cost: int,
+                cur_algorithm: AlgoType, timeout: Optional[float]):
+    global worker_shared_memory, worker_grid_map, worker_scenario
+    worker_shared_memory = SharedMemory(name=shared_memory_name)
+    size = map_size[0] * map_size[1]
+    forbidden_mask = np.ndarray(size, dtype=bool, buffer=worker_shared_memory.buf)
+    cell_type = np.ndarray(size, dtype=np.uint8, buffer=worker_shared_memory.buf, offset=size)
+    worker_grid_map = GridMap.from_arrays(map_size, forbidden_mask, cell_type)
+    worker_scenario = (max_fuel, fuel_cost, cur_algorithm, timeout)
+
+
+def search_chunk(od_pairs: list[tuple[int, tuple[int, int], tuple[int, int]]]) \
+        -> tuple[list[int], list[float], list[bool], bytes]:
+    """
+    Run the queries of one chunk on the grid map of the worker.
+    :return: the path length, search time and completion of every query and the concatenated paths as int32 bytes
+    """
+    return search_queries(worker_grid_map, *worker_scenario, od_pairs)
+
+
+def search_queries(grid_map: GridMap, max_fuel: int, fuel_cost: int, cur_algorithm: AlgoType, timeout: Optional[float],
+                   od_pairs: list[tuple[int, tuple[int, int], tuple[int, int]]]) \
+        -> tuple[list[int], list[float], list[bool], bytes]:
+    height = grid_map.height
+    # the station lists only feed the algorithms that build their own map, the forbidden set is never read
+    carrier_airport_list = grid_map.path_to_coords(np.flatnonzero(grid_map.cell_type == CARRIER_AIRPORT).tolist())
+    tanker_list = grid_map.path_to_coords(np.flatnonzero(grid_map.cell_type == TANKER).tolist())
+    lengths = []
+    times = []
+    completed = []
+    cells = []
+    for _, start_pos, end_pos in od_pairs:
+        token = CancellationToken.with_timeout(timeout)
+        search_start = time.time()
+        path = run_search(grid_map, max_fuel, fuel_cost, cur_algorithm, set(), carrier_airport_list, tanker_list,
+                          start_pos, end_pos, grid_map.map_size, token) or []
+        times.append(time.time() - search_start)
+        completed.append(token.status == COMPLETED)
+        lengths.append(len(path))
+        cells += [x * height + y for x, y in path]
+    return lengths, times, completed, np.asarray(cells, dtype=np.int32).tobytes()
+
+
+def batch_search(max_fuel: int,
+                 fuel_cost: int,
+                 cur_algorithm: AlgoType,
+                 forbidden_area: set[tuple[int, int]],
+                 carrier_airport_list: list[tuple[int, int]],
+                 tanker_list: list[tuple[int, int]],
+                 od_pairs: list[tuple[tuple[int, int], tuple[int, int]]],
+                 map_size: tuple[int, int],
+                 processes: Optional[int] = None,
+                 timeout: Optional[float] = None) -> BatchResult:
+    """
+    Search many origin/destination pairs on one scenario.
+    The grid is built once and placed in shared memory, every worker process builds its map from it once, so the
+    heuristic and station tables cached per map are reused by all the queries of the worker. Queries with the same
+    destination are sent to the same chunk to share their goal tables.
+    :param od_pairs: the (start_pos, end_pos) of every query
+    :param processes: the number of worker processes, 0 runs the queries in this process
+    :param timeout: the longest time a single query may run, in seconds, so a hard query can't hold up the batch
+    :return: the paths and search times of the queries, in the order of od_pairs
+    """
+    if cur_algorithm in (AlgoType.ALL, AlgoType.ALL_WITHOUT_DFS):
+        raise ValueError("batch search runs a single algorithm, got " + cur_algorithm.value)
+    grid_map = GridMap(map_size, forbidden_area, carrier_airport_list, tanker_list)
+    queries = sorted(((query, tuple(start_pos), tuple(end_pos)) for query, (start_pos, end_pos) in enumerate(od_pairs)),
+                     key=lambda item: (item[2], item[1]))
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = min(processes, len(queries))
+
+    if processes <= 1:
+        results = [search_queries(grid_map, max_fuel, fuel_cost, cur_algorithm, timeout, queries)]
+        chunks = [queries]
+    else:
+        chunk_size = math.ceil(len(queries) / (processes * 4))
+        chunks = [queries[i:i + chunk_size] for i in range(0, len(queries), chunk_size)]
+        shared_memory = SharedMemory(create=True, size=grid_map.size * 2)
+        try:
+            shared_memory.buf[:grid_map.size] = grid_map.forbidden_mask.tobytes()
+            shared_memory.buf[grid_map.size:] = grid_map.cell_type.tobytes()
+            with Pool(processes, initializer=init_worker,
+                      initargs=(shared_memory.name, grid_map.map_size, max_fuel, fuel_cost, cur_algorithm,
+                                timeout)) as pool:
+                results = pool.map(search_chunk, chunks)
+        finally:
+            shared_memory.close()
+            shared_memory.unlink()
+
+    # put the columns back in query order
+    lengths = np.zeros(len(queries), dtype=np.int64)
+    times = np.zeros(len(queries), dtype=np.float64)
+    completed = np.zeros(len(queries), dtype=bool)
+    chunk_cells = []
+    chunk_offsets = []
+    for chunk, (chunk_lengths, chunk_times, chunk_completed, cells) in zip(chunks, results):
+        order = [query for query, _, _ in chunk]
+        lengths[order] = chunk_lengths
+        times[order] = chunk_times
+        completed[order] = chunk_completed
+        chunk_cells.append(np.frombuffer(cells, dtype=np.int32))
+        chunk_offsets.append(np.concatenate(([0], np.cumsum(chunk_lengths)[:-1])))
+    path_offsets = np.zeros(len(queries) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=path_offsets[1:])
+    path_cells = np.empty(path_offsets[-1], dtype=np.int32)
+    for chunk, cells, offsets in zip(chunks, chunk_cells, chunk_offsets):
+        for (query, _, _), offset in zip(chunk, offsets):
+            path_cells[path_offsets[query]:path_offsets[query + 1]] = cells[offset:offset + lengths[query]]
+    return BatchResult(grid_map.map_size, path_offsets, path_cells, times, completed)
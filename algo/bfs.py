@@ -1,6 +1,15 @@
-from collections import deque
+import random
+from array import array
+from itertools import permutations
+from typing import Optional
 
-from numpy import random
+from algo.cancellation import CancellationToken, CHECK_MASK
+from algo.grid_map import GridMap
+
+# all the orders of the 4 directions, one of them is picked for every dequeued cell
+DIRECTION_ORDERS = list(permutations(range(4)))
+# the order of a cell is looked up in a seeded table of prime length, so the pattern doesn't line up with map rows
+ORDER_TABLE_SIZE = 4093
 
 
 def BFS(max_fuel: int,
@@ -10,60 +19,84 @@ def BFS(max_fuel: int,
         tanker_list: list[tuple[int, int]],
         start_pos: tuple[int, int],
         end_pos: tuple[int, int],
-        map_size: tuple[int, int]):
-    visited = dict()  # store the visited position and the remaining fuel
+        map_size: tuple[int, int],
+        grid_map: Optional[GridMap] = None,
+        seed: Optional[int] = None,
+        token: Optional[CancellationToken] = None):
+    if grid_map is None:
+        grid_map = GridMap(map_size, forbidden_area, carrier_airport_list, tanker_list)
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    blocked = grid_map.blocked
+    refuel = grid_map.refuel
+    width, height = grid_map.map_size
+    start = grid_map.index(start_pos)
+    end = grid_map.index(end_pos)
 
-    queue = deque([(start_pos, max_fuel, ())])  # store the position, remaining fuel, and the path
-    visited.update({start_pos: max_fuel})  # initialize the start position with max fuel
+    # the neighbor order is chosen per cell from a seeded table rather than shuffling every neighbor list,
+    # the path still looks random(visually better) while the same seed always gives the same path
+    rng = random.Random(seed)
+    order_table = bytes(rng.randrange(len(DIRECTION_ORDERS)) for _ in range(ORDER_TABLE_SIZE))
+    offsets = (-height, height, -1, 1)
+    direction_orders = [tuple(offsets[direction] for direction in order) for order in DIRECTION_ORDERS]
 
-    while queue:
-        cur_pos: tuple[int, int]
-        cur_fuel: int
-        path: tuple
-        cur_pos, cur_fuel, path = queue.popleft()
-        path = path + (cur_pos,)
+    # labels are appended in breadth-first order, so the label arrays are the queue themselves
+    label_cell = array('l', [start])
+    label_fuel = array('l', [max_fuel])
+    label_parent = array('l', [-1])
+    best_fuel = [-1] * grid_map.size  # store the most remaining fuel a cell has been reached with
+    best_fuel[start] = max_fuel
 
-        if cur_fuel < 0:
-            # skip if the fuel is negative
+    head = 0
+    found = -1
+    while head < len(label_cell):
+        cur_pos = label_cell[head]
+        cur_fuel = label_fuel[head]
+        if not head & CHECK_MASK and token is not None and \
+                token.checkpoint(head, len(label_cell) - head, -1, grid_map.manhattan(cur_pos, end)):
+            return token.stop(grid_map, label_cell, label_parent, end)
+        if cur_pos == end:
+            # the destination is reached
+            found = head
+            break
+        label = head
+        head += 1
+        if cur_fuel < best_fuel[cur_pos] or cur_fuel < fuel_cost:
+            # skip if a label with more fuel has reached the cell since, or the fuel can't cover another pixel
             continue
-        if cur_pos == end_pos:
-            # return the path if the destination is reached
-            return path
 
-        neighbors = get_neighbors(cur_pos, map_size)
-        random.shuffle(neighbors)  # shuffle the neighbors to get random path(visually better)
-        for neighbor in neighbors:
-            if neighbor in forbidden_area:
+        x, y = divmod(cur_pos, height)
+        for offset in direction_orders[order_table[cur_pos % ORDER_TABLE_SIZE]]:
+            # skip the neighbors out of the map
+            if offset == -height:
+                if x == 0:
+                    continue
+            elif offset == height:
+                if x + 1 == width:
+                    continue
+            elif offset == -1:
+                if y == 0:
+                    continue
+            elif y + 1 == height:
+                continue
+            neighbor = cur_pos + offset
+            if blocked[neighbor]:
                 # skip if the neighbor is forbidden
                 continue
-            is_visited = neighbor in visited
-            is_refuel = neighbor in carrier_airport_list or neighbor in tanker_list
-            if is_refuel:
-                # refuel if the neighbor is a carrier or airport or tanker and update the fuel at the poisition
-                queue.append((neighbor, max_fuel, path))
-                visited.update({neighbor: max_fuel})
-            elif is_visited and cur_fuel - fuel_cost > visited[neighbor] or not is_visited:
-                # update the fuel at the position and add the neighbor to the queue
-                # if current fuel - fuel cost is greater than the fuel previously visited,
+            # refuel if the neighbor is a carrier or airport or tanker
+            new_fuel = max_fuel if refuel[neighbor] else cur_fuel - fuel_cost
+            if new_fuel > best_fuel[neighbor]:
+                # if the new fuel is greater than the fuel previously visited,
                 # it means that can start from the neighbor with more fuel and reach further
-                new_fuel = cur_fuel - fuel_cost
-                queue.append((neighbor, new_fuel, path))
-                visited.update({neighbor: new_fuel})
+                best_fuel[neighbor] = new_fuel
+                label_cell.append(neighbor)
+                label_fuel.append(new_fuel)
+                label_parent.append(label)
 
     # return empty list if no path found
-    return []
-
-
-def get_neighbors(cur_pos, map_size):
-    neighbors = []
-    x, y = cur_pos
-    width, height = map_size
-    if x - 1 >= 0:
-        neighbors.append((x - 1, y))
-    if x + 1 < width:
-        neighbors.append((x + 1, y))
-    if y - 1 >= 0:
-        neighbors.append((x, y - 1))
-    if y + 1 < height:
-        neighbors.append((x, y + 1))
-    return neighbors
+    path = []
+    while found != -1:
+        path.append(label_cell[found])
+        found = label_parent[found]
+    path.reverse()
+    return grid_map.path_to_coords(path)
@@ -0,0 +1,125 @@
+from array import array
+from typing import Optional
+
+from algo.cancellation import CancellationToken, CHECK_MASK
+from algo.grid_map import GridMap
+
+
+class SearchFrontier:
+    """
+    Labels of one side of the bidirectional search, grown one distance layer at a time.
+    Forward labels hold the fuel left at their cell, backward labels hold the fuel needed at their cell
+    to reach the destination. Labels at the same cell are chained so the other side can look them up.
+    """
+
+    def __init__(self, grid_map: GridMap, source: int, fuel: int):
+        self.label_cell = array('l', [source])
+        self.label_dist = array('l', [0])
+        self.label_fuel = array('l', [fuel])
+        self.label_parent = array('l', [-1])
+        self.label_same_cell = array('l', [-1])  # the previous label at the same cell
+        self.last_label = [-1] * grid_map.size
+        self.last_label[source] = 0
+        self.layer_start = 0  # labels from layer_start on are the layer to expand next
+        self.depth = 0  # distance of the labels generated last
+
+    def layer_size(self) -> int:
+        return len(self.label_cell) - self.layer_start
+
+    def add(self, cell: int, dist: int, fuel: int, parent: int) -> int:
+        label = len(self.label_cell)
+        self.label_cell.append(cell)
+        self.label_dist.append(dist)
+        self.label_fuel.append(fuel)
+        self.label_parent.append(parent)
+        self.label_same_cell.append(self.last_label[cell])
+        self.last_label[cell] = label
+        return label
+
+    def trace(self, label: int) -> list[int]:
+        cells = []
+        while label != -1:
+            cells.append(self.label_cell[label])
+            label = self.label_parent[label]
+        return cells
+
+
+def bidirectional_search(map_grid: GridMap, start_pos, end_pos, fuel_cost, max_fuel,
+                         token: Optional[CancellationToken] = None):
+    """
+    Bidirectional breadth-first search under the refuel model.
+    The forward side grows from the start with the fuel left, the backward side grows from the destination with
+    the fuel still needed, which drops to one step of fuel in front of every refuel point.
+    A forward label meets a backward label at the same cell when its fuel covers what the backward label needs.
+    :param token: stops the search when cancelled or past its deadline, the partial result grows from the start
+    :return: the path from start_pos to end_pos, or an empty list if no path found
+    """
+    start = map_grid.index(start_pos)
+    end = map_grid.index(end_pos)
+    refuel = map_grid.refuel
+    forward = SearchFrontier(map_grid, start, max_fuel)
+    backward = SearchFrontier(map_grid, end, 0)
+
+    best_distance = 0 if start == end else float('inf')
+    best_meeting = (0, 0)  # the forward and backward labels of the best route
+    while best_distance > forward.depth + backward.depth + 1:
+        if forward.layer_size() == 0 or backward.layer_size() == 0:
+            break
+        # grow the side with the smaller layer
+        is_forward = forward.layer_size() <= backward.layer_size()
+        side, other = (forward, backward) if is_forward else (backward, forward)
+        layer_end = len(side.label_cell)
+        dist = side.depth + 1
+        for label in range(side.layer_start, layer_end):
+            if not label & CHECK_MASK and token is not None and \
+                    token.checkpoint(len(forward.label_cell) + len(backward.label_cell), layer_end - label,
+                                     forward.depth + backward.depth,
+                                     map_grid.manhattan(side.label_cell[label], end if is_forward else start)):
+                return token.stop(map_grid, forward.label_cell, forward.label_parent, end)
+            current = side.label_cell[label]
+            fuel = side.label_fuel[label]
+            if side.last_label[current] != label and side.label_dist[side.last_label[current]] == side.depth:
+                # a label of the same layer with a better fuel value has reached the cell since
+                continue
+            if is_forward and fuel < fuel_cost:
+                continue
+            for neighbor in map_grid.neighbors(current):
+                if is_forward:
+                    new_fuel = max_fuel if refuel[neighbor] else fuel - fuel_cost
+                    # keep the label only if it has more fuel left than every earlier label at the cell
+                    last = side.last_label[neighbor]
+                    if last != -1 and side.label_fuel[last] >= new_fuel:
+                        continue
+                else:
+                    # fuel needed at the neighbor to fly into the current cell and go on from there
+                    new_fuel = fuel_cost if refuel[current] else fuel + fuel_cost
+                    if new_fuel > max_fuel:
+                        continue
+                    # keep the label only if it needs less fuel than every earlier label at the cell
+                    last = side.last_label[neighbor]
+                    if last != -1 and side.label_fuel[last] <= new_fuel:
+                        continue
+                new_label = side.add(neighbor, dist, new_fuel, label)
+
+                # meet the labels of the other side at the same cell
+                other_label = other.last_label[neighbor]
+                while other_label != -1:
+                    if is_forward:
+                        feasible = other.label_fuel[other_label] <= new_fuel
+                    else:
+                        feasible = other.label_fuel[other_label] >= new_fuel
+                    if feasible and dist + other.label_dist[other_label] < best_distance:
+                        best_distance = dist + other.label_dist[other_label]
+                        best_meeting = (new_label, other_label) if is_forward else (other_label, new_label)
+                    other_label = other.label_same_cell[other_label]
+        side.layer_start = layer_end
+        side.depth = dist
+
+    if best_distance == float('inf'):
+        return []
+
+    forward_label, backward_label = best_meeting
+    path = list(reversed(forward.trace(forward_label))) + backward.trace(backward_label)[1:]
+    print("Bidirectional finished" "path lenth: ", len(path),
+          "labels: ", len(forward.label_cell) + len(backward.label_cell))
+    return map_grid.path_to_coords(path)
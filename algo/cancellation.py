@@ -0,0 +1,106 @@
+import threading
+import time
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+
+from algo.grid_map import GridMap
+from algo.progress import SearchProgress, RouteImprovement
+
+# the search loops look at the token once every CHECK_INTERVAL expansions, it must be a power of two
+CHECK_INTERVAL = 1024
+CHECK_MASK = CHECK_INTERVAL - 1
+
+# the shortest time between two progress reports, in seconds
+PROGRESS_INTERVAL = 0.1
+
+# status of a search
+COMPLETED = 'completed'
+CANCELLED = 'cancelled'
+TIMED_OUT = 'timed out'
+
+
+class CancellationToken:
+    """
+    Cooperative stop signal and progress hook for the search loops.
+    A search stops when the event is set or the wall-clock deadline has passed. It then returns an empty path
+    and leaves its status and the route to the label closest to the destination on the token.
+    The event may be a threading.Event or a multiprocessing.Event shared with worker processes.
+    The search loops call checkpoint() every CHECK_INTERVAL expansions, which also reports the progress to the
+    optional callback, at most once per progress interval. Anytime searches hand each route they improve to the
+    optional improvement callback.
+    """
+
+    def __init__(self, event=None, deadline: Optional[float] = None,
+                 progress: Optional[Callable[[SearchProgress], None]] = None,
+                 progress_interval: float = PROGRESS_INTERVAL,
+                 improvement: Optional[Callable[[RouteImprovement], None]] = None):
+        self.event = event if event is not None else threading.Event()
+        self.deadline = deadline  # time.time() after which the search stops, None for no deadline
+        self.progress = progress
+        self.improvement = improvement
+        self.progress_interval = progress_interval
+        self.start_time = time.time()
+        self.next_report = self.start_time + progress_interval
+        self.status = COMPLETED
+        self.partial_path: list[tuple[int, int]] = []
+
+    @classmethod
+    def with_timeout(cls, timeout: Optional[float], event=None) -> 'CancellationToken':
+        return cls(event, None if timeout is None else time.time() + timeout)
+
+    def cancel(self):
+        self.event.set()
+
+    def checkpoint(self, expanded: int, frontier: int, best_f: float, goal_distance: int) -> bool:
+        """
+        Report the progress if the last report is old enough, then tell whether the search should stop.
+        """
+        if self.progress is not None:
+            now = time.time()
+            if now >= self.next_report:
+                self.next_report = now + self.progress_interval
+                self.progress(SearchProgress(expanded, frontier, best_f, goal_distance, now - self.start_time))
+        return self.should_stop()
+
+    def improve(self, path: list[tuple[int, int]], bound: float):
+        """
+        Report a better route found by an anytime search, with its suboptimality bound.
+        """
+        if self.improvement is not None:
+            self.improvement(RouteImprovement(path, bound, time.time() - self.start_time))
+
+    def should_stop(self) -> bool:
+        if self.event.is_set():
+            self.status = CANCELLED
+            return True
+        if self.deadline is not None and time.time() >= self.deadline:
+            self.status = TIMED_OUT
+            return True
+        return False
+
+    def stop(self, grid_map: GridMap, label_cell: Sequence[int], label_parent: Sequence[int], end: int) -> list:
+        """
+        Record the route to the label closest to the destination as partial result.
+        :return: the empty path returned by a stopped search
+        """
+        self.partial_path = grid_map.path_to_coords(closest_route(grid_map, label_cell, label_parent, end))
+        return []
+
+
+def closest_route(grid_map: GridMap, label_cell: Sequence[int], label_parent: Sequence[int], end: int) -> list[int]:
+    """
+    The route to the label with the smallest Manhattan distance to the end, the first one among equals.
+    """
+    if not len(label_cell):
+        return []
+    cells = np.asarray(label_cell)
+    end_x, end_y = divmod(end, grid_map.height)
+    x, y = np.divmod(cells, grid_map.height)
+    label = int(np.argmin(np.abs(x - end_x) + np.abs(y - end_y)))
+    route = []
+    while label != -1:
+        route.append(label_cell[label])
+        label = label_parent[label]
+    route.reverse()
+    return route
@@ -0,0 +1,486 @@
+import heapq
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from algo.astar import astar
+from algo.cancellation import CancellationToken
+from algo.grid_map import GridMap
+from algo.heuristics import goal_distance_table
+from algo.hierarchical import CLUSTER_SIZE, LOCAL_ROUTE_LENGTH, abstract_graph, block_of, block_distances, \
+    local_links, refine_leg
+from algo.station_graph import max_hop_length, station_hops, expand_leg
+
+# bumped whenever the saved arrays change meaning, files of another version are rebuilt
+CH_FORMAT_VERSION = 2
+# the environment variable that moves the saved hierarchies out of the user cache directory
+CH_CACHE_ENV = 'AIRWAY_GENIUS_CH_CACHE'
+# saved hierarchies kept in the directory, about 250 KB each for a 1200x800 map, the least recently used go first
+CH_CACHE_MAX_FILES = 64
+# a witness search gives up after settling this many nodes, and the shortcut is added anyway
+WITNESS_SETTLE_LIMIT = 64
+# the build looks at the token once every this many contracted nodes
+CONTRACT_CHECK_MASK = 255
+# middle node of an edge of the original graph
+NO_MIDDLE = -1
+
+# hierarchies of the most recent forbidden masks, keyed by forbidden mask fingerprint
+HIERARCHY_CACHE_SIZE = 4
+hierarchy_cache: OrderedDict[str, 'ContractionHierarchy'] = OrderedDict()
+cache_lock = threading.Lock()
+
+
+def default_cache_dir() -> str:
+    """
+    The directory of the saved hierarchies, one file per forbidden mask, so a map opened again doesn't rebuild its
+    hierarchy. It is CH_CACHE_ENV if set, otherwise airway_genius/contraction in the user cache (%LOCALAPPDATA% on
+    Windows, $XDG_CACHE_HOME or ~/.cache elsewhere), never the package directory, which may be read-only or shared
+    between installs. It holds at most CH_CACHE_MAX_FILES files.
+    """
+    if os.environ.get(CH_CACHE_ENV):
+        return os.environ[CH_CACHE_ENV]
+    if os.name == 'nt':
+        root = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        root = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(root, 'airway_genius', 'contraction')
+
+
+# read once at import, may be replaced before the first search
+CH_CACHE_DIR = default_cache_dir()
+
+
+class ContractionHierarchy:
+    """
+    A contraction hierarchy of the transitions of the abstract graph of a map, fuel and refuel stations are ignored.
+    The nodes are contracted one at a time, in the order of their rank. Contracting a node removes it and links its
+    remaining neighbors by shortcuts where the node was on their only shortest path, so the edges kept for a node,
+    stored in up_start/up_target/up_length/up_middle like a CSR matrix, all lead to nodes of higher rank. A shortest
+    route always climbs the ranks and then goes down, so a query only searches upward from both of its ends.
+    """
+
+    def __init__(self, cells: np.ndarray, up_start: np.ndarray, up_target: np.ndarray, up_length: np.ndarray,
+                 up_middle: np.ndarray, build_seconds: float, loaded: bool):
+        self.cells = cells.tolist()  # flat index of each node
+        self.node_index = {cell: node for node, cell in enumerate(self.cells)}
+        self.up_start = up_start.tolist()  # first upward edge of each node, and the end of the edges
+        self.up_target = up_target.tolist()
+        self.up_length = up_length.tolist()
+        self.up_middle = up_middle.tolist()  # the contracted node a shortcut skips, NO_MIDDLE for original edges
+        self.build_seconds = build_seconds
+        self.loaded = loaded  # read from CH_CACHE_DIR rather than built
+        self.stored_bytes = sum(array.nbytes for array in (cells, up_start, up_target, up_length, up_middle))
+
+    def stats(self) -> dict[str, float]:
+        """
+        The size of the hierarchy and the time it took to build, to tell whether a map is worth one.
+        """
+        return {'nodes': len(self.cells), 'edges': len(self.up_target),
+                'shortcuts': sum(middle != NO_MIDDLE for middle in self.up_middle),
+                'build_seconds': round(self.build_seconds, 3), 'bytes': self.stored_bytes, 'loaded': self.loaded}
+
+    def middle(self, node: int, other: int) -> int:
+        """
+        The middle node of the edge between two nodes, kept as an upward edge of the one of lower rank.
+        """
+        for lower, upper in ((node, other), (other, node)):
+            for edge in range(self.up_start[lower], self.up_start[lower + 1]):
+                if self.up_target[edge] == upper:
+                    return self.up_middle[edge]
+        raise KeyError((node, other))
+
+    def unpack(self, nodes: list[int]) -> list[int]:
+        """
+        Replace the shortcuts between consecutive nodes by the edges of the original graph they stand for.
+        :return: the nodes of the original graph, from the first node to the last
+        """
+        route = [nodes[0]]
+        # edges still to walk, the next one on top
+        legs = list(zip(nodes, nodes[1:]))[::-1]
+        while legs:
+            source, target = legs.pop()
+            middle = self.middle(source, target)
+            if middle == NO_MIDDLE:
+                route.append(target)
+            else:
+                # the middle node was contracted before both ends, so both of its edges are kept
+                legs.append((middle, target))
+                legs.append((source, middle))
+        return route
+
+
+def witness_distances(graph: list[dict[int, tuple[int, int]]], source: int, skipped: int, targets: set[int],
+                      limit: int) -> dict[int, int]:
+    """
+    Distances from source without going through the skipped node, searched only until every target is settled, the
+    distance exceeds limit or WITNESS_SETTLE_LIMIT nodes are settled.
+    """
+    distances = {source: 0}
+    priority_queue = [(0, source)]
+    settled = 0
+    remaining = len(targets)
+    while priority_queue and remaining and settled < WITNESS_SETTLE_LIMIT:
+        distance, node = heapq.heappop(priority_queue)
+        if distance > distances[node]:
+            continue
+        if distance > limit:
+            break
+        settled += 1
+        if node in targets:
+            remaining -= 1
+        for neighbor, (length, _) in graph[node].items():
+            if neighbor == skipped:
+                continue
+            next_distance = distance + length
+            if next_distance < distances.get(neighbor, limit + 1):
+                distances[neighbor] = next_distance
+                heapq.heappush(priority_queue, (next_distance, neighbor))
+    return distances
+
+
+def needed_shortcuts(graph: list[dict[int, tuple[int, int]]], node: int) -> list[tuple[int, int, int]]:
+    """
+    The shortcuts that contracting a node adds, one for each pair of its neighbors without a witness path as short as
+    the path through the node.
+    :return: the (neighbor, other neighbor, length) of every shortcut
+    """
+    neighbors = [(neighbor, length) for neighbor, (length, _) in graph[node].items()]
+    shortcuts = []
+    for i, (source, source_length) in enumerate(neighbors[:-1]):
+        through = {target: source_length + length for target, length in neighbors[i + 1:]}
+        distances = witness_distances(graph, source, node, set(through), max(through.values()))
+        for target, length in through.items():
+            if distances.get(target, length + 1) > length:
+                shortcuts.append((source, target, length))
+    return shortcuts
+
+
+def contract(adjacency: list[list[tuple[int, int]]], token: Optional[CancellationToken] = None) \
+        -> Optional[tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Contract every node of a graph, the node that adds the fewest shortcuts for the edges it removes first.
+    The priority of a node is its edge difference plus the number of its neighbors already contracted, which spreads
+    the contraction over the map. It is only computed again when the node comes to the top of the queue.
+    :param adjacency: the (neighbor, length) of each node
+    :param token: checked every CONTRACT_CHECK_MASK + 1 nodes
+    :return: the upward edges in CSR form, (start, target, length, middle), None if stopped by the token
+    """
+    count = len(adjacency)
+    # the remaining edges, (length, middle) by neighbor, only between nodes not contracted yet
+    graph: list[dict[int, tuple[int, int]]] = [{} for _ in range(count)]
+    for node, neighbors in enumerate(adjacency):
+        for neighbor, length in neighbors:
+            if neighbor != node and length < graph[node].get(neighbor, (length + 1,))[0]:
+                graph[node][neighbor] = (length, NO_MIDDLE)
+    contracted_neighbors = [0] * count
+
+    def priority(node: int) -> int:
+        return len(needed_shortcuts(graph, node)) - len(graph[node]) + contracted_neighbors[node]
+
+    priority_queue = [(priority(node), node) for node in range(count)]
+    heapq.heapify(priority_queue)
+    upward: list[list[tuple[int, int, int]]] = [[] for _ in range(count)]
+    contracted = 0
+    while priority_queue:
+        if token is not None and not contracted & CONTRACT_CHECK_MASK and \
+                token.checkpoint(contracted, len(priority_queue), -1, -1):
+            return None
+        _, node = heapq.heappop(priority_queue)
+        current = priority(node)
+        if priority_queue and current > priority_queue[0][0]:
+            heapq.heappush(priority_queue, (current, node))
+            continue
+        for source, target, length in needed_shortcuts(graph, node):
+            if length < graph[source].get(target, (length + 1,))[0]:
+                graph[source][target] = (length, node)
+                graph[target][source] = (length, node)
+        for neighbor, (length, middle) in graph[node].items():
+            upward[node].append((neighbor, length, middle))
+            del graph[neighbor][node]
+            contracted_neighbors[neighbor] += 1
+        graph[node] = {}
+        contracted += 1
+
+    up_start = np.zeros(count + 1, dtype=np.int32)
+    up_start[1:] = np.cumsum([len(edges) for edges in upward])
+    edges = [edge for node_edges in upward for edge in node_edges]
+    up_target = np.array([target for target, _, _ in edges], dtype=np.int32)
+    up_length = np.array([length for _, length, _ in edges], dtype=np.int32)
+    up_middle = np.array([middle for _, _, middle in edges], dtype=np.int32)
+    return up_start, up_target, up_length, up_middle
+
+
+def hierarchy_file(grid_map: GridMap) -> str:
+    return os.path.join(CH_CACHE_DIR, grid_map.forbidden_fingerprint() + '.npz')
+
+
+def evict_saved_hierarchies():
+    """
+    Delete the least recently used saved hierarchies beyond CH_CACHE_MAX_FILES, by modification time, which a load
+    refreshes.
+    """
+    try:
+        with os.scandir(CH_CACHE_DIR) as entries:
+            saved = [(entry.stat().st_mtime, entry.path) for entry in entries
+                     if entry.is_file() and entry.name.endswith('.npz') and not entry.name.endswith('.partial.npz')]
+    except OSError:
+        return
+    saved.sort()
+    for _, path in saved[:max(len(saved) - CH_CACHE_MAX_FILES, 0)]:
+        try:
+            os.remove(path)
+        except OSError:
+            # already removed by another process
+            pass
+
+
+def load_hierarchy(grid_map: GridMap) -> Optional[ContractionHierarchy]:
+    """
+    Read the saved hierarchy of a map, None if there is none, it can't be read, or it was saved by another format
+    version or with another CLUSTER_SIZE.
+    """
+    path = hierarchy_file(grid_map)
+    try:
+        with np.load(path) as saved:
+            if int(saved['version']) != CH_FORMAT_VERSION or int(saved['cluster_size']) != CLUSTER_SIZE:
+                return None
+            hierarchy = ContractionHierarchy(saved['cells'], saved['up_start'], saved['up_target'],
+                                             saved['up_length'], saved['up_middle'], float(saved['build_seconds']),
+                                             True)
+        # the file is now the most recently used one
+        os.utime(path)
+        return hierarchy
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def save_hierarchy(grid_map: GridMap, cells: np.ndarray, up_start: np.ndarray, up_target: np.ndarray,
+                   up_length: np.ndarray, up_middle: np.ndarray, build_seconds: float):
+    """
+    Save the hierarchy of a map, a failed save only costs a rebuild the next time the map is opened.
+    """
+    path = hierarchy_file(grid_map)
+    # one partial file per process, so two processes saving the same map don't write into one file
+    partial = '%s.%d.partial.npz' % (path, os.getpid())
+    try:
+        os.makedirs(CH_CACHE_DIR, exist_ok=True)
+        np.savez_compressed(partial, version=np.int64(CH_FORMAT_VERSION), cluster_size=np.int64(CLUSTER_SIZE),
+                            cells=cells, up_start=up_start, up_target=up_target, up_length=up_length,
+                            up_middle=up_middle, build_seconds=np.float64(build_seconds))
+        # another process reading the file never sees half of it
+        os.replace(partial, path)
+    except OSError as error:
+        print("contraction hierarchy not saved:", error)
+        return
+    evict_saved_hierarchies()
+
+
+def contraction_hierarchy(grid_map: GridMap,
+                          token: Optional[CancellationToken] = None) -> Optional[ContractionHierarchy]:
+    """
+    The contraction hierarchy of a map, from memory, from CH_CACHE_DIR or built from the abstract graph of the map.
+    The hierarchy is built over the transitions of the abstract graph rather than over every pixel: the pixel graph
+    of a full map has about a million nodes, too many to contract in Python. The stations are left out, the routes
+    through the hierarchy ignore fuel and reach a station like any other cell, so moving a carrier or a tanker
+    doesn't rebuild the hierarchy, only editing the forbidden areas does.
+    :param token: checked while the abstract graph is built and the nodes contracted, a stopped build isn't kept
+    :return: the hierarchy, None if stopped by the token
+    """
+    key = grid_map.forbidden_fingerprint()
+    with cache_lock:
+        if key in hierarchy_cache:
+            hierarchy_cache.move_to_end(key)
+            return hierarchy_cache[key]
+
+    hierarchy = load_hierarchy(grid_map)
+    if hierarchy is None:
+        build_start = time.time()
+        free_space = GridMap.from_arrays(grid_map.map_size, grid_map.forbidden_mask,
+                                         np.zeros_like(grid_map.cell_type))
+        graph = abstract_graph(free_space, token)
+        if graph is None:
+            return None
+        upward = contract(graph.adjacency, token)
+        if upward is None:
+            return None
+        build_seconds = time.time() - build_start
+        cells = np.array(graph.cells, dtype=np.int64)
+        save_hierarchy(grid_map, cells, *upward, build_seconds)
+        hierarchy = ContractionHierarchy(cells, *upward, build_seconds, False)
+    print("contraction hierarchy", hierarchy.stats())
+
+    with cache_lock:
+        hierarchy_cache[key] = hierarchy
+        if len(hierarchy_cache) > HIERARCHY_CACHE_SIZE:
+            hierarchy_cache.popitem(last=False)
+    return hierarchy
+
+
+def upward_search(hierarchy: ContractionHierarchy, sources: list[tuple[int, int]]) \
+        -> tuple[dict[int, int], dict[int, int], list[tuple[int, int]]]:
+    """
+    Start a search of the upward edges from sources.
+    :param sources: the (node, distance) the search starts from
+    :return: the distances, the parents and the priority queue of the search
+    """
+    distances = {}
+    parents = {}
+    for node, distance in sources:
+        if distance < distances.get(node, distance + 1):
+            distances[node] = distance
+            parents[node] = -1
+    priority_queue = [(distance, node) for node, distance in distances.items()]
+    heapq.heapify(priority_queue)
+    return distances, parents, priority_queue
+
+
+def hierarchy_query(hierarchy: ContractionHierarchy, sources: list[tuple[int, int]],
+                    targets: list[tuple[int, int]]) -> Optional[tuple[int, list[int]]]:
+    """
+    Bidirectional upward Dijkstra: both searches only follow upward edges, the shortest route is the best node
+    settled by both, and each search stops once its queue holds nothing shorter than the best route found.
+    :param sources: the (node, distance) of the nodes the route may start from
+    :param targets: the (node, distance) of the nodes the route may end at
+    :return: the length of the route and its nodes of the original graph, None if no route found
+    """
+    searches = (upward_search(hierarchy, sources), upward_search(hierarchy, targets))
+    up_start, up_target, up_length = hierarchy.up_start, hierarchy.up_target, hierarchy.up_length
+    best = -1
+    meeting = -1
+    side = 0
+    while searches[0][2] or searches[1][2]:
+        if not searches[side][2]:
+            side = 1 - side
+        distances, parents, priority_queue = searches[side]
+        distance, node = heapq.heappop(priority_queue)
+        if best != -1 and distance >= best:
+            priority_queue.clear()
+            continue
+        if distance > distances[node]:
+            side = 1 - side
+            continue
+        other = searches[1 - side][0].get(node)
+        if other is not None and (best == -1 or distance + other < best):
+            best = distance + other
+            meeting = node
+        for edge in range(up_start[node], up_start[node + 1]):
+            neighbor = up_target[edge]
+            next_distance = distance + up_length[edge]
+            if next_distance < distances.get(neighbor, next_distance + 1):
+                distances[neighbor] = next_distance
+                parents[neighbor] = node
+                heapq.heappush(priority_queue, (next_distance, neighbor))
+        side = 1 - side
+    if meeting == -1:
+        return None
+
+    halves = []
+    for distances, parents, _ in searches:
+        half = []
+        node = meeting
+        while node != -1:
+            half.append(node)
+            node = parents[node]
+        halves.append(half)
+    # the forward half is walked back from the meeting node, the backward half already leads to the target
+    return best, hierarchy.unpack(halves[0][::-1] + halves[1][1:])
+
+
+def hierarchy_route(grid_map: GridMap, hierarchy: ContractionHierarchy, start: int, end: int) -> Optional[list[int]]:
+    """
+    The shortest route between two cells over the abstract graph, through the hierarchy, expanded back to cells.
+    Like hierarchical_search(), a cell that isn't a node is linked to the nodes of its block, and two such cells of
+    one block may also be linked inside it. A short route is replaced by the grid route if that one is shorter.
+    :return: the flat indices of the cells from start to end, None if no route found
+    """
+    if start == end:
+        return [start]
+    node_index = hierarchy.node_index
+    sources = [(node_index[start], 0)] if start in node_index else local_links(grid_map, node_index, start)
+    targets = [(node_index[end], 0)] if end in node_index else local_links(grid_map, node_index, end)
+    found = hierarchy_query(hierarchy, sources, targets)
+
+    origin_x, origin_y, free = block_of(grid_map, start)
+    if block_of(grid_map, end)[:2] == (origin_x, origin_y):
+        start_x, start_y = grid_map.position(start)
+        end_x, end_y = grid_map.position(end)
+        inside = int(block_distances(free, [(start_x - origin_x, start_y - origin_y)])[0][end_x - origin_x,
+                                                                                          end_y - origin_y])
+        if inside > 0 and (found is None or inside <= found[0]):
+            return refine_leg(grid_map, start, end)
+    if found is None:
+        return None
+
+    if found[0] <= LOCAL_ROUTE_LENGTH:
+        length = int(grid_map.distance_field([end], found[0])[start])
+        if 0 < length < found[0]:
+            return expand_leg(grid_map, start, end, length)
+    route = [hierarchy.cells[node] for node in found[1]]
+    if route[0] != start:
+        route.insert(0, start)
+    if route[-1] != end:
+        route.append(end)
+    path = [start]
+    for source, target in zip(route, route[1:]):
+        path += refine_leg(grid_map, source, target)[1:]
+    return path
+
+
+def has_fuel(grid_map: GridMap, path: list[int], fuel_cost: int, max_fuel: int) -> bool:
+    """
+    Whether a path leaving with a full tank can be flown to its end.
+    """
+    refuel = grid_map.refuel
+    fuel = max_fuel
+    for cell in path[1:]:
+        fuel -= fuel_cost
+        if fuel < 0:
+            return False
+        if refuel[cell]:
+            fuel = max_fuel
+    return True
+
+
+def contraction_search(map_grid: GridMap, start_pos, end_pos, fuel_cost, max_fuel,
+                       token: Optional[CancellationToken] = None):
+    """
+    Route through the contraction hierarchy of the map, built once per map and then shared by every query on it.
+    The hierarchy ignores fuel. If its route runs out of fuel, the route is repaired at station granularity: the
+    shortest sequence of stations is found on the station graph, and each hop is routed through the hierarchy again,
+    or expanded on the grid when the route of the hierarchy doesn't fit in one tank. Like HPA*, the route crosses
+    blocks at fixed transitions, so it may be slightly longer than the shortest one.
+    :param token: stops the search when cancelled or past its deadline while the hierarchy or the station matrix is
+    computed
+    :return: the path from start_pos to end_pos, or an empty list if no path found
+    """
+    start = map_grid.index(start_pos)
+    end = map_grid.index(end_pos)
+    if map_grid.blocked[start] or map_grid.blocked[end]:
+        return []
+    hierarchy = contraction_hierarchy(map_grid, token)
+    if hierarchy is None:
+        return []
+
+    path = hierarchy_route(map_grid, hierarchy, start, end)
+    if path is None:
+        print("Contraction hierarchy found no route, falling back to A*")
+        return astar(max_fuel, fuel_cost, set(), [], [], start_pos, end_pos, map_grid.map_size, map_grid,
+                     goal_distance_table(map_grid, end_pos), token)
+    repaired_hops = 0
+    if not has_fuel(map_grid, path, fuel_cost, max_fuel):
+        hops = station_hops(map_grid, start, end, max_hop_length(fuel_cost, max_fuel), token)
+        if hops is None:
+            return []
+        path = [start]
+        for source, target, length in hops:
+            leg = hierarchy_route(map_grid, hierarchy, source, target)
+            if leg is None or not has_fuel(map_grid, leg, fuel_cost, max_fuel):
+                leg = expand_leg(map_grid, source, target, length)
+            path += leg[1:]
+        repaired_hops = len(hops)
+    print("Contraction hierarchy finished" "path lenth: ", len(path), "repaired hops: ", repaired_hops)
+    return map_grid.path_to_coords(path)
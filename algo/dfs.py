@@ -1,39 +1,7 @@
-from numpy import random
-import sys
+from typing import Optional
 
-global local_max_fuel
-global local_fuel_cost
-global local_forbidden_area_coords_list
-global local_carrier_airport_list
-global local_tanker_list
-global local_start_pos
-global local_end_pos
-global local_map_size
-global best_distance
-global shortest_path_coords_list
-global visited
-global local_forbidden_area
-global path_coords_list
-
-
-def get_neighbors(cur_pos):
-    """
-    get the neighbors of the current position
-    :param cur_pos: the current position
-    :return: the neighbors list
-    """
-    neighbors = []
-    x, y = cur_pos[0], cur_pos[1]
-    width, height = local_map_size[0], local_map_size[1]
-    if x - 1 >= 0:
-        neighbors.append((x - 1, y))
-    if x + 1 < width:
-        neighbors.append((x + 1, y))
-    if y - 1 >= 0:
-        neighbors.append((x, y - 1))
-    if y + 1 < height:
-        neighbors.append((x, y + 1))
-    return neighbors
+from algo.cancellation import CancellationToken, CHECK_MASK
+from algo.grid_map import GridMap
 
 
 def DFS(max_fuel: int,
@@ -43,80 +11,78 @@ def DFS(max_fuel: int,
         tanker_list: list[tuple[int, int]],
         start_pos: tuple[int, int],
         end_pos: tuple[int, int],
-        map_size: tuple[int, int]):
-    global best_distance
-    global shortest_path_coords_list
-    global local_max_fuel
-    global local_fuel_cost
-    global local_carrier_airport_list
-    global local_tanker_list
-    global local_start_pos
-    global local_end_pos
-    global local_map_size
-    global visited
-    global local_forbidden_area
-    global path_coords_list
-    local_max_fuel = max_fuel
-    local_carrier_airport_list = carrier_airport_list
-    local_tanker_list = tanker_list
-    local_start_pos = start_pos
-    local_end_pos = end_pos
-    local_fuel_cost = fuel_cost
-    local_map_size = map_size
-    best_distance = local_map_size[0] * local_map_size[1]
-    shortest_path_coords_list = None
-    local_forbidden_area = forbidden_area
-    path_coords_list = []
-    visited = dict()
-    # set the maximum recursion depth
-    sys.setrecursionlimit(2500)
-    DFS_auxiliary(max_fuel, start_pos, 0)
-    print("DFS finished")
-    print(best_distance)
-    return shortest_path_coords_list if shortest_path_coords_list is not None else []
+        map_size: tuple[int, int],
+        grid_map: Optional[GridMap] = None,
+        token: Optional[CancellationToken] = None):
+    """
+    Branch and bound depth first search with an explicit stack.
+    All the state is local, so the search is re-entrant and can run in several threads at once.
+    A branch is cut when its distance plus the Manhattan distance to the destination can't beat the best route found,
+    or when the same cell has already been entered with no more distance and no less fuel.
+    :param token: stops the search when cancelled or past its deadline, the partial result is the best route found
+    so far, or the current branch if there is none
+    :return: the shortest path found, or an empty list if no path found
+    """
+    if grid_map is None:
+        grid_map = GridMap(map_size, forbidden_area, carrier_airport_list, tanker_list)
+    refuel = grid_map.refuel
+    height = grid_map.height
+    start = grid_map.index(start_pos)
+    end = grid_map.index(end_pos)
+    end_x, end_y = end_pos
 
+    # a fuel-feasible route may pass a cell once per refuel, so this bounds the length of any useful route
+    best_distance = grid_map.size * (len(grid_map.refuel_indices()) + 1)
+    shortest_path = None
+    # the distance and fuel of the last entry into each cell
+    visited_distance = [best_distance] * grid_map.size
+    visited_fuel = [-1] * grid_map.size
 
-def DFS_auxiliary(cur_fuel: int, cur_pos: tuple[int, int], cur_distance: int):
-    global best_distance
-    global shortest_path_coords_list
-    global local_max_fuel
-    global local_fuel_cost
-    global local_forbidden_area_coords_list
-    global local_carrier_airport_list
-    global local_tanker_list
-    global local_start_pos
-    global local_end_pos
-    global local_map_size
-    global visited
-    global local_forbidden_area
-    global path_coords_list
-    path_coords_list.append(cur_pos)
-    if cur_fuel < 0:
-        return
-    if cur_distance >= best_distance:
-        return
-    if cur_pos[0] == local_end_pos[0] and cur_pos[1] == local_end_pos[1]:
-        if cur_distance < best_distance:
+    path = []  # the cells of the current branch, the depth of a cell equals its distance
+    stack = [(start, 0, max_fuel)]  # store the cell, distance and remaining fuel
+    popped = 0
+    while stack:
+        popped += 1
+        if not popped & CHECK_MASK and token is not None and \
+                token.checkpoint(popped, len(stack), best_distance if shortest_path is not None else -1,
+                                 grid_map.manhattan(stack[-1][0], end)):
+            token.partial_path = grid_map.path_to_coords(shortest_path if shortest_path is not None else path)
+            return []
+        cur_pos, cur_distance, cur_fuel = stack.pop()
+        # backtrack the current branch to the parent of this entry
+        del path[cur_distance:]
+        path.append(cur_pos)
+
+        x, y = divmod(cur_pos, height)
+        if cur_distance + abs(x - end_x) + abs(y - end_y) >= best_distance:
+            continue
+        if cur_pos == end:
             best_distance = cur_distance
-            shortest_path_coords_list = path_coords_list.copy()
-        return
-    if cur_fuel == 0:
-        return
-    visited.update({cur_pos: cur_fuel})
-    neighbors = get_neighbors(cur_pos)
-    if random.randint(0, 20) == 0:
-        random.shuffle(neighbors)
-    for neighbor in neighbors:
-    # for neighbor in get_neighbors(cur_pos):
-        if neighbor in local_forbidden_area:
+            shortest_path = path.copy()
+            continue
+        if visited_distance[cur_pos] <= cur_distance and visited_fuel[cur_pos] >= cur_fuel:
+            # an entry that is no worse has already been explored, or is an ancestor of this one
+            continue
+        visited_distance[cur_pos] = cur_distance
+        visited_fuel[cur_pos] = cur_fuel
+        if cur_fuel < fuel_cost:
             continue
-        is_refuel = neighbor in local_carrier_airport_list or neighbor in local_tanker_list
-        is_visited = neighbor in visited
-        if is_refuel and not is_visited:
-            DFS_auxiliary(local_max_fuel, neighbor, cur_distance + 1)
-            path_coords_list.pop()
-        elif is_visited and cur_fuel - local_fuel_cost > visited[neighbor] or not is_visited:
-            new_fuel = cur_fuel - local_fuel_cost
-            DFS_auxiliary(new_fuel, neighbor, cur_distance + 1)
-            path_coords_list.pop()
-    return
+
+        children = []
+        new_distance = cur_distance + 1
+        for neighbor in grid_map.neighbors(cur_pos):
+            new_fuel = max_fuel if refuel[neighbor] else cur_fuel - fuel_cost
+            if visited_distance[neighbor] <= new_distance and visited_fuel[neighbor] >= new_fuel:
+                continue
+            neighbor_x, neighbor_y = divmod(neighbor, height)
+            lower_bound = new_distance + abs(neighbor_x - end_x) + abs(neighbor_y - end_y)
+            if lower_bound < best_distance:
+                children.append((lower_bound, neighbor, new_fuel))
+        # push the most promising child last so it is explored first
+        children.sort(reverse=True)
+        for _, neighbor, new_fuel in children:
+            stack.append((neighbor, new_distance, new_fuel))
+
+    print("DFS finished")
+    print(best_distance)
+    return grid_map.path_to_coords(shortest_path) if shortest_path is not None else []
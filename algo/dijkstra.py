@@ -1,110 +1,94 @@
-
-import heapq
-import random
-
-
-class Node:
-    def __init__(self, node_type=0):
-        self.node_type = node_type
-        self.visited = 0
-
-    def __str__(self):
-        return f"({self.node_type}, {self.visited})"
-
-    __repr__ = __str__
-
-def init_map(map_size, forbidden=None, carrier_airport=None, tanker=None):
-    if forbidden is None:
-        forbidden = []
-    if carrier_airport is None:
-        carrier_airport = []
-    if tanker is None:
-        tanker = []
-
-    map_grid = []
-    forbidden_set = set(forbidden)
-    carrier_set = set(carrier_airport)
-    tanker_set = set(tanker)
-
-    for i in range(map_size[0]):
-        row = []
-        for j in range(map_size[1]):
-            node_type = 0
-            if (i, j) in forbidden_set:
-                visited = 1
-            else:
-                visited = 0
-                if (i, j) in carrier_set:
-                    node_type = 1
-                elif (i, j) in tanker_set:
-                    node_type = 2
-            node = Node(node_type)
-            node.visited = visited
-            row.append(node)
-        map_grid.append(row)
-    return map_grid
-
-def dijkstra_search(map_grid, start_pos, end_pos, fuel_cost, max_fuel):
-    size = len(map_grid)
-    distances = {(i, j): float('inf') for i in range(len(map_grid)) for j in range(len(map_grid[0]))}
-    distances[start_pos] = 0
-    previous_nodes = {start_pos: None}
-    # store the distance, position, and fuel remaining
-    priority_queue = [(0, start_pos, max_fuel)]
-    fuel_used = {(i, j): float('inf') for i in range(len(map_grid)) for j in range(len(map_grid[0]))}
-    # initialize the fuel used at the start position to 0
-    fuel_used[start_pos] = 0
-    # 4 directions: north, south, east, west
-    direction = [(0, 1), (0, -1), (1, 0), (-1, 0)]
-
-    while priority_queue:
-        # get the current distance, position, and fuel remaining
-        current_distance, (current_x, current_y), current_fuel = heapq.heappop(priority_queue)
-
-        # if the current position is forbidden, skip it
-        if map_grid[current_x][current_y].visited == 1:
-            continue
-
-        # if the fuel remaining is 0, skip it
-        if current_fuel <= 0:
-            continue
-
-        # if the current position is a carrier or airport, refuel
-        if map_grid[current_x][current_y].node_type in [1, 2]:
-            current_fuel = max_fuel
-
-        # if the current position is the end position, break the loop
-        if (current_x, current_y) == end_pos:
-            break
-
-        # get the neighbors of the current position
-        neighbors = [(current_x - 1, current_y), (current_x + 1, current_y), (current_x, current_y - 1),
-                     (current_x, current_y + 1)]
-        # iterate through the neighbors
-        for (nx, ny) in neighbors:
-            if 0 <= nx < len(map_grid) and 0 <= ny < len(map_grid[0]) and map_grid[nx][ny].visited == 0:
-                if map_grid[nx][ny].node_type in [1, 2]:
-                    distance = current_distance + 1  # no random weight for refueling stations
-                else:
-                    distance = current_distance + 1
-                if distance < distances[(nx, ny)] or distance == distances[(nx, ny)] and current_fuel - fuel_cost > fuel_used[(nx, ny)]:
-                    distances[(nx, ny)] = distance
-                    fuel_needed = current_fuel - fuel_cost
-                    if fuel_needed >= 0:
-                        fuel_used[(nx, ny)] = fuel_needed
-                        previous_nodes[(nx, ny)] = (current_x, current_y)
-                        heapq.heappush(priority_queue, (distance, (nx, ny), fuel_needed))
-    # if the distance at the end position is infinity, return an empty list
-    if distances[end_pos] == float('infinity'):
+from array import array
+from typing import Optional
+
+from algo.cancellation import CancellationToken, CHECK_MASK
+from algo.grid_map import GridMap
+from algo.priority_queue import BucketQueue
+from algo.workspace import search_workspace
+
+
+def dijkstra_search(map_grid: GridMap, start_pos, end_pos, fuel_cost, max_fuel,
+                    token: Optional[CancellationToken] = None):
+    """
+    Label-setting Dijkstra over (cell, remaining fuel) states.
+    A label is kept only if no other label at the same cell is both closer and has more fuel left,
+    so the first label popped at the end position is the shortest fuel-feasible route.
+    :param map_grid: the grid map
+    :param start_pos: the start position
+    :param end_pos: the end position
+    :param fuel_cost: the fuel cost per pixel
+    :param max_fuel: the fuel capacity, refilled at carriers, airports and tankers
+    :param token: stops the search when cancelled or past its deadline
+    :return: the path from start_pos to end_pos, or an empty list if no path found
+    """
+    start = map_grid.index(start_pos)
+    end = map_grid.index(end_pos)
+    refuel = map_grid.refuel
+
+    with search_workspace(map_grid) as workspace:
+        # labels are stored in parallel compact arrays, a label is addressed by its index
+        label_cell = array('l', [start])
+        label_dist = array('l', [0])
+        label_fuel = array('l', [max_fuel])
+        label_parent = array('l', [-1])
+        # the label with the most fuel left at each cell, stamped with the base of the search. Labels are created in
+        # non-decreasing distance order, so a new label is dominated unless it has more fuel than every label already
+        # created at its cell
+        base = workspace.begin()
+        best_label = workspace.stamped('label')
+        best_label[start] = base
+        # every move costs one, the distances are popped in non-decreasing order from one bucket per distance
+        priority_queue = BucketQueue(0, 0)  # store the label by its distance
+
+        found = -1
+        popped = 0
+        while priority_queue:
+            popped += 1
+            if not popped & CHECK_MASK and token is not None:
+                head_distance, head_label = priority_queue.peek()
+                if token.checkpoint(popped, len(priority_queue), head_distance,
+                                    map_grid.manhattan(label_cell[head_label], end)):
+                    return token.stop(map_grid, label_cell, label_parent, end)
+            current_distance, label = priority_queue.pop()
+            current = label_cell[label]
+
+            # skip the label if a label with more fuel reached the cell no later
+            best = best_label[current] - base
+            if best != label and label_dist[best] <= current_distance:
+                continue
+
+            if current == end:
+                found = label
+                break
+
+            current_fuel = label_fuel[label]
+            if current_fuel < fuel_cost:
+                continue
+
+            distance = current_distance + 1
+            for neighbor in map_grid.neighbors(current):
+                # refuel if the neighbor is a carrier, airport or tanker
+                new_fuel = max_fuel if refuel[neighbor] else current_fuel - fuel_cost
+                best = best_label[neighbor]
+                if best >= base and new_fuel <= label_fuel[best - base]:
+                    continue
+                new_label = len(label_cell)
+                label_cell.append(neighbor)
+                label_dist.append(distance)
+                label_fuel.append(new_fuel)
+                label_parent.append(label)
+                best_label[neighbor] = base + new_label
+                priority_queue.push(distance, new_label)
+
+    # if the end position has never been reached, return an empty list
+    if found == -1:
         return []
 
     path = []
-    current_node = end_pos
-    while current_node is not None:
-        path.append(current_node)
-        current_node = previous_nodes[current_node]
+    while found != -1:
+        path.append(label_cell[found])
+        found = label_parent[found]
     path.reverse()
 
-    print("Dijkstra finished" "path lenth: ", len(path))
-    return path
-
+    print("Dijkstra finished" "path lenth: ", len(path), "labels: ", len(label_cell))
+    return map_grid.path_to_coords(path)
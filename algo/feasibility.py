@@ -0,0 +1,177 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from algo.grid_map import GridMap
+from algo.station_graph import max_hop_length
+
+# reason codes of the queries rejected before searching, returned as the one-element path [code]
+# like the other sentinels of the GUI (-2 not launched, -3 timed out, -4 failed)
+FEASIBLE = 0
+BLOCKED_ENDPOINT = -5
+SEPARATED = -6
+OUT_OF_FUEL_RANGE = -7
+REASON_MESSAGES = {
+    BLOCKED_ENDPOINT: "The start or end position is inside a forbidden area.",
+    SEPARATED: "The start and end positions are separated by forbidden areas.",
+    OUT_OF_FUEL_RANGE: "No chain of carriers, airports and tankers within fuel range links the start and end positions.",
+}
+
+# station regions of the most recent maps, keyed by map fingerprint
+STATION_REGIONS_CACHE_SIZE = 8
+station_regions_cache: OrderedDict[str, 'StationRegions'] = OrderedDict()
+cache_lock = threading.Lock()
+
+
+class StationRegions:
+    """
+    Every free cell assigned to its nearest refuel station by one multi-source wavefront, with the shortest link
+    between each pair of neighboring regions.
+    Two stations are within one tank of each other, directly or through other stations, exactly when a chain of
+    region links no longer than a tank joins them: a route of length L from station i to station j crosses regions
+    at adjacent cells a, b, and the link d(a) + 1 + d(b) across them is at most d(i, a) + 1 + d(j, b) <= L.
+    So the free-space components and the fuel clusters of the stations both come from the links.
+    """
+
+    def __init__(self, stations: np.ndarray, owner: np.ndarray, links: np.ndarray):
+        self.stations = stations  # flat indices of the stations
+        self.owner = owner  # station number of the region of each cell, -1 for cells no station can reach
+        self.links = links  # (station, station, length) of the shortest link between two neighboring regions
+        self.components = cluster_roots(len(stations), links, None)
+        self.fuel_clusters: dict[int, np.ndarray] = {}  # roots of the fuel clusters, by max hop
+
+    def fuel_cluster_roots(self, max_hop: Optional[int]) -> np.ndarray:
+        if max_hop not in self.fuel_clusters:
+            self.fuel_clusters[max_hop] = cluster_roots(len(self.stations), self.links, max_hop)
+        return self.fuel_clusters[max_hop]
+
+
+def cluster_roots(count: int, links: np.ndarray, max_hop: Optional[int]) -> np.ndarray:
+    """
+    Union-find over the stations, joining the regions whose link is no longer than the max hop.
+    :return: the root station of each station
+    """
+    parent = list(range(count))
+
+    def find(node: int) -> int:
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for first, second, length in links.tolist():
+        if max_hop is None or length <= max_hop:
+            first, second = find(first), find(second)
+            if first != second:
+                parent[max(first, second)] = min(first, second)
+    return np.array([find(node) for node in range(count)], dtype=np.int32)
+
+
+def station_regions(grid_map: GridMap) -> StationRegions:
+    """
+    Grow the regions of all the stations at once, one distance layer at a time, and find the links between them.
+    """
+    key = grid_map.fingerprint()
+    with cache_lock:
+        if key in station_regions_cache:
+            station_regions_cache.move_to_end(key)
+            return station_regions_cache[key]
+
+    width, height = grid_map.map_size
+    stations = grid_map.refuel_indices()
+    owner = np.full(grid_map.size, -1, dtype=np.int32)
+    distance = np.full(grid_map.size, -1, dtype=np.int32)
+    owner[grid_map.forbidden_mask] = -2  # never entered, reset at the end
+    owner[stations] = np.arange(len(stations), dtype=np.int32)
+    distance[stations] = 0
+    frontier = stations.astype(np.int64)
+    step = 0
+    while frontier.size:
+        step += 1
+        x = frontier // height
+        y = frontier - x * height
+        sides = (x > 0, x < width - 1, y > 0, y < height - 1)
+        candidates = np.concatenate((frontier[sides[0]] - height, frontier[sides[1]] + height,
+                                     frontier[sides[2]] - 1, frontier[sides[3]] + 1))
+        owners = np.concatenate([owner[frontier[side]] for side in sides])
+        free = owner[candidates] == -1
+        candidates, owners = candidates[free], owners[free]
+        # a cell reached by several regions in the same layer joins the first one
+        candidates, first = np.unique(candidates, return_index=True)
+        owner[candidates] = owners[first]
+        distance[candidates] = step
+        frontier = candidates
+    owner[grid_map.forbidden_mask] = -1
+
+    # links across every pair of horizontally or vertically adjacent cells of different regions
+    planes = owner.reshape(width, height), distance.reshape(width, height)
+    pairs = []
+    for first, second in (((slice(None, -1), slice(None)), (slice(1, None), slice(None))),
+                          ((slice(None), slice(None, -1)), (slice(None), slice(1, None)))):
+        first_owner, second_owner = planes[0][first].ravel(), planes[0][second].ravel()
+        crossing = (first_owner != second_owner) & (first_owner >= 0) & (second_owner >= 0)
+        lengths = planes[1][first].ravel()[crossing] + 1 + planes[1][second].ravel()[crossing]
+        pairs.append(np.stack((np.minimum(first_owner[crossing], second_owner[crossing]),
+                               np.maximum(first_owner[crossing], second_owner[crossing]), lengths), axis=1))
+    links = np.concatenate(pairs) if pairs else np.empty((0, 3), dtype=np.int32)
+    # keep the shortest link of each pair of regions
+    order = np.lexsort((links[:, 2], links[:, 1], links[:, 0]))
+    links = links[order]
+    first = np.ones(len(links), dtype=bool)
+    first[1:] = (links[1:, 0] != links[:-1, 0]) | (links[1:, 1] != links[:-1, 1])
+    regions = StationRegions(stations, owner, links[first])
+
+    with cache_lock:
+        station_regions_cache[key] = regions
+        if len(station_regions_cache) > STATION_REGIONS_CACHE_SIZE:
+            station_regions_cache.popitem(last=False)
+    return regions
+
+
+def precheck(grid_map: GridMap, start_pos: tuple[int, int], end_pos: tuple[int, int], fuel_cost: int,
+             max_fuel: int, diagonal: bool = False) -> int:
+    """
+    Tell whether a route can exist before searching for it.
+    When the start and the end are stations, which is always the case in the GUI, the answer is two lookups in the
+    cached station regions. Otherwise the stations within one tank of the start and of the end are found with two
+    bounded wavefronts.
+    :param diagonal: the search also moves diagonally, the regions and wavefronts only follow 4-connected moves and
+    could reject a route it finds, so only the endpoints are checked
+    :return: FEASIBLE, or the reason code of an impossible query
+    """
+    start = grid_map.index(start_pos)
+    end = grid_map.index(end_pos)
+    if grid_map.blocked[start] or grid_map.blocked[end]:
+        return BLOCKED_ENDPOINT
+    if start == end or diagonal:
+        return FEASIBLE
+    max_hop = max_hop_length(fuel_cost, max_fuel)
+    regions = station_regions(grid_map)
+    components = regions.components
+    clusters = regions.fuel_cluster_roots(max_hop)
+    start_owner, end_owner = regions.owner[start], regions.owner[end]
+    stations = regions.stations
+
+    if grid_map.refuel[start] and grid_map.refuel[end]:
+        if components[start_owner] != components[end_owner]:
+            return SEPARATED
+        return FEASIBLE if clusters[start_owner] == clusters[end_owner] else OUT_OF_FUEL_RANGE
+
+    # the start is flown from on a full tank, like a station
+    start_field = grid_map.distance_field([start], max_hop)
+    if start_field[end] >= 0:
+        return FEASIBLE
+    end_field = grid_map.distance_field([end], max_hop)
+    start_clusters = set(clusters[start_field[stations] >= 0].tolist())
+    if start_clusters & set(clusters[end_field[stations] >= 0].tolist()):
+        return FEASIBLE
+    if start_owner >= 0 and end_owner >= 0:
+        connected = components[start_owner] == components[end_owner]
+    elif max_hop is None:
+        connected = False
+    else:
+        # a component without any station, only a direct flight could have linked them
+        connected = grid_map.distance_field([start])[end] >= 0
+    return OUT_OF_FUEL_RANGE if connected else SEPARATED
@@ -0,0 +1,182 @@
+import hashlib
+import math
+from typing import Iterable, Optional
+
+import numpy as np
+
+# cell types stored in the cell type plane
+FREE = 0
+CARRIER_AIRPORT = 1
+TANKER = 2
+
+
+class GridMap:
+    """
+    Compact map representation shared by every search algorithm.
+    The map is stored as a uint8 cell type plane and a forbidden mask, both flattened,
+    so a cell is addressed by a single integer index: index = x * height + y.
+    """
+
+    def __init__(self,
+                 map_size: tuple[int, int],
+                 forbidden: Optional[Iterable[tuple[int, int]]] = None,
+                 carrier_airport: Optional[Iterable[tuple[int, int]]] = None,
+                 tanker: Optional[Iterable[tuple[int, int]]] = None):
+        self.map_size = (int(map_size[0]), int(map_size[1]))
+        self.width, self.height = self.map_size
+        self.size = self.width * self.height
+
+        self.forbidden_mask = np.zeros(self.size, dtype=bool)
+        self.forbidden_mask[self.__to_indices(forbidden)] = True
+        self.cell_type = np.zeros(self.size, dtype=np.uint8)
+        # carriers and airports take precedence over tankers, forbidden cells are never refuel points
+        self.cell_type[self.__to_indices(tanker)] = TANKER
+        self.cell_type[self.__to_indices(carrier_airport)] = CARRIER_AIRPORT
+        self.cell_type[self.forbidden_mask] = FREE
+
+        self.__build_views()
+
+    @classmethod
+    def from_arrays(cls, map_size: tuple[int, int], forbidden_mask: np.ndarray, cell_type: np.ndarray) -> 'GridMap':
+        """
+        Build a grid map from the planes of another one, e.g. planes read from shared memory.
+        :param map_size: the map size
+        :param forbidden_mask: the flattened bool forbidden mask
+        :param cell_type: the flattened uint8 cell type plane
+        """
+        grid_map = cls.__new__(cls)
+        grid_map.map_size = (int(map_size[0]), int(map_size[1]))
+        grid_map.width, grid_map.height = grid_map.map_size
+        grid_map.size = grid_map.width * grid_map.height
+        grid_map.forbidden_mask = forbidden_mask
+        grid_map.cell_type = cell_type
+        grid_map.__build_views()
+        return grid_map
+
+    def __build_views(self):
+        # byte views for the pure python search loops, indexing bytes is much cheaper than indexing numpy arrays
+        self.blocked = self.forbidden_mask.tobytes()
+        self.refuel = (self.cell_type != FREE).tobytes()
+        self.__fingerprint = None
+        self.__forbidden_fingerprint = None
+
+    def __to_indices(self, coords: Optional[Iterable[tuple[int, int]]]) -> np.ndarray:
+        """
+        Convert a collection of (x, y) coordinates to flat indices, coordinates out of the map are dropped.
+        """
+        if not coords:
+            return np.empty(0, dtype=np.int64)
+        coords = np.asarray(list(coords), dtype=np.int64).reshape(-1, 2)
+        x, y = coords[:, 0], coords[:, 1]
+        in_map = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        return x[in_map] * self.height + y[in_map]
+
+    def index(self, pos: tuple[int, int]) -> int:
+        return pos[0] * self.height + pos[1]
+
+    def position(self, index: int) -> tuple[int, int]:
+        return divmod(index, self.height)
+
+    def manhattan(self, index: int, other: int) -> int:
+        x, y = divmod(index, self.height)
+        other_x, other_y = divmod(other, self.height)
+        return abs(x - other_x) + abs(y - other_y)
+
+    def in_bounds(self, pos: tuple[int, int]) -> bool:
+        return 0 <= pos[0] < self.width and 0 <= pos[1] < self.height
+
+    def is_passable(self, index: int) -> bool:
+        return not self.blocked[index]
+
+    def is_refuel(self, index: int) -> bool:
+        return self.refuel[index] == 1
+
+    def neighbors(self, index: int) -> list[int]:
+        """
+        Get the passable 4-connected neighbors of a cell.
+        :param index: the flat index of the cell
+        :return: the flat indices of the neighbors
+        """
+        height = self.height
+        blocked = self.blocked
+        x, y = divmod(index, height)
+        neighbor_list = []
+        if x > 0 and not blocked[index - height]:
+            neighbor_list.append(index - height)
+        if x + 1 < self.width and not blocked[index + height]:
+            neighbor_list.append(index + height)
+        if y > 0 and not blocked[index - 1]:
+            neighbor_list.append(index - 1)
+        if y + 1 < height and not blocked[index + 1]:
+            neighbor_list.append(index + 1)
+        return neighbor_list
+
+    def path_to_coords(self, indices: Iterable[int]) -> list[tuple[int, int]]:
+        height = self.height
+        return [divmod(index, height) for index in indices]
+
+    def refuel_indices(self) -> np.ndarray:
+        """
+        Get the flat indices of all the carriers, airports and tankers.
+        """
+        return np.flatnonzero(self.cell_type != FREE)
+
+    def fingerprint(self) -> str:
+        """
+        A stable hash of the map size, the forbidden mask and the cell types, used as key of the preprocessing caches.
+        """
+        if self.__fingerprint is None:
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update(np.array(self.map_size, dtype=np.int64).tobytes())
+            digest.update(np.packbits(self.forbidden_mask).tobytes())
+            digest.update(self.cell_type.tobytes())
+            self.__fingerprint = digest.hexdigest()
+        return self.__fingerprint
+
+    def forbidden_fingerprint(self) -> str:
+        """
+        A stable hash of the map size and the forbidden mask only, for tables that don't depend on the refuel points.
+        """
+        if self.__forbidden_fingerprint is None:
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update(np.array(self.map_size, dtype=np.int64).tobytes())
+            digest.update(np.packbits(self.forbidden_mask).tobytes())
+            self.__forbidden_fingerprint = digest.hexdigest()
+        return self.__forbidden_fingerprint
+
+    def distance_field(self, sources: Iterable[int], limit: Optional[int] = None) -> np.ndarray:
+        """
+        Grid distance from the nearest source to every cell, ignoring fuel.
+        The whole frontier is advanced at once with array operations, one step per distance layer.
+        :param sources: the flat indices of the sources
+        :param limit: stop after this distance, farther cells are left unreachable
+        :return: int32 distances indexed by cell, -1 for unreachable cells
+        """
+        width, height = self.map_size
+        distance = np.full(self.size, -1, dtype=np.int32)
+        distance[self.forbidden_mask] = -2  # never entered, reset to unreachable at the end
+        frontier = np.unique(np.asarray(list(sources), dtype=np.int64))
+        frontier = frontier[distance[frontier] == -1]
+        distance[frontier] = 0
+        step = 0
+        while frontier.size and (limit is None or step < limit):
+            step += 1
+            x = frontier // height
+            y = frontier - x * height
+            candidates = np.concatenate((frontier[x > 0] - height, frontier[x < width - 1] + height,
+                                         frontier[y > 0] - 1, frontier[y < height - 1] + 1))
+            frontier = np.unique(candidates[distance[candidates] == -1])
+            distance[frontier] = step
+        distance[self.forbidden_mask] = -1
+        return distance
+
+
+def route_length(path: list[tuple[int, int]]) -> float:
+    """
+    The length of a route in pixels, counted like len(path) on 4-connected routes: the first cell counts 1, every
+    straight step 1 and every diagonal step sqrt(2), so the routes of the 8-connected JPS aren't under-reported.
+    """
+    length = 1 if path else 0
+    for (x, y), (next_x, next_y) in zip(path, path[1:]):
+        length += math.sqrt(2) if x != next_x and y != next_y else 1
+    return length
@@ -0,0 +1,147 @@
+import heapq
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from algo.cancellation import CancellationToken
+from algo.grid_map import GridMap
+from algo.station_graph import station_matrix
+from algo.wavefront import LAYER_CHECK_MASK
+
+# goal distance tables of the most recent destinations, keyed by (forbidden mask fingerprint, goal index)
+GOAL_TABLE_CACHE_SIZE = 16
+goal_table_cache: OrderedDict[tuple[str, int], array] = OrderedDict()
+# detour and station distance tables of the most recent destinations, keyed by (map fingerprint, goal index, max hop)
+# since they also depend on the refuel points and the fuel range
+detour_table_cache: OrderedDict[tuple[str, int, Optional[int]], tuple[array, array]] = OrderedDict()
+cache_lock = threading.Lock()
+
+
+def goal_distance_table(grid_map: GridMap, goal_pos: tuple[int, int]) -> array:
+    """
+    Exact obstacle-aware distance from every cell to the goal, ignoring fuel.
+    It is computed with one reverse sweep from the goal and is a perfect consistent heuristic for A* when fuel
+    doesn't force a detour. Tables only depend on the forbidden mask, so they are shared by scenarios that only
+    differ in their refuel points.
+    :param grid_map: the grid map
+    :param goal_pos: the destination
+    :return: distances indexed by cell, -1 where the goal can't be reached
+    """
+    key = (grid_map.forbidden_fingerprint(), grid_map.index(goal_pos))
+    with cache_lock:
+        if key in goal_table_cache:
+            goal_table_cache.move_to_end(key)
+            return goal_table_cache[key]
+
+    table = array('i', grid_map.distance_field([grid_map.index(goal_pos)]).tobytes())
+    with cache_lock:
+        goal_table_cache[key] = table
+        if len(goal_table_cache) > GOAL_TABLE_CACHE_SIZE:
+            goal_table_cache.popitem(last=False)
+    return table
+
+
+def station_goal_distances(grid_map: GridMap, goal_pos: tuple[int, int], max_hop: Optional[int],
+                           token: Optional[CancellationToken] = None) -> Optional[np.ndarray]:
+    """
+    Length of the shortest fuel-feasible route from every refuel station to the goal, leaving on a full tank.
+    Such a route is a chain of hops between stations that fit in one tank, then a last hop to the goal, so it is
+    found by Dijkstra from the goal on the station graph.
+    :param token: checked between two station fields of the station matrix
+    :return: the lengths in the order of grid_map.refuel_indices(), -1 where the goal can't be reached, None if
+    stopped by the token
+    """
+    station_graph = station_matrix(grid_map, max_hop, token)
+    if station_graph is None:
+        return None
+    stations, matrix = station_graph
+    goal_distance = np.frombuffer(goal_distance_table(grid_map, goal_pos), dtype=np.int32)[stations].tolist()
+    adjacency = matrix.tolist()
+    lengths = [-1] * len(stations)
+    priority_queue = [(distance, i) for i, distance in enumerate(goal_distance)
+                      if distance >= 0 and (max_hop is None or distance <= max_hop)]
+    heapq.heapify(priority_queue)
+    while priority_queue:
+        length, current = heapq.heappop(priority_queue)
+        if lengths[current] != -1:
+            continue
+        lengths[current] = length
+        for neighbor, hop in enumerate(adjacency[current]):
+            if hop > 0 and lengths[neighbor] == -1:
+                heapq.heappush(priority_queue, (length + hop, neighbor))
+    return np.array(lengths, dtype=np.int32)
+
+
+def detour_tables(grid_map: GridMap, goal_pos: tuple[int, int], max_hop: Optional[int],
+                  token: Optional[CancellationToken] = None) -> Optional[tuple[array, array]]:
+    """
+    Lower bounds for a route that can't reach the goal on the fuel it has left, and so must stop first at a refuel
+    station other than the goal, one from which the goal can be reached.
+    The detour distance of a cell is the smallest distance to such a station, ignoring fuel, plus the fuel-feasible
+    length from that station to the goal. It is computed with one wavefront from all the stations, each station
+    joining it once the wavefront reaches its length to the goal. The station distance of a cell is the distance to
+    the nearest such station, the least fuel range needed to go on.
+    :param grid_map: the grid map
+    :param goal_pos: the destination
+    :param max_hop: the longest distance that can be flown between two refuels, see max_hop_length()
+    :param token: checked between two station fields and every LAYER_CHECK_MASK + 1 layers of the wavefront, stopped
+    tables are not cached
+    :return: the detour distances and the station distances indexed by cell, -1 where no such station can be reached,
+    None if stopped by the token
+    """
+    goal = grid_map.index(goal_pos)
+    key = (grid_map.fingerprint(), goal, max_hop)
+    with cache_lock:
+        if key in detour_table_cache:
+            detour_table_cache.move_to_end(key)
+            return detour_table_cache[key]
+
+    width, height = grid_map.map_size
+    stations = grid_map.refuel_indices()
+    offsets = station_goal_distances(grid_map, goal_pos, max_hop, token)
+    if offsets is None:
+        return None
+    usable = (stations != goal) & (offsets >= 0)
+    stations, offsets = stations[usable], offsets[usable]
+    station_distance = grid_map.distance_field(stations.tolist())
+    order = np.argsort(offsets, kind='stable')
+    stations, offsets = stations[order], offsets[order]
+    distance = np.full(grid_map.size, -1, dtype=np.int32)
+    distance[grid_map.forbidden_mask] = -2  # never entered, reset to unreachable at the end
+    frontier = np.empty(0, dtype=np.int64)
+    joined = 0
+    step = int(offsets[0]) if stations.size else 0
+    while True:
+        # the stations whose goal distance is the current step join the wavefront
+        joining_end = int(np.searchsorted(offsets, step, side='right'))
+        joining = stations[joined:joining_end].astype(np.int64)
+        joined = joining_end
+        joining = joining[distance[joining] == -1]
+        distance[joining] = step
+        frontier = np.concatenate((frontier, joining))
+        if not frontier.size:
+            if joined == stations.size:
+                break
+            step = int(offsets[joined])
+            continue
+        step += 1
+        if token is not None and not step & LAYER_CHECK_MASK and \
+                token.checkpoint(joined, frontier.size, step, -1):
+            return None
+        x = frontier // height
+        y = frontier - x * height
+        candidates = np.concatenate((frontier[x > 0] - height, frontier[x < width - 1] + height,
+                                     frontier[y > 0] - 1, frontier[y < height - 1] + 1))
+        frontier = np.unique(candidates[distance[candidates] == -1])
+        distance[frontier] = step
+    distance[grid_map.forbidden_mask] = -1
+
+    tables = array('i', distance.tobytes()), array('i', station_distance.tobytes())
+    with cache_lock:
+        detour_table_cache[key] = tables
+        if len(detour_table_cache) > GOAL_TABLE_CACHE_SIZE:
+            detour_table_cache.popitem(last=False)
+    return tables
@@ -0,0 +1,414 @@
+import hashlib
+import heapq
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from algo.astar import astar
+from algo.cancellation import CancellationToken
+from algo.grid_map import GridMap
+from algo.heuristics import goal_distance_table
+
+# side length of a cluster, in cells
+CLUSTER_SIZE = 32
+# an entrance at least this long gets a transition at each end instead of one in the middle
+ENTRANCE_SPLIT = 6
+# routes up to this long are compared with a direct grid search, fixed transitions make the largest detours on short
+# routes
+LOCAL_ROUTE_LENGTH = 4 * CLUSTER_SIZE
+# the abstract search looks at the token once every this many labels, a label costs far more than a grid expansion
+ABSTRACT_CHECK_MASK = 255
+# the side of the cluster an exit leads out of, in the order of the offsets -height, height, -1, 1
+LEFT, RIGHT, UP, DOWN = range(4)
+
+# cluster data keyed by the content of the cluster, so an edit only invalidates the clusters it touches
+# and identical clusters (open sea, a fully forbidden block...) share one entry
+CLUSTER_CACHE_SIZE = 16384
+cluster_cache: OrderedDict[str, 'Cluster'] = OrderedDict()
+# abstract graphs of the most recent maps, keyed by map fingerprint
+ABSTRACT_GRAPH_CACHE_SIZE = 8
+abstract_graph_cache: OrderedDict[str, 'AbstractGraph'] = OrderedDict()
+cache_lock = threading.Lock()
+
+
+class Cluster:
+    """
+    The part of the abstract graph inside one CLUSTER_SIZE x CLUSTER_SIZE block, in cell indices local to the block
+    (x * CLUSTER_SIZE + y). The nodes are the transitions to the neighbor blocks and the refuel stations of the block.
+    """
+
+    def __init__(self, nodes: np.ndarray, exits: list[tuple[int, int]], distances: np.ndarray):
+        self.nodes = nodes  # local indices of the nodes
+        self.exits = exits  # (node, side) of every transition, the node is linked to the cell across that side
+        self.distances = distances  # int32 grid distances between the nodes inside the block, -1 if unreachable
+
+
+class AbstractGraph:
+    """
+    The graph of transitions and stations of a whole map, with grid distances as edge lengths.
+    """
+
+    def __init__(self, cells: list[int], adjacency: list[list[tuple[int, int]]], clusters_built: int):
+        self.cells = cells  # flat index of each node
+        self.node_index = {cell: node for node, cell in enumerate(cells)}
+        self.adjacency = adjacency  # (neighbor, length) of each node
+        self.clusters_built = clusters_built  # clusters that missed the cache when the graph was built
+
+
+def block_distances(free: np.ndarray, sources: list[tuple[int, int]]) -> np.ndarray:
+    """
+    Grid distances inside a block from each source, all the sources are advanced together one layer at a time.
+    :param free: the passable cells of the block
+    :param sources: the (x, y) positions of the sources in the block
+    :return: int32 distances indexed by source, x and y, -1 for unreachable cells
+    """
+    count = len(sources)
+    distance = np.full((count,) + free.shape, -1, dtype=np.int32)
+    frontier = np.zeros((count,) + free.shape, dtype=bool)
+    for i, (x, y) in enumerate(sources):
+        frontier[i, x, y] = True
+    distance[frontier] = 0
+    reached = frontier.copy()
+    step = 0
+    while frontier.any():
+        step += 1
+        grown = np.zeros_like(frontier)
+        grown[:, 1:, :] |= frontier[:, :-1, :]
+        grown[:, :-1, :] |= frontier[:, 1:, :]
+        grown[:, :, 1:] |= frontier[:, :, :-1]
+        grown[:, :, :-1] |= frontier[:, :, 1:]
+        grown &= free
+        grown &= ~reached
+        reached |= grown
+        distance[grown] = step
+        frontier = grown
+    return distance
+
+
+def transitions(inside: np.ndarray, outside: np.ndarray) -> list[int]:
+    """
+    The positions along a side of a block where the route may cross it.
+    :param inside: the passable cells along the side, inside the block
+    :param outside: the passable cells along the side, across it
+    """
+    crossing = np.concatenate(([False], inside & outside, [False]))
+    changes = np.flatnonzero(crossing[1:] != crossing[:-1])
+    positions = []
+    for begin, end in zip(changes[::2], changes[1::2]):
+        if end - begin >= ENTRANCE_SPLIT:
+            positions += [begin, end - 1]
+        else:
+            positions.append((begin + end - 1) // 2)
+    return positions
+
+
+def build_cluster(window: np.ndarray, refuel: np.ndarray) -> Cluster:
+    """
+    Find the transitions and the stations of a block and the distances between them.
+    :param window: the passable cells of the block with a one-cell ring around it, cells out of the map are blocked
+    :param refuel: the refuel stations of the block
+    """
+    free = window[1:-1, 1:-1]
+    size = free.shape[0]
+    exits = []
+    for position in transitions(free[0], window[0, 1:-1]):
+        exits.append((position, LEFT))
+    for position in transitions(free[-1], window[-1, 1:-1]):
+        exits.append(((size - 1) * size + position, RIGHT))
+    for position in transitions(free[:, 0], window[1:-1, 0]):
+        exits.append((position * size, UP))
+    for position in transitions(free[:, -1], window[1:-1, -1]):
+        exits.append((position * size + size - 1, DOWN))
+    stations = np.flatnonzero((refuel & free).ravel())
+    nodes = np.unique(np.concatenate((np.array([cell for cell, _ in exits], dtype=np.int64), stations)))
+    node_slot = {int(cell): slot for slot, cell in enumerate(nodes)}
+    exits = [(node_slot[cell], side) for cell, side in exits]
+    if len(nodes):
+        distance = block_distances(free, [divmod(int(cell), size) for cell in nodes])
+        distances = distance[:, nodes // size, nodes % size]
+    else:
+        distances = np.empty((0, 0), dtype=np.int32)
+    return Cluster(nodes, exits, distances)
+
+
+def cluster_windows(grid_map: GridMap) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The passable mask padded to whole blocks and a ring of blocked cells, and the refuel mask padded to whole blocks.
+    """
+    width, height = grid_map.map_size
+    columns = -(-width // CLUSTER_SIZE)
+    rows = -(-height // CLUSTER_SIZE)
+    passable = np.zeros((columns * CLUSTER_SIZE + 2, rows * CLUSTER_SIZE + 2), dtype=bool)
+    passable[1:width + 1, 1:height + 1] = ~grid_map.forbidden_mask.reshape(width, height)
+    refuel = np.zeros((columns * CLUSTER_SIZE, rows * CLUSTER_SIZE), dtype=bool)
+    refuel[:width, :height] = grid_map.cell_type.reshape(width, height) != 0
+    return passable, refuel
+
+
+def cluster_key(window: np.ndarray, refuel: np.ndarray) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.packbits(window).tobytes())
+    digest.update(np.packbits(refuel).tobytes())
+    return digest.hexdigest()
+
+
+def abstract_graph(grid_map: GridMap, token: Optional[CancellationToken] = None) -> Optional[AbstractGraph]:
+    """
+    The abstract graph of a map, built from the cached clusters. Only the clusters whose block or ring changed since
+    they were last seen are computed again.
+    :param token: checked between two clusters, a stopped build is not cached
+    :return: the abstract graph, None if stopped by the token
+    """
+    key = grid_map.fingerprint()
+    with cache_lock:
+        if key in abstract_graph_cache:
+            abstract_graph_cache.move_to_end(key)
+            return abstract_graph_cache[key]
+
+    height = grid_map.height
+    passable, refuel = cluster_windows(grid_map)
+    columns, rows = refuel.shape[0] // CLUSTER_SIZE, refuel.shape[1] // CLUSTER_SIZE
+    offsets = (-height, height, -1, 1)
+    cells = []
+    node_index = {}
+    edges = []
+    clusters_built = 0
+    for cluster_x in range(columns):
+        for cluster_y in range(rows):
+            origin_x, origin_y = cluster_x * CLUSTER_SIZE, cluster_y * CLUSTER_SIZE
+            if token is not None and token.checkpoint(cluster_x * rows + cluster_y, columns * rows, -1, -1):
+                return None
+            window = passable[origin_x:origin_x + CLUSTER_SIZE + 2, origin_y:origin_y + CLUSTER_SIZE + 2]
+            block_refuel = refuel[origin_x:origin_x + CLUSTER_SIZE, origin_y:origin_y + CLUSTER_SIZE]
+            key_of_cluster = cluster_key(window, block_refuel)
+            with cache_lock:
+                cluster = cluster_cache.get(key_of_cluster)
+                if cluster is not None:
+                    cluster_cache.move_to_end(key_of_cluster)
+            if cluster is None:
+                cluster = build_cluster(window, block_refuel)
+                clusters_built += 1
+                with cache_lock:
+                    cluster_cache[key_of_cluster] = cluster
+                    if len(cluster_cache) > CLUSTER_CACHE_SIZE:
+                        cluster_cache.popitem(last=False)
+
+            # the nodes are always inside the map, the padding is blocked
+            x, y = np.divmod(cluster.nodes, CLUSTER_SIZE)
+            global_nodes = []
+            for cell in ((x + origin_x) * height + y + origin_y).tolist():
+                if cell not in node_index:
+                    node_index[cell] = len(cells)
+                    cells.append(cell)
+                global_nodes.append(node_index[cell])
+            distances = cluster.distances.tolist()
+            for i, row in enumerate(distances):
+                for j in range(i + 1, len(row)):
+                    if row[j] > 0:
+                        edges.append((global_nodes[i], global_nodes[j], row[j]))
+            for slot, side in cluster.exits:
+                # the block across finds the same transition from the same two lines of cells,
+                # so each crossing is only linked from the block on its left or above it
+                if side == LEFT or side == UP:
+                    continue
+                cell = cells[global_nodes[slot]]
+                across = cell + offsets[side]
+                if across not in node_index:
+                    node_index[across] = len(cells)
+                    cells.append(across)
+                edges.append((global_nodes[slot], node_index[across], 1))
+
+    adjacency = [[] for _ in cells]
+    for source, target, length in edges:
+        adjacency[source].append((target, length))
+        adjacency[target].append((source, length))
+    graph = AbstractGraph(cells, adjacency, clusters_built)
+    with cache_lock:
+        abstract_graph_cache[key] = graph
+        if len(abstract_graph_cache) > ABSTRACT_GRAPH_CACHE_SIZE:
+            abstract_graph_cache.popitem(last=False)
+    return graph
+
+
+def block_of(grid_map: GridMap, cell: int) -> tuple[int, int, np.ndarray]:
+    """
+    The origin and the passable cells of the block containing a cell.
+    """
+    x, y = grid_map.position(cell)
+    origin_x, origin_y = x - x % CLUSTER_SIZE, y - y % CLUSTER_SIZE
+    free = ~grid_map.forbidden_mask.reshape(grid_map.map_size)[origin_x:origin_x + CLUSTER_SIZE,
+                                                                origin_y:origin_y + CLUSTER_SIZE]
+    return origin_x, origin_y, free
+
+
+def local_links(grid_map: GridMap, node_index: dict[int, int], cell: int) -> list[tuple[int, int]]:
+    """
+    Link a cell that is not a node of the abstract graph to the nodes of its block.
+    :param node_index: the node of each cell of the abstract graph
+    :return: the (node, length) of every node of the block reachable from the cell inside the block
+    """
+    origin_x, origin_y, free = block_of(grid_map, cell)
+    x, y = grid_map.position(cell)
+    distance = block_distances(free, [(x - origin_x, y - origin_y)])[0]
+    links = []
+    for local_x, local_y in zip(*np.nonzero(distance > 0)):
+        node = node_index.get(grid_map.index((int(local_x) + origin_x, int(local_y) + origin_y)))
+        if node is not None:
+            links.append((node, int(distance[local_x, local_y])))
+    return links
+
+
+def refine_leg(grid_map: GridMap, source: int, target: int) -> list[int]:
+    """
+    Expand an edge of the abstract graph back to cells, inside the block of its two ends.
+    :return: the flat indices of the cells from source to target
+    """
+    if grid_map.manhattan(source, target) == 1:
+        return [source, target]
+    origin_x, origin_y, free = block_of(grid_map, target)
+    target_x, target_y = grid_map.position(target)
+    distance = block_distances(free, [(target_x - origin_x, target_y - origin_y)])[0]
+    leg = [source]
+    x, y = grid_map.position(source)
+    x, y = x - origin_x, y - origin_y
+    while distance[x, y] > 0:
+        for next_x, next_y in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+            if 0 <= next_x < free.shape[0] and 0 <= next_y < free.shape[1] and \
+                    distance[next_x, next_y] == distance[x, y] - 1:
+                x, y = next_x, next_y
+                break
+        leg.append(grid_map.index((x + origin_x, y + origin_y)))
+    return leg
+
+
+def trace_labels(cells: list[int], labels_node: list[int], labels_parent: list[int], label: int) -> list[int]:
+    """
+    :return: the flat indices of the nodes from the start to the node of the label
+    """
+    route = []
+    while label != -1:
+        route.append(cells[labels_node[label]])
+        label = labels_parent[label]
+    route.reverse()
+    return route
+
+
+def refine_route(grid_map: GridMap, route: list[int]) -> list[int]:
+    """
+    Expand a route of the abstract graph back to cells.
+    """
+    path = route[:1]
+    for source, target in zip(route, route[1:]):
+        path += refine_leg(grid_map, source, target)[1:]
+    return path
+
+
+def hierarchical_search(map_grid: GridMap, start_pos, end_pos, fuel_cost, max_fuel,
+                        token: Optional[CancellationToken] = None):
+    """
+    HPA*: the map is cut into blocks, and the route is searched on the abstract graph of the transitions between
+    blocks and of the refuel stations, before only the chosen edges are expanded back to cells inside their block.
+    The route crosses blocks at fixed transitions, so it can be noticeably longer than the shortest one, by a few
+    percent on average and far more on routes that pass close to a block corner. A start and an end in one block are
+    also linked inside it, and a route up to LOCAL_ROUTE_LENGTH long is replaced by the A* route if that one is
+    shorter, which removes the worst detours of short routes. Each edge is no longer than its expansion and fuel is
+    only refilled at the stations on the abstract route, so the route always has enough fuel. If the abstract graph
+    has no route, the search falls back to A* on the full map.
+    :param token: stops the search when cancelled or past its deadline, the partial route then leads to the node
+    closest to the end
+    :return: the path from start_pos to end_pos, or an empty list if no path found
+    """
+    start = map_grid.index(start_pos)
+    end = map_grid.index(end_pos)
+    if map_grid.blocked[start] or map_grid.blocked[end]:
+        return []
+    graph = abstract_graph(map_grid, token)
+    if graph is None:
+        return []
+
+    # the start and the end are linked to the nodes of their block if they are not nodes themselves
+    cells = graph.cells
+    extra_cells = [cell for cell in (start, end) if cell not in graph.node_index]
+    extra_links: dict[int, list[tuple[int, int]]] = {}
+    node_index = dict(graph.node_index) if extra_cells else graph.node_index
+    if extra_cells:
+        cells = cells + extra_cells
+        for cell in extra_cells:
+            node_index[cell] = len(node_index)
+        for cell in extra_cells:
+            for node, length in local_links(map_grid, graph.node_index, cell):
+                extra_links.setdefault(node_index[cell], []).append((node, length))
+                extra_links.setdefault(node, []).append((node_index[cell], length))
+    start_node = node_index[start]
+    end_node = node_index[end]
+    # a start and an end in one block are also linked inside it, nodes or not
+    origin_x, origin_y, free = block_of(map_grid, start)
+    if start != end and block_of(map_grid, end)[:2] == (origin_x, origin_y):
+        end_x, end_y = map_grid.position(end)
+        start_x, start_y = map_grid.position(start)
+        length = int(block_distances(free, [(start_x - origin_x, start_y - origin_y)])[0][end_x - origin_x,
+                                                                                         end_y - origin_y])
+        if length > 0:
+            extra_links.setdefault(start_node, []).append((end_node, length))
+    refuel = map_grid.refuel
+
+    # label-setting Dijkstra over (node, fuel) on the abstract graph, as in algo.dijkstra with weighted edges:
+    # labels are popped in non-decreasing distance, so a label with no more fuel than one popped before is dominated
+    labels_node = [start_node]
+    labels_parent = [-1]
+    popped_fuel = [-1] * len(cells)
+    priority_queue = [(0, -max_fuel, 0)]
+    found = -1
+    popped = 0
+    # the popped label closest to the end, for the partial route of a stopped search
+    closest = 0
+    closest_distance = map_grid.manhattan(start, end)
+    while priority_queue:
+        popped += 1
+        if token is not None and not popped & ABSTRACT_CHECK_MASK and \
+                token.checkpoint(popped, len(priority_queue), priority_queue[0][0], closest_distance):
+            token.partial_path = map_grid.path_to_coords(refine_route(map_grid, trace_labels(cells, labels_node,
+                                                                                             labels_parent, closest)))
+            return []
+        distance, negative_fuel, label = heapq.heappop(priority_queue)
+        node = labels_node[label]
+        if -negative_fuel <= popped_fuel[node]:
+            continue
+        popped_fuel[node] = -negative_fuel
+        if node == end_node:
+            found = label
+            break
+        if map_grid.manhattan(cells[node], end) < closest_distance:
+            closest = label
+            closest_distance = map_grid.manhattan(cells[node], end)
+        neighbors = graph.adjacency[node] if node < len(graph.adjacency) else []
+        for neighbor, length in neighbors + extra_links.get(node, []):
+            fuel = -negative_fuel - length * fuel_cost
+            if fuel < 0:
+                continue
+            if refuel[cells[neighbor]]:
+                fuel = max_fuel
+            if fuel <= popped_fuel[neighbor]:
+                continue
+            labels_node.append(neighbor)
+            labels_parent.append(label)
+            heapq.heappush(priority_queue, (distance + length, -fuel, len(labels_node) - 1))
+
+    if found == -1:
+        print("Hierarchical search found no abstract route, falling back to A*")
+        return astar(max_fuel, fuel_cost, set(), [], [], start_pos, end_pos, map_grid.map_size, map_grid,
+                     goal_distance_table(map_grid, end_pos), token)
+
+    path = refine_route(map_grid, trace_labels(cells, labels_node, labels_parent, found))
+    if len(path) - 1 <= LOCAL_ROUTE_LENGTH:
+        # the shortest route is no longer than this one, so A* only looks at a small part of the map
+        local = astar(max_fuel, fuel_cost, set(), [], [], start_pos, end_pos, map_grid.map_size, map_grid,
+                      token=token)
+        if local and len(local) < len(path):
+            print("Hierarchical search finished" "path lenth: ", len(local), "local A* route")
+            return local
+    print("Hierarchical search finished" "path lenth: ", len(path), "abstract nodes: ", len(graph.cells),
+          "clusters built: ", graph.clusters_built)
+    return map_grid.path_to_coords(path)
@@ -0,0 +1,290 @@
+import heapq
+import threading
+from typing import Optional
+
+import numpy as np
+
+from algo.cancellation import CancellationToken
+from algo.grid_map import GridMap, FREE
+from algo.station_graph import max_hop_length
+
+INFINITY = float('inf')
+
+
+class IncrementalPlanner:
+    """
+    Lifelong Planning A* (LPA*) on the refuel station graph, kept alive between searches.
+    The nodes of the graph are the refuel stations, the start and the destination, an edge is a hop that fits in one
+    tank. The planner remembers the distance field of every node, the map they were computed on and the LPA* state.
+    When the map is edited, only the fields that can see a changed cell are recomputed, and LPA* repairs the previous
+    route from the edges whose length changed instead of searching again from scratch.
+    """
+
+    def __init__(self, rebuild_ratio: float = 0.05):
+        self.rebuild_ratio = rebuild_ratio  # start over when more than this share of the cells changed
+        self.map_size = None
+        self.max_hop = None
+        self.forbidden_mask: Optional[np.ndarray] = None
+        self.station_mask: Optional[np.ndarray] = None
+        self.fields: dict[int, np.ndarray] = {}  # distance field of each node cell, bounded by the max hop
+        self.fields_computed = 0  # number of fields computed by the last plan
+
+        # the station graph, removed nodes stay in the lists with all their edges cut
+        self.nodes: list[int] = []
+        self.node_index: dict[int, int] = {}
+        self.weights: list[list[float]] = []
+        self.start = -1
+        self.end = -1
+        self.start_node = -1
+        self.end_node = -1
+
+        # LPA* state
+        self.g: list[float] = []
+        self.rhs: list[float] = []
+        self.h: list[int] = []
+        self.open_list: list[tuple[tuple[float, float], int]] = []
+        self.open_key: dict[int, tuple[float, float]] = {}
+
+    def plan(self, grid_map: GridMap, start: int, end: int, fuel_cost: int, max_fuel: int,
+             token: Optional[CancellationToken] = None) -> Optional[list[int]]:
+        """
+        Find the shortest route on the given map, reusing the state left by the previous plan.
+        :param token: checked between two distance fields, a stopped plan leaves the planner to start over next time
+        :return: the flat indices of the cells from start to end, None if no path found or stopped by the token
+        """
+        if grid_map.blocked[start] or grid_map.blocked[end]:
+            return None
+        self.fields_computed = 0
+        max_hop = max_hop_length(fuel_cost, max_fuel)
+        station_mask = grid_map.cell_type != FREE
+
+        changed = None
+        if self.map_size == grid_map.map_size and self.max_hop == max_hop:
+            changed = np.flatnonzero((self.forbidden_mask != grid_map.forbidden_mask) |
+                                     (self.station_mask != station_mask))
+            if changed.size > self.rebuild_ratio * grid_map.size:
+                changed = None
+        wanted = set(grid_map.refuel_indices().tolist())
+        wanted.update((start, end))
+        if changed is None:
+            self.fields.clear()
+            repaired = set()
+        else:
+            self.fields = {cell: field for cell, field in self.fields.items() if cell in wanted}
+            repaired = self.repair_fields(grid_map, changed, token)
+            if repaired is None:
+                self.map_size = None
+                return None
+        self.map_size = grid_map.map_size
+        self.max_hop = max_hop
+        self.forbidden_mask = grid_map.forbidden_mask.copy()
+        self.station_mask = station_mask
+        for cell in wanted:
+            if cell not in self.fields:
+                if token is not None and \
+                        token.checkpoint(self.fields_computed, len(wanted) - len(self.fields), -1, -1):
+                    # the graph no longer matches the fields, start over next time
+                    self.map_size = None
+                    return None
+                self.fields[cell] = grid_map.distance_field([cell], max_hop)
+                self.fields_computed += 1
+
+        if changed is None or start != self.start or end != self.end:
+            self.reset_search(wanted, start, end)
+        else:
+            self.update_graph(wanted, repaired)
+        self.compute_shortest_path()
+        return self.route(grid_map)
+
+    def repair_fields(self, grid_map: GridMap, changed: np.ndarray,
+                      token: Optional[CancellationToken] = None) -> Optional[set[int]]:
+        """
+        Recompute the distance fields that can see a changed cell.
+        A field is stale if it reaches a cell that is now forbidden, or if it can step into a cell that is no longer
+        forbidden. Stations that come and go don't change any field, only the set of nodes.
+        :return: the cells whose field was recomputed, None if stopped by the token
+        """
+        width, height = grid_map.map_size
+        now_forbidden = changed[grid_map.forbidden_mask[changed]]
+        opened = changed[self.forbidden_mask[changed] & ~grid_map.forbidden_mask[changed]]
+        x = opened // height
+        y = opened - x * height
+        around_opened = np.concatenate((opened[x > 0] - height, opened[x < width - 1] + height,
+                                        opened[y > 0] - 1, opened[y < height - 1] + 1))
+        repaired = set()
+        for cell, field in self.fields.items():
+            stale = (field[now_forbidden] >= 0).any()
+            if not stale and around_opened.size:
+                distances = field[around_opened]
+                reached = distances >= 0
+                if self.max_hop is not None:
+                    reached &= distances < self.max_hop
+                stale = reached.any()
+            if stale:
+                if token is not None and \
+                        token.checkpoint(self.fields_computed, len(self.fields) - len(repaired), -1, -1):
+                    return None
+                self.fields[cell] = grid_map.distance_field([cell], self.max_hop)
+                self.fields_computed += 1
+                repaired.add(cell)
+        return repaired
+
+    def edge_weights(self, cell: int) -> list[float]:
+        """
+        The length of the hops from a node to every node of the graph, removed nodes can't be reached.
+        """
+        distances = self.fields[cell][self.nodes].tolist()
+        node_index = self.node_index
+        return [distance if distance > 0 and node_index.get(self.nodes[node]) == node else INFINITY
+                for node, distance in enumerate(distances)]
+
+    def reset_search(self, wanted: set[int], start: int, end: int):
+        self.nodes = sorted(wanted)
+        self.node_index = {cell: node for node, cell in enumerate(self.nodes)}
+        self.weights = [self.edge_weights(cell) for cell in self.nodes]
+        self.start, self.end = start, end
+        self.start_node = self.node_index[start]
+        self.end_node = self.node_index[end]
+        height = self.map_size[1]
+        end_x, end_y = divmod(end, height)
+        self.h = [abs(cell // height - end_x) + abs(cell % height - end_y) for cell in self.nodes]
+        self.g = [INFINITY] * len(self.nodes)
+        self.rhs = [INFINITY] * len(self.nodes)
+        self.rhs[self.start_node] = 0
+        self.open_list = []
+        self.open_key = {}
+        self.push(self.start_node)
+
+    def update_graph(self, wanted: set[int], repaired: set[int]):
+        """
+        Apply the edits of the map to the station graph and mark the nodes whose edges changed.
+        """
+        touched = set()
+        for node, cell in enumerate(self.nodes):
+            if cell not in wanted and self.node_index.get(cell) == node:
+                # the station was removed, cut all its edges
+                for other, weight in enumerate(self.weights[node]):
+                    if weight != INFINITY:
+                        self.weights[other][node] = INFINITY
+                        touched.add(other)
+                self.weights[node] = [INFINITY] * len(self.nodes)
+                touched.add(node)
+        self.node_index = {cell: node for cell, node in self.node_index.items() if cell in wanted}
+
+        height = self.map_size[1]
+        end_x, end_y = divmod(self.end, height)
+        for cell in wanted:
+            if cell in self.node_index:
+                continue
+            node = len(self.nodes)
+            self.nodes.append(cell)
+            self.node_index[cell] = node
+            for row in self.weights:
+                row.append(INFINITY)
+            self.weights.append([INFINITY] * len(self.nodes))
+            self.h.append(abs(cell // height - end_x) + abs(cell % height - end_y))
+            self.g.append(INFINITY)
+            self.rhs.append(INFINITY)
+            repaired.add(cell)
+
+        for cell in repaired:
+            node = self.node_index[cell]
+            weights = self.edge_weights(cell)
+            for other, weight in enumerate(weights):
+                if self.weights[node][other] != weight:
+                    self.weights[node][other] = weight
+                    self.weights[other][node] = weight
+                    touched.add(node)
+                    touched.add(other)
+        for node in touched:
+            self.update_vertex(node)
+
+    def calculate_key(self, node: int) -> tuple[float, float]:
+        distance = min(self.g[node], self.rhs[node])
+        return distance + self.h[node], distance
+
+    def push(self, node: int):
+        key = self.calculate_key(node)
+        self.open_key[node] = key
+        heapq.heappush(self.open_list, (key, node))
+
+    def top_key(self) -> tuple[float, float]:
+        # entries whose node was queued again or became consistent are skipped lazily
+        while self.open_list and self.open_key.get(self.open_list[0][1]) != self.open_list[0][0]:
+            heapq.heappop(self.open_list)
+        return self.open_list[0][0] if self.open_list else (INFINITY, INFINITY)
+
+    def update_vertex(self, node: int):
+        if node != self.start_node:
+            best = INFINITY
+            g = self.g
+            for other, weight in enumerate(self.weights[node]):
+                if weight != INFINITY and g[other] + weight < best:
+                    best = g[other] + weight
+            self.rhs[node] = best
+        if self.g[node] != self.rhs[node]:
+            self.push(node)
+        else:
+            self.open_key.pop(node, None)
+
+    def compute_shortest_path(self):
+        end_node = self.end_node
+        while self.top_key() < self.calculate_key(end_node) or self.rhs[end_node] != self.g[end_node]:
+            if not self.open_list:
+                break
+            _, node = heapq.heappop(self.open_list)
+            del self.open_key[node]
+            if self.g[node] > self.rhs[node]:
+                self.g[node] = self.rhs[node]
+            else:
+                self.g[node] = INFINITY
+                self.update_vertex(node)
+            for other, weight in enumerate(self.weights[node]):
+                if weight != INFINITY:
+                    self.update_vertex(other)
+
+    def route(self, grid_map: GridMap) -> Optional[list[int]]:
+        if self.g[self.end_node] == INFINITY:
+            return None
+        hops = [self.end_node]
+        current = self.end_node
+        while current != self.start_node:
+            weights = self.weights[current]
+            current = min((node for node in range(len(self.nodes)) if weights[node] != INFINITY),
+                          key=lambda node: self.g[node] + weights[node])
+            hops.append(current)
+        hops.reverse()
+
+        path = [self.start]
+        for source, target in zip(hops, hops[1:]):
+            # walk down the distance field of the target
+            field = self.fields[self.nodes[target]]
+            current = self.nodes[source]
+            while current != self.nodes[target]:
+                for neighbor in grid_map.neighbors(current):
+                    if field[neighbor] == field[current] - 1:
+                        current = neighbor
+                        break
+                path.append(current)
+        return path
+
+
+# the planner of the last scenario, every run repairs the state left by the previous one
+incremental_planner = IncrementalPlanner()
+incremental_planner_lock = threading.Lock()
+
+
+def incremental_search(map_grid: GridMap, start_pos, end_pos, fuel_cost, max_fuel,
+                       token: Optional[CancellationToken] = None):
+    """
+    Incremental search on the station graph, fast when the map changed little since the previous search.
+    :return: the path from start_pos to end_pos, or an empty list if no path found
+    """
+    with incremental_planner_lock:
+        path = incremental_planner.plan(map_grid, map_grid.index(start_pos), map_grid.index(end_pos), fuel_cost,
+                                        max_fuel, token)
+        fields_computed = incremental_planner.fields_computed
+    if path is None:
+        return []
+    print("Incremental finished" "path lenth: ", len(path), "fields computed: ", fields_computed)
+    return map_grid.path_to_coords(path)
@@ -0,0 +1,218 @@
+import heapq
+import math
+from array import array
+from typing import Optional
+
+from algo.cancellation import CancellationToken, closest_route
+from algo.grid_map import GridMap
+
+SQRT2 = math.sqrt(2)
+STRAIGHT_DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+DIAGONAL_DIRECTIONS = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+# every expansion scans whole runs, so the token is checked more often than in the other searches
+JUMP_CHECK_MASK = 15
+# a single scan can cross most of the map, so the scans also check the token once every this many cells
+SCAN_CHECK_MASK = 1023
+
+
+class JumpPointSearch:
+    """
+    Jump Point Search on a uniform-cost grid.
+    Straight runs of equal-cost cells are skipped by scanning, and only cells where the optimal route may turn
+    (jump points) are put into the open list. Carriers, airports, tankers and the destination are always jump points,
+    so the fuel is refilled exactly where the plain grid search would refill it.
+    With diagonal moves, a diagonal step costs sqrt(2) in distance and fuel and may not cut obstacle corners.
+    """
+
+    def __init__(self, grid_map: GridMap, end: int, fuel_cost, diagonal: bool = False,
+                 token: Optional[CancellationToken] = None):
+        self.grid_map = grid_map
+        self.width, self.height = grid_map.map_size
+        self.blocked = grid_map.blocked
+        self.refuel = grid_map.refuel
+        self.end = end
+        self.fuel_cost = fuel_cost
+        self.diagonal = diagonal
+        self.token = token
+        self.scanned = 0  # cells scanned by all the jumps so far
+        self.stopped = False  # set once the token stops the search, every scan then gives up
+
+    def walkable(self, x: int, y: int) -> bool:
+        return 0 <= x < self.width and 0 <= y < self.height and not self.blocked[x * self.height + y]
+
+    def is_target(self, x: int, y: int) -> bool:
+        index = x * self.height + y
+        return index == self.end or self.refuel[index] == 1
+
+    def jump(self, x: int, y: int, dx: int, dy: int, fuel) -> Optional[tuple[int, int, float]]:
+        """
+        Scan from (x, y) in direction (dx, dy) until a jump point is found.
+        :param fuel: the fuel left at (x, y), the scan stops when it can't cover another step
+        :return: the jump point and the distance to it, None if the scan hits an obstacle, runs out of fuel or the
+        search is stopped
+        """
+        walkable = self.walkable
+        step_cost = SQRT2 if dx and dy else 1
+        step_fuel = step_cost * self.fuel_cost
+        distance = 0
+        while True:
+            self.scanned += 1
+            if not self.scanned & SCAN_CHECK_MASK and self.token is not None and self.token.should_stop():
+                self.stopped = True
+            if self.stopped:
+                return None
+            if dx and dy and not (walkable(x + dx, y) and walkable(x, y + dy)):
+                # no corner cutting
+                return None
+            x += dx
+            y += dy
+            fuel -= step_fuel
+            distance += step_cost
+            if fuel < 0 or not walkable(x, y):
+                return None
+            if self.is_target(x, y):
+                return x, y, distance
+            if dx and dy:
+                if self.jump(x, y, dx, 0, fuel) is not None or self.jump(x, y, 0, dy, fuel) is not None:
+                    return x, y, distance
+            elif dx:
+                if (walkable(x, y - 1) and not walkable(x - dx, y - 1)) or \
+                        (walkable(x, y + 1) and not walkable(x - dx, y + 1)):
+                    return x, y, distance
+            else:
+                if (walkable(x - 1, y) and not walkable(x - 1, y - dy)) or \
+                        (walkable(x + 1, y) and not walkable(x + 1, y - dy)):
+                    return x, y, distance
+                if not self.diagonal:
+                    # in the 4-connected grid, vertical runs must look for horizontal jump points
+                    if self.jump(x, y, 1, 0, fuel) is not None or self.jump(x, y, -1, 0, fuel) is not None:
+                        return x, y, distance
+
+    def directions(self, x: int, y: int, dx: int, dy: int) -> list[tuple[int, int]]:
+        """
+        The directions worth scanning from a jump point reached by moving in direction (dx, dy).
+        A zero direction means the point is the start or a refuel point, every direction is scanned from there.
+        """
+        if dx == 0 and dy == 0:
+            if self.diagonal:
+                return list(STRAIGHT_DIRECTIONS + DIAGONAL_DIRECTIONS)
+            return list(STRAIGHT_DIRECTIONS)
+        if not self.diagonal:
+            if dx:
+                return [(dx, 0), (0, 1), (0, -1)]
+            return [(0, dy), (1, 0), (-1, 0)]
+        if dx and dy:
+            return [(dx, 0), (0, dy), (dx, dy)]
+        if dx:
+            return [(dx, 0), (dx, 1), (dx, -1), (0, 1), (0, -1)]
+        return [(0, dy), (1, dy), (-1, dy), (1, 0), (-1, 0)]
+
+    def heuristic(self, x: int, y: int, end_x: int, end_y: int) -> float:
+        delta_x, delta_y = abs(x - end_x), abs(y - end_y)
+        if self.diagonal:
+            return max(delta_x, delta_y) + (SQRT2 - 1) * min(delta_x, delta_y)
+        return delta_x + delta_y
+
+
+def sign(value: int) -> int:
+    return (value > 0) - (value < 0)
+
+
+def fill_runs(jump_points: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """
+    Fill the straight and diagonal runs between consecutive jump points.
+    """
+    path = jump_points[:1]
+    for (x, y), (next_x, next_y) in zip(jump_points, jump_points[1:]):
+        dx, dy = sign(next_x - x), sign(next_y - y)
+        while (x, y) != (next_x, next_y):
+            x += dx
+            y += dy
+            path.append((x, y))
+    return path
+
+
+def jps_search(map_grid: GridMap, start_pos, end_pos, fuel_cost, max_fuel, diagonal: bool = False,
+               token: Optional[CancellationToken] = None):
+    """
+    Fuel-aware Jump Point Search.
+    :param map_grid: the grid map
+    :param start_pos: the start position
+    :param end_pos: the end position
+    :param fuel_cost: the fuel cost per pixel
+    :param max_fuel: the fuel capacity, refilled at carriers, airports and tankers
+    :param diagonal: allow 8-connected moves
+    :param token: stops the search when cancelled or past its deadline
+    :return: the path from start_pos to end_pos, or an empty list if no path found
+    """
+    height = map_grid.height
+    start = map_grid.index(start_pos)
+    end = map_grid.index(end_pos)
+    end_x, end_y = end_pos
+    search = JumpPointSearch(map_grid, end, fuel_cost, diagonal, token)
+
+    # jump point labels, the frontier holds label indices and the route is rebuilt from the parent pointers
+    label_cell = array('l', [start])
+    label_cost = array('d', [0])
+    label_fuel = array('d', [max_fuel])
+    label_parent = array('l', [-1])
+    expanded_fuel = {}  # most fuel left among the labels expanded at each jump point
+    frontier = [(search.heuristic(start_pos[0], start_pos[1], end_x, end_y), 0, 0)]
+
+    end_label = -1
+    expanded = 0
+    popped = 0
+    while frontier:
+        popped += 1
+        if search.stopped or not popped & JUMP_CHECK_MASK and token is not None and \
+                token.checkpoint(expanded, len(frontier), frontier[0][0],
+                                 map_grid.manhattan(label_cell[frontier[0][2]], end)):
+            token.partial_path = fill_runs(map_grid.path_to_coords(closest_route(map_grid, label_cell, label_parent,
+                                                                                 end)))
+            return []
+        _, negative_cost, label = heapq.heappop(frontier)
+        current = label_cell[label]
+        current_fuel = label_fuel[label]
+        if current_fuel <= expanded_fuel.get(current, -1):
+            continue
+        expanded_fuel[current] = current_fuel
+        expanded += 1
+        if current == end:
+            end_label = label
+            break
+
+        x, y = divmod(current, height)
+        parent = label_parent[label]
+        if parent == -1 or map_grid.refuel[current]:
+            dx, dy = 0, 0
+        else:
+            parent_x, parent_y = divmod(label_cell[parent], height)
+            dx, dy = sign(x - parent_x), sign(y - parent_y)
+        for direction_x, direction_y in search.directions(x, y, dx, dy):
+            jump_point = search.jump(x, y, direction_x, direction_y, current_fuel)
+            if jump_point is None:
+                continue
+            jump_x, jump_y, distance = jump_point
+            next_node = jump_x * height + jump_y
+            new_fuel = max_fuel if map_grid.refuel[next_node] else current_fuel - distance * fuel_cost
+            if new_fuel <= expanded_fuel.get(next_node, -1):
+                continue
+            new_cost = label_cost[label] + distance
+            label_cell.append(next_node)
+            label_cost.append(new_cost)
+            label_fuel.append(new_fuel)
+            label_parent.append(label)
+            new_priority = new_cost + search.heuristic(jump_x, jump_y, end_x, end_y)
+            heapq.heappush(frontier, (new_priority, -new_cost, len(label_cell) - 1))
+
+    if end_label == -1:
+        return []
+
+    jump_points = []
+    while end_label != -1:
+        jump_points.append(divmod(label_cell[end_label], height))
+        end_label = label_parent[end_label]
+    jump_points.reverse()
+    path = fill_runs(jump_points)
+    print("JPS finished" "path lenth: ", len(path), "expanded: ", expanded)
+    return path
@@ -0,0 +1,115 @@
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from algo.cancellation import CancellationToken
+from algo.grid_map import GridMap
+
+# landmarks chosen per forbidden mask
+LANDMARK_COUNT = 8
+# distances are stored as uint16, longer ones are clipped, which keeps the bounds admissible
+UNREACHABLE = np.iinfo(np.uint16).max
+MAX_STORED_DISTANCE = UNREACHABLE - 1
+
+# landmark planes of the most recent forbidden masks, keyed by forbidden mask fingerprint
+LANDMARK_CACHE_SIZE = 4
+landmark_cache: OrderedDict[str, 'Landmarks'] = OrderedDict()
+cache_lock = threading.Lock()
+
+
+class Landmarks:
+    """
+    The distance planes of a few landmark cells, for the ALT (A*, landmarks, triangle inequality) lower bound
+    |d(L, cell) - d(L, goal)| <= d(cell, goal).
+    They only depend on the forbidden mask, so every pair of positions on the same map shares them, whatever the
+    refuel points.
+    """
+
+    def __init__(self, cells: list[int], planes: np.ndarray):
+        self.cells = cells  # flat indices of the landmarks
+        self.planes = planes  # uint16 (landmark, cell) distances, UNREACHABLE where a cell can't be reached
+
+
+def landmark_planes(grid_map: GridMap, count: int = LANDMARK_COUNT,
+                    token: Optional[CancellationToken] = None) -> Optional[Landmarks]:
+    """
+    The landmarks of the forbidden mask, chosen by farthest-point sampling: the first one is the free cell farthest
+    from the free cell nearest the center of the map, each next one the cell farthest from all those chosen so far.
+    Landmarks on the edges of the free space give the tightest bounds, the way the outermost airports would, but
+    don't change when the airports do. All of them lie in the component of the first free cell, other components
+    get no landmark bound.
+    :param token: checked between two landmark planes, stopped planes are not cached
+    :return: the landmarks, None if stopped by the token
+    """
+    key = grid_map.forbidden_fingerprint()
+    with cache_lock:
+        if key in landmark_cache:
+            landmark_cache.move_to_end(key)
+            return landmark_cache[key]
+
+    width, height = grid_map.map_size
+    free = np.flatnonzero(~grid_map.forbidden_mask)
+    if not free.size:
+        landmarks = Landmarks([], np.empty((0, grid_map.size), dtype=np.uint16))
+    else:
+        x, y = free // height, free % height
+        seed = int(free[np.argmin(np.abs(2 * x - width) + np.abs(2 * y - height))])
+        # distance from the nearest chosen landmark, -1 outside the component
+        nearest = grid_map.distance_field([seed])
+        cells = []
+        planes = []
+        while len(cells) < count:
+            if token is not None and token.checkpoint(len(cells), count - len(cells), -1, -1):
+                return None
+            cell = int(np.argmax(nearest))
+            if nearest[cell] <= 0:
+                # fewer cells than landmarks
+                break
+            plane = grid_map.distance_field([cell])
+            cells.append(cell)
+            planes.append(np.where(plane >= 0, np.minimum(plane, MAX_STORED_DISTANCE),
+                                   UNREACHABLE).astype(np.uint16))
+            nearest = np.minimum(nearest, plane)
+        landmarks = Landmarks(cells, np.stack(planes) if planes else np.empty((0, grid_map.size), dtype=np.uint16))
+
+    with cache_lock:
+        landmark_cache[key] = landmarks
+        if len(landmark_cache) > LANDMARK_CACHE_SIZE:
+            landmark_cache.popitem(last=False)
+    return landmarks
+
+
+def landmark_heuristic_table(grid_map: GridMap, goal_pos: tuple[int, int],
+                             token: Optional[CancellationToken] = None) -> Optional[array]:
+    """
+    Per-cell lower bounds of the distance to the goal, the largest of the Manhattan distance and the landmark bounds.
+    The bounds of all the cells are computed at once from the landmark planes, which takes a few array passes
+    instead of the reverse sweep of goal_distance_table(), so a new destination is cheap. Both bounds are
+    consistent, and so is their maximum.
+    :param token: checked while the landmark planes are computed
+    :return: the bounds indexed by cell, -1 where a landmark shows the goal can't be reached, like
+    goal_distance_table(), None if stopped by the token
+    """
+    height = grid_map.height
+    landmarks = landmark_planes(grid_map, token=token)
+    if landmarks is None:
+        return None
+    goal = grid_map.index(goal_pos)
+    cells = np.arange(grid_map.size, dtype=np.int32)
+    x = cells // height
+    bound = np.abs(x - goal_pos[0]) + np.abs(cells - x * height - goal_pos[1])
+    unreachable = np.zeros(grid_map.size, dtype=bool)
+    for plane in landmarks.planes:
+        goal_distance = int(plane[goal])
+        reached = plane != UNREACHABLE
+        if goal_distance == UNREACHABLE:
+            # the landmark is cut off from the goal, so is every cell it reaches
+            unreachable |= reached
+            continue
+        unreachable |= ~reached
+        np.maximum(bound, np.abs(plane.astype(np.int32) - goal_distance), out=bound)
+    bound[unreachable] = -1
+    return array('i', bound.astype(np.int32).tobytes())
@@ -0,0 +1,232 @@
+import queue
+import threading
+import time
+import multiprocessing
+from typing import Callable, Optional, Union
+
+from airway_genius_gui.globals import AlgoType
+from algo.algo_brain import route_cache, run_search, search_key
+from algo.astar import ANYTIME_TIME_BUDGET
+from algo.cancellation import CancellationToken, COMPLETED, CANCELLED, TIMED_OUT
+from algo.feasibility import precheck, FEASIBLE
+from algo.grid_map import GridMap
+from algo.progress import SearchProgress, RouteImprovement
+
+# the algorithms compared in the "All" modes, in the order of the comparison table
+ALL_ALGORITHMS = (AlgoType.DIJKSTRA, AlgoType.ASTAR, AlgoType.BFS, AlgoType.DFS)
+# algorithms that keep their state between searches in their own module have to run in the calling process
+IN_PROCESS_ALGORITHMS = (AlgoType.INCREMENTAL,)
+DEFAULT_TIMEOUT = 60.0  # seconds
+# how long a worker may take to notice its deadline or the cancellation before the pool is killed
+GRACE_PERIOD = 5.0  # seconds
+POLL_INTERVAL = 0.02  # seconds
+# forked workers would inherit the locks of the GUI and of the threads running at that moment, spawned ones start clean
+START_METHOD = 'spawn'
+
+# status of an algorithm result, besides the ones of algo.cancellation
+FAILED = 'failed'
+INFEASIBLE = 'infeasible'  # rejected before searching, the path is the reason code of algo.feasibility
+
+# the cancellation event and the progress queue of the pool, inherited by every worker process
+worker_cancel_event = None
+worker_progress_queue = None
+
+
+def init_worker(cancel_event, progress_queue):
+    global worker_cancel_event, worker_progress_queue
+    worker_cancel_event = cancel_event
+    worker_progress_queue = progress_queue
+
+
+def search_task(grid_map: GridMap,
+                max_fuel: int,
+                fuel_cost: int,
+                cur_algorithm: AlgoType,
+                carrier_airport_list: list[tuple[int, int]],
+                tanker_list: list[tuple[int, int]],
+                start_pos: tuple[int, int],
+                end_pos: tuple[int, int],
+                anytime_budget: Optional[float],
+                deadline: Optional[float],
+                report_progress: bool = False,
+                cancel_event=None,
+                progress: Optional[Callable[[Union[SearchProgress, RouteImprovement]], None]] = None) \
+        -> tuple[list, float, str, list]:
+    """
+    Run one search in a worker process.
+    The grid map is sent instead of the forbidden set, its numpy planes pickle much smaller than a set of tuples.
+    :param anytime_budget: seconds the anytime search keeps improving its route once it has one, None for no limit
+    :param report_progress: send the progress snapshots and the route improvements of the search through the
+    progress queue of the pool
+    :param cancel_event: the cancellation event when the search runs in the calling process
+    :param progress: the progress callback when the search runs in the calling process
+    :return: the path, the search time, the status and the partial path of a stopped search
+    """
+    if progress is None and report_progress:
+        progress = lambda report: worker_progress_queue.put((cur_algorithm, report))
+    token = CancellationToken(cancel_event if cancel_event is not None else worker_cancel_event, deadline, progress,
+                              improvement=progress)
+    search_start = time.time()
+    # the algorithms only read the forbidden set when they have to build the map themselves
+    path = run_search(grid_map, max_fuel, fuel_cost, cur_algorithm, set(), carrier_airport_list, tanker_list,
+                      start_pos, end_pos, grid_map.map_size, token, anytime_budget)
+    return path, time.time() - search_start, token.status, token.partial_path
+
+
+class SearchBackend:
+    """
+    Runs searches in a pool of worker processes, so they don't share the GIL with the GUI or with each other.
+    Every algorithm has its own deadline, and each result is handed over as soon as it is ready. Searches are stopped
+    cooperatively through a cancellation event shared with the workers, so the pool is kept between searches and
+    the workers keep their preprocessing caches. The pool is only killed if a worker misses its deadline by more than
+    the grace period, and is started again on demand.
+    """
+
+    def __init__(self, processes: int = len(ALL_ALGORITHMS)):
+        self.processes = processes
+        self.pool = None
+        self.lock = threading.Lock()
+        self.context = multiprocessing.get_context(START_METHOD)
+        self.cancel_event = self.context.Event()
+        self.progress_queue = self.context.Queue()
+
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = self.context.Pool(self.processes, initializer=init_worker,
+                                              initargs=(self.cancel_event, self.progress_queue))
+            return self.pool
+
+    def terminate(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool.join()
+                self.pool = None
+
+    def cancel(self):
+        """
+        Ask the running search to stop, the searches return their partial results within a few milliseconds.
+        """
+        self.cancel_event.set()
+
+    def run(self,
+            max_fuel: int,
+            fuel_cost: int,
+            algorithms: tuple[AlgoType, ...],
+            forbidden_area: set[tuple[int, int]],
+            carrier_airport_list: list[tuple[int, int]],
+            tanker_list: list[tuple[int, int]],
+            start_pos: tuple[int, int],
+            end_pos: tuple[int, int],
+            map_size: tuple[int, int],
+            on_result: Callable[[AlgoType, list, float, str, list], None],
+            timeout: float = DEFAULT_TIMEOUT,
+            on_progress: Optional[Callable[[AlgoType, SearchProgress], None]] = None,
+            on_improvement: Optional[Callable[[AlgoType, RouteImprovement], None]] = None,
+            anytime_budget: Optional[float] = ANYTIME_TIME_BUDGET) -> bool:
+        """
+        Run the algorithms in parallel, the route cache is looked up here before anything is sent to the workers.
+        :param on_result: called with the algorithm, its path, its search time, its status and its partial path
+        as each one finishes
+        :param timeout: the longest time an algorithm may run, in seconds
+        :param on_progress: called with the algorithm and a snapshot of its progress a few times per second
+        :param on_improvement: called with the algorithm and each better route of an anytime search, before its
+        final result
+        :param anytime_budget: seconds the anytime search keeps improving its route once it has one, None for no limit
+        :return: False if the search was cancelled
+        """
+        # the event is cleared when a search is over rather than when the next one starts, a Stop pressed while a
+        # search is starting would be lost otherwise
+        try:
+            self.drain_progress(None, None)
+            report_progress = on_progress is not None or on_improvement is not None
+            grid_map = GridMap(map_size, forbidden_area, carrier_airport_list, tanker_list)
+            # only the 8-connected search is checked differently
+            reasons = {diagonal: precheck(grid_map, start_pos, end_pos, fuel_cost, max_fuel, diagonal)
+                       for diagonal in {algorithm == AlgoType.JPS_DIAGONAL for algorithm in algorithms}}
+            pending = {}
+            for algorithm in algorithms:
+                reason = reasons[algorithm == AlgoType.JPS_DIAGONAL]
+                if reason != FEASIBLE:
+                    on_result(algorithm, [reason], 0, INFEASIBLE, [])
+                    continue
+                key = search_key(algorithm, grid_map, start_pos, end_pos, fuel_cost, max_fuel, anytime_budget)
+                cached = route_cache.get(key)
+                task = (grid_map, max_fuel, fuel_cost, algorithm, carrier_airport_list, tanker_list, start_pos, end_pos,
+                        anytime_budget, time.time() + timeout, report_progress)
+                if cached is not None:
+                    on_result(algorithm, cached[0], cached[1], COMPLETED, [])
+                elif algorithm in IN_PROCESS_ALGORITHMS:
+                    progress = None
+                    if report_progress:
+                        progress = lambda report: self.dispatch_progress(algorithm, report, on_progress, on_improvement)
+                    result = search_task(*task, self.cancel_event, progress)
+                    if result[2] == COMPLETED:
+                        route_cache.put(key, result[0], result[1])
+                    on_result(algorithm, *result)
+                else:
+                    pending[algorithm] = (self.get_pool().apply_async(search_task, task), key, task[-2])
+
+            killed = False
+            cancel_time = None
+            while pending:
+                if cancel_time is None and self.cancel_event.is_set():
+                    cancel_time = time.time()
+                self.drain_progress(on_progress, on_improvement)
+                for algorithm, (async_result, key, deadline) in list(pending.items()):
+                    if async_result.ready():
+                        del pending[algorithm]
+                        # the reports sent just before the result may still be on their way
+                        self.drain_progress(on_progress, on_improvement)
+                        try:
+                            result = async_result.get()
+                        except Exception as e:
+                            print("search failed:", algorithm.value, repr(e))
+                            on_result(algorithm, [], 0, FAILED, [])
+                            continue
+                        if result[2] == COMPLETED:
+                            route_cache.put(key, result[0], result[1])
+                        on_result(algorithm, *result)
+                    elif time.time() > min(deadline, cancel_time or deadline) + GRACE_PERIOD:
+                        # the worker is stuck in code that doesn't check the token, it can only be stopped by killing it
+                        del pending[algorithm]
+                        killed = True
+                        status = CANCELLED if self.cancel_event.is_set() else TIMED_OUT
+                        on_result(algorithm, [], timeout, status, [])
+                time.sleep(POLL_INTERVAL)
+
+            if killed:
+                self.terminate()
+            cancelled = self.cancel_event.is_set()
+        finally:
+            self.cancel_event.clear()
+        return not cancelled
+
+    def drain_progress(self,
+                       on_progress: Optional[Callable[[AlgoType, SearchProgress], None]],
+                       on_improvement: Optional[Callable[[AlgoType, RouteImprovement], None]]):
+        """
+        Hand the reports sent by the workers to the callbacks, or drop them if there is none.
+        """
+        while True:
+            try:
+                algorithm, report = self.progress_queue.get_nowait()
+            except queue.Empty:
+                return
+            self.dispatch_progress(algorithm, report, on_progress, on_improvement)
+
+    @staticmethod
+    def dispatch_progress(algorithm: AlgoType,
+                          report: Union[SearchProgress, RouteImprovement],
+                          on_progress: Optional[Callable[[AlgoType, SearchProgress], None]],
+                          on_improvement: Optional[Callable[[AlgoType, RouteImprovement], None]]):
+        if isinstance(report, RouteImprovement):
+            if on_improvement is not None:
+                on_improvement(algorithm, report)
+        elif on_progress is not None:
+            on_progress(algorithm, report)
+
+
+# shared by every calculation thread of the GUI
+search_backend = SearchBackend()
@@ -0,0 +1,142 @@
+import heapq
+
+# an item is packed with its key in one integer as key << ITEM_BITS | item, the items are label indices
+ITEM_BITS = 32
+ITEM_MASK = (1 << ITEM_BITS) - 1
+
+
+class BucketQueue:
+    """
+    Dial's bucket queue, for small non-negative integer keys that never go below the last popped key, like the
+    distances of a unit-cost Dijkstra or the f-values of A* with a consistent heuristic.
+    Bucket k holds the items of key k and a cursor moves forward to the first bucket that isn't empty, so push and
+    pop are O(1) amortized. Within a bucket the item pushed last is popped first.
+    """
+    __slots__ = ('buckets', 'cursor', 'size')
+
+    def __init__(self, key: int, item: int):
+        self.buckets: list[list[int]] = [[] for _ in range(key + 1)]
+        self.buckets[key].append(item)
+        self.cursor = key
+        self.size = 1
+
+    def __len__(self):
+        return self.size
+
+    def push(self, key: int, item: int):
+        buckets = self.buckets
+        if key >= len(buckets):
+            buckets.extend([] for _ in range(key + 1 - len(buckets)))
+        buckets[key].append(item)
+        self.size += 1
+
+    def pop(self) -> tuple[int, int]:
+        key = self.cursor
+        bucket = self.buckets[key]
+        while not bucket:
+            key += 1
+            bucket = self.buckets[key]
+        self.cursor = key
+        self.size -= 1
+        return key, bucket.pop()
+
+    def peek(self) -> tuple[int, int]:
+        key = self.cursor
+        while not self.buckets[key]:
+            key += 1
+        self.cursor = key
+        return key, self.buckets[key][-1]
+
+
+class RadixHeap:
+    """
+    Radix heap of packed integers, for non-negative integer keys that never go below the last popped key but span
+    too wide a range for one bucket per key, like the packed (distance, turns) costs of the advanced Dijkstra.
+    Bucket b holds the keys whose highest bit differing from the last popped key is bit b - 1, bucket 0 the keys
+    equal to it. When bucket 0 runs empty, the first bucket that isn't is spread again around its smallest key, so
+    every item moves down at most once per bit of the key. Ties on the key are broken by the item pushed last.
+    """
+    __slots__ = ('buckets', 'last', 'size')
+
+    def __init__(self, key: int, item: int):
+        self.buckets: list[list[int]] = [[key << ITEM_BITS | item]]
+        self.last = key
+        self.size = 1
+
+    def __len__(self):
+        return self.size
+
+    def push(self, key: int, item: int):
+        buckets = self.buckets
+        bucket = (key ^ self.last).bit_length()
+        if bucket >= len(buckets):
+            buckets.extend([] for _ in range(bucket + 1 - len(buckets)))
+        buckets[bucket].append(key << ITEM_BITS | item)
+        self.size += 1
+
+    def pop(self) -> tuple[int, int]:
+        buckets = self.buckets
+        if not buckets[0]:
+            self.redistribute()
+        self.size -= 1
+        packed = buckets[0].pop()
+        return packed >> ITEM_BITS, packed & ITEM_MASK
+
+    def peek(self) -> tuple[int, int]:
+        if not self.buckets[0]:
+            self.redistribute()
+        packed = self.buckets[0][-1]
+        return packed >> ITEM_BITS, packed & ITEM_MASK
+
+    def redistribute(self):
+        buckets = self.buckets
+        bucket = 1
+        while not buckets[bucket]:
+            bucket += 1
+        spread = buckets[bucket]
+        buckets[bucket] = []
+        last = self.last = min(spread) >> ITEM_BITS
+        for packed in spread:
+            buckets[((packed >> ITEM_BITS) ^ last).bit_length()].append(packed)
+
+
+class TieBucketQueue:
+    """
+    Bucket queue like BucketQueue, with ties on the key broken by an integer tie value, the smaller first, then by
+    the smaller item. Each bucket is a binary heap of the tie values packed with the items; it only holds the
+    items of one key, so it stays a few levels deep and is ordered on plain integers.
+    """
+    __slots__ = ('buckets', 'cursor', 'size')
+
+    def __init__(self, key: int, tie: int, item: int):
+        self.buckets: list[list[int]] = [[] for _ in range(key + 1)]
+        self.buckets[key].append(tie << ITEM_BITS | item)
+        self.cursor = key
+        self.size = 1
+
+    def __len__(self):
+        return self.size
+
+    def push(self, key: int, tie: int, item: int):
+        buckets = self.buckets
+        if key >= len(buckets):
+            buckets.extend([] for _ in range(key + 1 - len(buckets)))
+        heapq.heappush(buckets[key], tie << ITEM_BITS | item)
+        self.size += 1
+
+    def pop(self) -> tuple[int, int]:
+        key = self.cursor
+        bucket = self.buckets[key]
+        while not bucket:
+            key += 1
+            bucket = self.buckets[key]
+        self.cursor = key
+        self.size -= 1
+        return key, heapq.heappop(bucket) & ITEM_MASK
+
+    def peek(self) -> tuple[int, int]:
+        key = self.cursor
+        while not self.buckets[key]:
+            key += 1
+        self.cursor = key
+        return key, self.buckets[key][0] & ITEM_MASK
@@ -0,0 +1,29 @@
+class SearchProgress:
+    """
+    Snapshot of a running search, reported at a throttled rate through the progress callback of its token.
+    """
+
+    def __init__(self, expanded: int, frontier: int, best_f: float, goal_distance: int, elapsed: float):
+        self.expanded = expanded  # nodes expanded so far
+        self.frontier = frontier  # nodes waiting in the open list, queue or stack
+        self.best_f = best_f  # the smallest priority in the frontier, -1 if the search has none
+        self.goal_distance = goal_distance  # Manhattan distance from the next node to the destination, -1 if none
+        self.elapsed = elapsed  # seconds since the search started
+
+    def __repr__(self):
+        return (f"SearchProgress(expanded={self.expanded}, frontier={self.frontier}, best_f={self.best_f}, "
+                f"goal_distance={self.goal_distance}, elapsed={self.elapsed:.2f})")
+
+
+class RouteImprovement:
+    """
+    A route found by an anytime search before it finishes, reported through the improvement callback of its token.
+    """
+
+    def __init__(self, path: list[tuple[int, int]], bound: float, elapsed: float):
+        self.path = path
+        self.bound = bound  # the route is at most this many times longer than the shortest one
+        self.elapsed = elapsed  # seconds since the search started
+
+    def __repr__(self):
+        return f"RouteImprovement(length={len(self.path)}, bound={self.bound:.3f}, elapsed={self.elapsed:.2f})"
@@ -0,0 +1,90 @@
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from algo.grid_map import GridMap
+
+
+def route_key(algorithm_name: str,
+              grid_map: GridMap,
+              start_pos: tuple[int, int],
+              end_pos: tuple[int, int],
+              fuel_cost: int,
+              max_fuel: int) -> str:
+    """
+    A stable hash of everything a search result depends on.
+    The map fingerprint covers the map size, the forbidden mask and the refuel points.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((algorithm_name, grid_map.fingerprint(), tuple(start_pos), tuple(end_pos), fuel_cost,
+                        max_fuel)).encode())
+    return digest.hexdigest()
+
+
+def result_points(result: Any) -> int:
+    """
+    Count the path points held by a search result, used as the memory weight of a cache entry.
+    """
+    if isinstance(result, (list, tuple)):
+        if result and isinstance(result[0], tuple) and len(result[0]) == 2 and isinstance(result[0][0], int):
+            return len(result)
+        return sum(result_points(item) for item in result)
+    return 0
+
+
+class RouteCache:
+    """
+    Bounded LRU cache of search results.
+    The least recently used entries are evicted once either the number of entries or the total number of path points
+    held goes over its limit. Entries store the result with the time the search took, and hit/miss statistics are kept.
+    """
+
+    def __init__(self, max_entries: int = 64, max_points: int = 1_000_000):
+        self.max_entries = max_entries
+        self.max_points = max_points
+        self.entries: OrderedDict[str, tuple[Any, float, int]] = OrderedDict()
+        self.points = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[tuple[Any, float]]:
+        """
+        :return: a copy of the cached result and the time the search took, None on a miss
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            result, elapsed, _ = entry
+        return copy.deepcopy(result), elapsed
+
+    def put(self, key: str, result: Any, elapsed: float):
+        points = result_points(result)
+        if points > self.max_points:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.points -= self.entries.pop(key)[2]
+            self.entries[key] = (copy.deepcopy(result), elapsed, points)
+            self.points += points
+            while len(self.entries) > self.max_entries or self.points > self.max_points:
+                _, (_, _, evicted_points) = self.entries.popitem(last=False)
+                self.points -= evicted_points
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.points = 0
+
+    def stats(self) -> dict[str, int]:
+        with self.lock:
+            return {'entries': len(self.entries), 'points': self.points, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions}
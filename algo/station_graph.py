@@ -0,0 +1,152 @@
+import heapq
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from algo.cancellation import CancellationToken
+from algo.grid_map import GridMap
+
+# station distance matrices of the most recent scenarios, keyed by (map fingerprint, max hop)
+STATION_MATRIX_CACHE_SIZE = 8
+station_matrix_cache: OrderedDict[tuple[str, Optional[int]], tuple[np.ndarray, np.ndarray]] = OrderedDict()
+cache_lock = threading.Lock()
+
+
+def max_hop_length(fuel_cost: int, max_fuel: int) -> Optional[int]:
+    """
+    The longest distance that can be flown on a full tank, None if flying costs no fuel.
+    """
+    return max_fuel // fuel_cost if fuel_cost > 0 else None
+
+
+def station_matrix(grid_map: GridMap, max_hop: Optional[int],
+                   token: Optional[CancellationToken] = None) -> Optional[tuple[np.ndarray, np.ndarray]]:
+    """
+    Grid distances between every pair of carriers, airports and tankers, computed once per scenario.
+    :param grid_map: the grid map
+    :param max_hop: the longest distance that can be flown between two refuels
+    :param token: checked between two stations, a stopped computation is not cached
+    :return: the flat indices of the stations and the distance matrix between them, -1 where a hop is out of range,
+    None if stopped by the token
+    """
+    key = (grid_map.fingerprint(), max_hop)
+    with cache_lock:
+        if key in station_matrix_cache:
+            station_matrix_cache.move_to_end(key)
+            return station_matrix_cache[key]
+
+    stations = grid_map.refuel_indices()
+    matrix = np.full((len(stations), len(stations)), -1, dtype=np.int32)
+    for i, station in enumerate(stations):
+        if token is not None and token.checkpoint(i, len(stations) - i, -1, -1):
+            return None
+        matrix[i] = grid_map.distance_field([station], max_hop)[stations]
+
+    with cache_lock:
+        station_matrix_cache[key] = (stations, matrix)
+        if len(station_matrix_cache) > STATION_MATRIX_CACHE_SIZE:
+            station_matrix_cache.popitem(last=False)
+    return stations, matrix
+
+
+def expand_leg(grid_map: GridMap, source: int, target: int, length: int) -> list[int]:
+    """
+    Expand a hop of the station graph back to pixels by walking down the distance field of the target.
+    :return: the flat indices of the cells from source to target
+    """
+    distance = grid_map.distance_field([target], length).tolist()
+    leg = [source]
+    current = source
+    while current != target:
+        for neighbor in grid_map.neighbors(current):
+            if distance[neighbor] == distance[current] - 1:
+                current = neighbor
+                break
+        leg.append(current)
+    return leg
+
+
+def station_hops(map_grid: GridMap, start: int, end: int, max_hop: Optional[int],
+                 token: Optional[CancellationToken] = None) -> Optional[list[tuple[int, int, int]]]:
+    """
+    The shortest sequence of hops between stations from start to end, each of them short enough for one tank.
+    :param token: stops the search when cancelled or past its deadline while the station matrix is computed
+    :return: the (source, target, length) of every hop, in flat indices, None if no route found or stopped
+    """
+    station_graph = station_matrix(map_grid, max_hop, token)
+    if station_graph is None:
+        return None
+    stations, matrix = station_graph
+
+    # the start and the end are normally airports or carriers, other positions are linked to the graph on demand
+    nodes = stations.tolist()
+    if start not in nodes:
+        nodes.append(start)
+    if end not in nodes:
+        nodes.append(end)
+    if len(nodes) > len(stations):
+        graph = np.full((len(nodes), len(nodes)), -1, dtype=np.int32)
+        graph[:len(stations), :len(stations)] = matrix
+        for i in range(len(stations), len(nodes)):
+            field = map_grid.distance_field([nodes[i]], max_hop)[nodes]
+            graph[i] = field
+            graph[:, i] = field
+        matrix = graph
+    start_node = nodes.index(start)
+    end_node = nodes.index(end)
+    adjacency = matrix.tolist()
+
+    # plain Dijkstra on the station graph, every station refuels so a hop only has to fit in one tank
+    distances = [float('inf')] * len(nodes)
+    previous_nodes = [-1] * len(nodes)
+    distances[start_node] = 0
+    priority_queue = [(0, start_node)]
+    while priority_queue:
+        current_distance, current = heapq.heappop(priority_queue)
+        if current == end_node:
+            break
+        if current_distance > distances[current]:
+            continue
+        for neighbor, length in enumerate(adjacency[current]):
+            if length <= 0:
+                continue
+            distance = current_distance + length
+            if distance < distances[neighbor]:
+                distances[neighbor] = distance
+                previous_nodes[neighbor] = current
+                heapq.heappush(priority_queue, (distance, neighbor))
+
+    if distances[end_node] == float('inf'):
+        return None
+
+    hops = []
+    current = end_node
+    while current != -1:
+        hops.append(current)
+        current = previous_nodes[current]
+    hops.reverse()
+    return [(nodes[source], nodes[target], adjacency[source][target]) for source, target in zip(hops, hops[1:])]
+
+
+def station_graph_search(map_grid: GridMap, start_pos, end_pos, fuel_cost, max_fuel,
+                         token: Optional[CancellationToken] = None):
+    """
+    Search on the graph of refuel stations instead of the pixel grid.
+    Every route is a sequence of hops between stations, so Dijkstra runs on a small weighted graph whose edges are
+    the hops that fit in one tank, and only the chosen hops are expanded back to pixels.
+    :param token: stops the search when cancelled or past its deadline while the station matrix is computed
+    :return: the path from start_pos to end_pos, or an empty list if no path found
+    """
+    start = map_grid.index(start_pos)
+    end = map_grid.index(end_pos)
+    hops = station_hops(map_grid, start, end, max_hop_length(fuel_cost, max_fuel), token)
+    if hops is None:
+        return []
+
+    path = [start]
+    for source, target, length in hops:
+        path += expand_leg(map_grid, source, target, length)[1:]
+    print("Station graph finished" "path lenth: ", len(path), "stations: ", len(map_grid.refuel_indices()))
+    return map_grid.path_to_coords(path)
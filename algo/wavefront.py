@@ -0,0 +1,97 @@
+from typing import Optional
+
+import numpy as np
+
+from algo.cancellation import CancellationToken
+from algo.grid_map import GridMap, FREE
+
+# the search looks at the token once every this many layers
+LAYER_CHECK_MASK = 15
+
+
+def trace_back(grid_map: GridMap, layers: list[tuple[np.ndarray, np.ndarray]], layer: int, cell: int) -> list[int]:
+    """
+    Follow the directions recorded by the wavefront back from a cell reached at the given layer.
+    :param layers: the cells improved at each layer, sorted, and the side each of them was reached from
+    :return: the flat indices of the cells from the start to the cell
+    """
+    height = grid_map.height
+    offsets = (-height, height, -1, 1)
+    route = [cell]
+    while layer > 0:
+        cells, directions = layers[layer]
+        cell -= offsets[directions[np.searchsorted(cells, cell)]]
+        route.append(cell)
+        layer -= 1
+    route.reverse()
+    return route
+
+
+def wavefront_search(map_grid: GridMap, start_pos, end_pos, fuel_cost, max_fuel,
+                     token: Optional[CancellationToken] = None):
+    """
+    Fuel-aware BFS that advances the whole frontier one layer at a time with array operations.
+    A layer holds every cell whose best remaining fuel improved at that distance. Its moves in the 4 directions are
+    generated at once, forbidden cells are masked out, refuel cells reset the fuel, and only the move with the most
+    fuel is kept for each cell, if it beats the best fuel the cell was ever reached with. Each layer records the side
+    its cells were reached from, so the route is rebuilt by walking the layers back from the destination.
+    The frontier is kept as index arrays rather than whole-map planes: the frontier of a grid search is a thin ring,
+    and shifting full planes would touch every cell on every layer.
+    :param token: stops the search when cancelled or past its deadline
+    :return: the path from start_pos to end_pos, or an empty list if no path found
+    """
+    width, height = map_grid.map_size
+    start = map_grid.index(start_pos)
+    end = map_grid.index(end_pos)
+    end_x, end_y = end_pos
+    blocked = map_grid.forbidden_mask
+    refuel = map_grid.cell_type != FREE
+    best_fuel = np.full(map_grid.size, -1, dtype=np.int32)
+    best_fuel[start] = max_fuel
+
+    cells = np.array([start], dtype=np.int64)
+    fuel = np.array([max_fuel], dtype=np.int32)
+    layers = [(cells, np.zeros(1, dtype=np.uint8))]
+    expanded = 0
+    while cells.size:
+        layer = len(layers) - 1
+        if best_fuel[end] >= 0 and np.any(cells == end):
+            route = trace_back(map_grid, layers, layer, end)
+            print("Wavefront BFS finished" "path lenth: ", len(route), "layers: ", len(layers))
+            return map_grid.path_to_coords(route)
+
+        # only cells with enough fuel for another pixel move on
+        moving = fuel >= fuel_cost
+        cells = cells[moving]
+        fuel = fuel[moving] - fuel_cost
+        expanded += cells.size
+        x = cells // height
+        y = cells - x * height
+        if token is not None and not layer & LAYER_CHECK_MASK and \
+                token.checkpoint(expanded, cells.size, layer,
+                                 int((np.abs(x - end_x) + np.abs(y - end_y)).min()) if cells.size else -1):
+            if cells.size:
+                closest = int(np.argmin(np.abs(x - end_x) + np.abs(y - end_y)))
+                token.partial_path = map_grid.path_to_coords(trace_back(map_grid, layers, layer, int(cells[closest])))
+            return []
+
+        sides = (x > 0, x < width - 1, y > 0, y < height - 1)
+        next_cells = np.concatenate((cells[sides[0]] - height, cells[sides[1]] + height,
+                                     cells[sides[2]] - 1, cells[sides[3]] + 1))
+        next_fuel = np.concatenate([fuel[side] for side in sides])
+        directions = np.repeat(np.arange(4, dtype=np.uint8), [np.count_nonzero(side) for side in sides])
+        passable = ~blocked[next_cells]
+        next_cells, next_fuel, directions = next_cells[passable], next_fuel[passable], directions[passable]
+        next_fuel = np.where(refuel[next_cells], max_fuel, next_fuel).astype(np.int32)
+        better = next_fuel > best_fuel[next_cells]
+        next_cells, next_fuel, directions = next_cells[better], next_fuel[better], directions[better]
+        # keep the move with the most fuel for each cell, the cells come out sorted for trace_back
+        order = np.lexsort((-next_fuel, next_cells))
+        next_cells, next_fuel, directions = next_cells[order], next_fuel[order], directions[order]
+        first = np.ones(next_cells.size, dtype=bool)
+        first[1:] = next_cells[1:] != next_cells[:-1]
+        cells, fuel, directions = next_cells[first], next_fuel[first], directions[first]
+        best_fuel[cells] = fuel
+        layers.append((cells, directions))
+
+    return []
@@ -0,0 +1,104 @@
+import threading
+from array import array
+from contextlib import contextmanager
+from typing import Iterator
+
+from algo.grid_map import GridMap
+
+# a stamped entry holds generation << STAMP_BITS | value, the values written by one search are below 1 << STAMP_BITS
+STAMP_BITS = 32
+# the generation after which the stamped planes are cleared, so the entries stay within 64 bits
+MAX_GENERATION = (1 << (63 - STAMP_BITS)) - 1
+# workspaces kept by each thread, one per map size
+WORKSPACE_POOL_SIZE = 2
+# the planes a pooled workspace keeps between searches, in bytes, the largest ones beyond it are released,
+# so every thread and worker process holds at most a few single planes of a 1200x800 map
+WORKSPACE_MAX_BYTES = 32 << 20
+
+# the idle workspaces of each thread, worker processes have their own
+thread_pool = threading.local()
+
+
+class SearchWorkspace:
+    """
+    Per-cell arrays of one map size, reused by the searches run one after another.
+    A stamped plane is a compact array, read on every move, that holds base + value, where base is the generation
+    of the running search shifted by STAMP_BITS. Each search takes a new base in begin(), so every entry written by an
+    earlier search reads as a negative value, i.e. unset, and only the cells a search touches are ever written.
+    A plain plane is a compact array that isn't reset at all: an entry of it must only be read where a stamped plane
+    shows that the running search wrote it.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.generation = 0
+        self.stamped_planes: dict[str, array] = {}
+        self.plain_planes: dict[str, array] = {}
+
+    def begin(self) -> int:
+        """
+        Start a search.
+        :return: the base of the search, added to the values it writes in the stamped planes
+        """
+        self.generation += 1
+        if self.generation > MAX_GENERATION:
+            for name, plane in self.stamped_planes.items():
+                self.stamped_planes[name] = array('q', [0]) * len(plane)
+            self.generation = 1
+        return self.generation << STAMP_BITS
+
+    def stamped(self, name: str, layers: int = 1) -> array:
+        """
+        :param layers: entries per cell
+        :return: the stamped plane of the name, allocated on the first use
+        """
+        if name not in self.stamped_planes:
+            # generation 0 is never used, so the zeroed plane reads as unset
+            self.stamped_planes[name] = array('q', [0]) * (self.size * layers)
+        return self.stamped_planes[name]
+
+    def plain(self, name: str) -> array:
+        """
+        :return: the plain plane of the name, allocated on the first use
+        """
+        if name not in self.plain_planes:
+            self.plain_planes[name] = array('q', [0]) * self.size
+        return self.plain_planes[name]
+
+    def trim(self, max_bytes: int):
+        """
+        Release the largest planes until the others fit in max_bytes, a released plane is allocated again by the next
+        search that uses it. A plain plane can always go, a stamped plane allocated again reads as unset.
+        """
+        planes = [(len(plane) * plane.itemsize, kind, name)
+                  for kind in (self.stamped_planes, self.plain_planes) for name, plane in kind.items()]
+        total = sum(size for size, _, _ in planes)
+        for size, kind, name in sorted(planes, key=lambda plane: plane[0], reverse=True):
+            if total <= max_bytes:
+                break
+            del kind[name]
+            total -= size
+
+
+@contextmanager
+def search_workspace(grid_map: GridMap) -> Iterator[SearchWorkspace]:
+    """
+    Lend a workspace of the map size from the pool of the running thread, so back-to-back and batch queries don't
+    allocate and fill per-cell arrays on every call. A search run while another one holds the workspace, in the same
+    thread, is lent a new one. A workspace given back is trimmed to WORKSPACE_MAX_BYTES.
+    """
+    pool: list[SearchWorkspace] = getattr(thread_pool, 'workspaces', None)
+    if pool is None:
+        pool = thread_pool.workspaces = []
+    workspace = next((idle for idle in pool if idle.size == grid_map.size), None)
+    if workspace is None:
+        workspace = SearchWorkspace(grid_map.size)
+    else:
+        pool.remove(workspace)
+    try:
+        yield workspace
+    finally:
+        workspace.trim(WORKSPACE_MAX_BYTES)
+        pool.append(workspace)
+        if len(pool) > WORKSPACE_POOL_SIZE:
+            pool.pop(0)